@@ -0,0 +1,477 @@
+"""
+Benchmark suite for the throughput and scaling of simulations.
+
+Runs a set of reproducible scenarios and reports, for each, the seconds
+taken, the simulated days per second, the agent-days per second and the
+peak memory allocated:
+
+ - attention: an AttentionSimulation of a LUCAS0 population of each size
+ - finance_model: FinanceModel expectations over growing horizons
+ - inferential: InferentialExpectations, with KS tests, over growing horizons
+ - build_population: building the LUCAS0 and WHITESHARK populations
+ - sim_stats: the statistics of simulations with long series
+ - rpc: round trips of a ClientRPCMarket to a local stand-in for AMMPS,
+   in process and over a socket, a day at a time and batched
+
+The results are written to a JSON file, which records the git commit,
+so runs on different commits can be compared:
+
+    python benchmarks/throughput.py --out before.json
+    python benchmarks/throughput.py --out after.json --compare before.json
+
+Setup, such as solving the population of a simulation, is not timed.
+Peak memory is measured with tracemalloc in a separate run of each
+scenario, so that tracing does not slow down the timed runs.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+import pandas as pd
+from HARK.ConsumptionSaving.ConsPortfolioModel import SequentialPortfolioConsumerType
+
+from sharkfin.expectations import FinanceModel, InferentialExpectations, UsualExpectations
+from sharkfin.markets import MockMarket
+from sharkfin.markets.ammps import ClientRPCMarket
+from sharkfin.markets.ammps_local import LocalAMMPSServer, QueueTransport, SocketTransport
+from sharkfin.simulation import AttentionSimulation, MarketSimulation
+from simulate.parameters import (
+    LUCAS0,
+    WHITESHARK,
+    build_population,
+    instantiate_population,
+    solve_population,
+)
+
+SCENARIOS = [
+    "attention",
+    "finance_model",
+    "inferential",
+    "build_population",
+    "sim_stats",
+    "rpc",
+]
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--scenarios", help="scenarios to run", nargs="+", default=SCENARIOS, choices=SCENARIOS
+)
+parser.add_argument(
+    "--agents", help="population sizes of the attention scenario",
+    nargs="+", type=int, default=[1000, 10000, 100000],
+)
+parser.add_argument(
+    "--horizons", help="days of the expectations scenarios",
+    nargs="+", type=int, default=[1000, 10000, 100000],
+)
+parser.add_argument(
+    "--populations", help="populations of the build_population scenario",
+    nargs="+", default=["LUCAS0", "WHITESHARK"], choices=["LUCAS0", "WHITESHARK"],
+)
+parser.add_argument(
+    "--series", help="days of the series of the sim_stats scenario",
+    nargs="+", type=int, default=[10000, 100000],
+)
+parser.add_argument("--rpc_days", help="days of the rpc scenario", type=int, default=1000)
+parser.add_argument("--quarters", help="quarters of the attention scenario", type=int, default=2)
+parser.add_argument("--days", help="days per quarter", type=int, default=60)
+parser.add_argument("--observers", help="agents observing in the inferential scenario", type=int, default=100)
+parser.add_argument("--processes", help="processes for solving populations", type=int, default=None)
+parser.add_argument("--repeat", help="timed runs of each scenario; the fastest is kept", type=int, default=1)
+parser.add_argument("--no-memory", help="skip the peak memory runs", action="store_true")
+parser.add_argument("--seed", help="random seed", type=int, default=0)
+parser.add_argument("--out", help="path of the JSON results", default="benchmark.json")
+parser.add_argument("--compare", help="path of earlier JSON results to compare with", default=None)
+
+
+def attention_scenario(solved_pop, agents, quarters, days, seed):
+    """
+    An AttentionSimulation of LUCAS0 agents with usual expectations.
+    """
+    pop = instantiate_population(solved_pop, seed=seed, num_per_type=agents)
+
+    sim = AttentionSimulation(
+        pop,
+        UsualExpectations,
+        a=0.2,
+        q=quarters,
+        r=days,
+        market=MockMarket(rng=np.random.default_rng(seed)),
+        days_per_quarter=days,
+        seed=seed,
+        fm_args={},
+    )
+
+    def run():
+        sim.simulate(burn_in=1)
+
+    return run, quarters * days, len(pop.agents)
+
+
+def finance_model_scenario(horizon, days, seed):
+    """
+    FinanceModel expectations, updated on each day of the horizon.
+    """
+    market = MockMarket(rng=np.random.default_rng(seed))
+    fm = FinanceModel(market, days_per_quarter=days, options={})
+
+    def run():
+        for day in range(horizon):
+            market.run_market()
+            fm.calculate_risky_expectations()
+            fm.risky_expectations()
+
+    return run, horizon, 1
+
+
+def inferential_scenario(horizon, days, observers, seed):
+    """
+    InferentialExpectations, updated on each day of the horizon, with a
+    panel of observers each testing the returns of a dozen past days.
+    """
+    rng = np.random.default_rng(seed)
+    market = MockMarket(rng=np.random.default_rng(seed))
+    fm = InferentialExpectations(market, days_per_quarter=days, options={"zeta": 0.5})
+
+    def run():
+        for day in range(horizon):
+            market.run_market()
+            fm.calculate_risky_expectations()
+
+            attention_days = [
+                np.sort(rng.choice(day + 1, size=min(day + 1, 12), replace=False))
+                for observer in range(observers)
+            ]
+            fm.attention_risky_expectations(attention_days)
+
+    return run, horizon, observers
+
+
+def build_population_scenario(name, processes, seed):
+    """
+    Building, that is solving and instantiating, a population.
+    """
+    parameters = {"LUCAS0": LUCAS0, "WHITESHARK": WHITESHARK}[name].copy()
+
+    def run():
+        pop = build_population(
+            SequentialPortfolioConsumerType, parameters, seed=seed, processes=processes
+        )
+        run.agents = len(pop.agents)
+
+    return run, 0, None
+
+
+def sim_stats_scenario(series, days, seed):
+    """
+    The statistics of a MarketSimulation whose market has a long series.
+    """
+    sim = MarketSimulation(
+        q=max(1, series // days),
+        r=days,
+        market=MockMarket(rng=np.random.default_rng(seed)),
+        days_per_quarter=days,
+    )
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim.simulate()
+
+    def run():
+        sim.sim_stats()
+
+    return run, len(sim.market.prices) - 1, 0
+
+
+def rpc_scenario(transport, batched, days, seed):
+    """
+    A ClientRPCMarket run for a number of days by a LocalAMMPS,
+    in this process or over a socket to a server in a background thread.
+    """
+    if transport == "socket":
+        server = LocalAMMPSServer()
+        server.serve_in_thread()
+
+        market_transport = SocketTransport(*server.server_address)
+    else:
+        server = None
+        market_transport = QueueTransport()
+
+    market = ClientRPCMarket(
+        rng=np.random.default_rng(seed), transport=market_transport, batched=batched
+    )
+
+    def run():
+        if batched:
+            market.run_market_batch([(0, 0)] * days)
+        else:
+            for day in range(days):
+                market.run_market()
+
+        market.close_market()
+
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    return run, days, 0
+
+
+def measure(make, repeat, memory):
+    """
+    Times the run made by make, and measures its peak memory.
+
+    Parameters
+    ----------
+
+    make: a function returning the run, a function of no arguments,
+        and the simulated days and agents of the run
+
+    repeat: int - the number of timed runs; the fastest is kept
+
+    memory: bool - whether to measure the peak memory in another run
+
+    Returns
+    -------
+
+    A dict of the results.
+    """
+    seconds = None
+
+    for i in range(repeat):
+        run, days, agents = make()
+
+        start = time.perf_counter()
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            run()
+
+        elapsed = time.perf_counter() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+
+    # some runs only know their number of agents once they are done
+    agents = getattr(run, "agents", agents)
+
+    result = {
+        "seconds": seconds,
+        "days": days,
+        "agents": agents,
+        "days_per_second": days / seconds if days else None,
+        "agent_days_per_second": days * agents / seconds if days and agents else None,
+        "peak_memory_bytes": None,
+    }
+
+    if memory:
+        run, days, agents = make()
+
+        tracemalloc.start()
+
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                run()
+
+            result["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return result
+
+
+def git_commit():
+    """
+    The commit of the working tree, or None if it is not known.
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(args):
+    """
+    Runs the scenarios selected by the arguments.
+
+    Returns
+    -------
+
+    A list of dicts, one for each case of each scenario.
+    """
+    memory = not args.no_memory
+    cases = []
+
+    if "attention" in args.scenarios:
+        parameters = LUCAS0.copy()
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            solved_pop = solve_population(
+                SequentialPortfolioConsumerType, parameters, processes=args.processes
+            )
+
+        for agents in args.agents:
+            cases.append(
+                (
+                    "attention",
+                    {"agents": agents, "quarters": args.quarters},
+                    lambda agents=agents: attention_scenario(
+                        solved_pop, agents, args.quarters, args.days, args.seed
+                    ),
+                )
+            )
+
+    if "finance_model" in args.scenarios:
+        for horizon in args.horizons:
+            cases.append(
+                (
+                    "finance_model",
+                    {"horizon": horizon},
+                    lambda horizon=horizon: finance_model_scenario(
+                        horizon, args.days, args.seed
+                    ),
+                )
+            )
+
+    if "inferential" in args.scenarios:
+        for horizon in args.horizons:
+            cases.append(
+                (
+                    "inferential",
+                    {"horizon": horizon, "observers": args.observers},
+                    lambda horizon=horizon: inferential_scenario(
+                        horizon, args.days, args.observers, args.seed
+                    ),
+                )
+            )
+
+    if "build_population" in args.scenarios:
+        for name in args.populations:
+            cases.append(
+                (
+                    "build_population",
+                    {"population": name},
+                    lambda name=name: build_population_scenario(
+                        name, args.processes, args.seed
+                    ),
+                )
+            )
+
+    if "sim_stats" in args.scenarios:
+        for series in args.series:
+            cases.append(
+                (
+                    "sim_stats",
+                    {"series": series},
+                    lambda series=series: sim_stats_scenario(series, args.days, args.seed),
+                )
+            )
+
+    if "rpc" in args.scenarios:
+        for transport in ["queue", "socket"]:
+            for batched in [False, True]:
+                cases.append(
+                    (
+                        "rpc",
+                        {"transport": transport, "batched": batched},
+                        lambda transport=transport, batched=batched: rpc_scenario(
+                            transport, batched, args.rpc_days, args.seed
+                        ),
+                    )
+                )
+
+    results = []
+
+    for scenario, params, make in cases:
+        result = {"scenario": scenario, "params": params}
+        result.update(measure(make, args.repeat, memory))
+
+        print(f"{scenario} {params}: {result['seconds']:.3f}s", file=sys.stderr)
+
+        results.append(result)
+
+    return results
+
+
+def case_key(result):
+    return (result["scenario"], json.dumps(result["params"], sort_keys=True))
+
+
+def compare(results, earlier):
+    """
+    A DataFrame comparing results with earlier results of the same cases.
+    A speedup above 1 means the case got faster.
+    """
+    earlier = {case_key(result): result for result in earlier}
+    rows = []
+
+    for result in results:
+        before = earlier.get(case_key(result))
+
+        if before is None:
+            continue
+
+        rows.append(
+            {
+                "scenario": result["scenario"],
+                "params": result["params"],
+                "seconds_before": before["seconds"],
+                "seconds_after": result["seconds"],
+                "speedup": before["seconds"] / result["seconds"],
+                "memory_ratio": (
+                    result["peak_memory_bytes"] / before["peak_memory_bytes"]
+                    if result["peak_memory_bytes"] and before["peak_memory_bytes"]
+                    else None
+                ),
+            }
+        )
+
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    results = run_benchmarks(args)
+
+    report = {
+        "commit": git_commit(),
+        "time": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "args": vars(args),
+        "results": results,
+    }
+
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+
+    columns = ["seconds", "days_per_second", "agent_days_per_second", "peak_memory_bytes"]
+
+    rows = [
+        {"scenario": r["scenario"], "params": r["params"]} | {key: r[key] for key in columns}
+        for r in results
+    ]
+
+    print(pd.DataFrame(rows).to_string(index=False))
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            earlier = json.load(f)
+
+        print()
+        print(compare(results, earlier["results"]).to_string(index=False))
@@ -0,0 +1,113 @@
+"""
+Benchmark of the cost of each tracking level of a simulation's history.
+
+Runs the same AttentionSimulation once for each level in TRACKING_LEVELS,
+from one solved population, and reports the time taken by the simulation,
+by tracking alone, and the memory allocated for the history.
+
+    python benchmarks/tracking.py --popn 100 --quarters 2
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+import pandas as pd
+from HARK.ConsumptionSaving.ConsPortfolioModel import SequentialPortfolioConsumerType
+
+from sharkfin.expectations import UsualExpectations
+from sharkfin.history import TRACKING_LEVELS, TrackingPolicy
+from sharkfin.markets import MockMarket
+from sharkfin.simulation import AttentionSimulation
+from simulate.parameters import LUCAS0, instantiate_population, solve_population
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--popn", help="number of agents per agent type", default=100)
+parser.add_argument("--quarters", help="number of quarters", default=2)
+parser.add_argument("--days", help="days per quarter", default=60)
+parser.add_argument("--every", help="track every this many days", default=1)
+parser.add_argument("--seed", help="random seed", default=0)
+
+
+def run_level(solved_pop, tracking, quarters, days, seed):
+    """
+    Runs a simulation with a tracking policy.
+
+    Returns
+    -------
+
+    The seconds taken by the simulation and by its calls to track,
+    and the bytes allocated for its history.
+    """
+    pop = instantiate_population(solved_pop, seed=seed)
+
+    sim = AttentionSimulation(
+        pop,
+        UsualExpectations,
+        a=0.2,
+        q=quarters,
+        r=days,
+        market=MockMarket(rng=np.random.default_rng(seed)),
+        days_per_quarter=days,
+        seed=seed,
+        fm_args={},
+        tracking=tracking,
+    )
+
+    track_seconds = 0.0
+    track = sim.track
+
+    def timed_track(day, time_delta=0):
+        nonlocal track_seconds
+
+        start = time.perf_counter()
+        track(day, time_delta)
+        track_seconds += time.perf_counter() - start
+
+    sim.track = timed_track
+
+    start = time.perf_counter()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim.simulate(burn_in=1)
+        sim.sim_stats()
+
+    return time.perf_counter() - start, track_seconds, sim.history.nbytes
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    parameters = LUCAS0.copy()
+    parameters["num_per_type"] = int(args.popn)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        solved_pop = solve_population(SequentialPortfolioConsumerType, parameters)
+
+    rows = []
+
+    for level in TRACKING_LEVELS:
+        seconds, track_seconds, nbytes = run_level(
+            solved_pop,
+            TrackingPolicy(level, every=int(args.every)),
+            int(args.quarters),
+            int(args.days),
+            int(args.seed),
+        )
+
+        rows.append(
+            {
+                "level": level,
+                "seconds": seconds,
+                "track_seconds": track_seconds,
+                "history_bytes": nbytes,
+            }
+        )
+
+    print(pd.DataFrame(rows).to_string(index=False))
@@ -0,0 +1,168 @@
+"""
+The attention history of a population: the days on which each agent
+has attended to the market.
+
+The days are stored for the whole population in one ragged array, in
+compressed sparse row (CSR) form: the days of agent i are
+days[indptr[i]:indptr[i + 1]], in the order they were recorded.
+An agent attending twice on the same day has that day twice.
+
+Days recorded since the last read are kept apart, as they were recorded,
+and merged into the ragged array in one pass when the log is next read.
+"""
+
+import numpy as np
+
+
+class AttentionLog:
+    """
+    The days on which each agent of a population has attended to the market.
+
+    Parameters
+    ----------
+
+    n_agents: int - the number of agents
+
+    capacity: int - the initial size of the array of days
+    """
+
+    def __init__(self, n_agents, capacity=1024):
+        self.n_agents = n_agents
+
+        self.indptr = np.zeros(n_agents + 1, dtype=np.int64)
+        self._days = np.empty(capacity, dtype=np.int32)
+
+        # the (agent_indices, day) of each record not yet merged into the days
+        self._pending = []
+
+    def __len__(self):
+        """
+        The number of days recorded, for all agents.
+        """
+        return int(self.indptr[-1]) + sum(len(agents) for agents, _ in self._pending)
+
+    @property
+    def nbytes(self):
+        """
+        The memory used by the log, in bytes.
+        """
+        return (
+            self.indptr.nbytes
+            + self._days.nbytes
+            + sum(agents.nbytes for agents, _ in self._pending)
+        )
+
+    def record(self, agent_indices, day):
+        """
+        Records that the agents attended on a day.
+
+        Params
+        ------
+        agent_indices: array of int -- positions of the agents in the population
+        day: int
+        """
+        agent_indices = np.array(agent_indices, dtype=np.int64).ravel()
+
+        if len(agent_indices) > 0:
+            self._pending.append((agent_indices, day))
+
+    def compact(self):
+        """
+        Merges the days recorded since the last read into the ragged array.
+        """
+        if not self._pending:
+            return
+
+        agents = np.concatenate([agents for agents, _ in self._pending])
+        days = np.concatenate(
+            [np.full(len(agents), day, dtype=np.int32) for agents, day in self._pending]
+        )
+        self._pending = []
+
+        # grouped by agent, in the order recorded
+        order = np.argsort(agents, kind="stable")
+        agents = agents[order]
+        days = days[order]
+
+        old_counts = np.diff(self.indptr)
+        new_counts = np.bincount(agents, minlength=self.n_agents)
+
+        indptr = self.indptr.copy()
+        indptr[1:] += np.cumsum(new_counts)
+
+        size = int(indptr[-1])
+        old_size = int(self.indptr[-1])
+
+        if size > len(self._days):
+            buffer = np.empty(max(size, 2 * len(self._days)), dtype=np.int32)
+        else:
+            buffer = np.empty_like(self._days)
+
+        # each agent's days move up by the new days of the agents before it
+        shift = np.repeat(indptr[:-1] - self.indptr[:-1], old_counts)
+        buffer[np.arange(old_size) + shift] = self._days[:old_size]
+
+        # and its new days follow its old ones
+        new_starts = np.cumsum(new_counts) - new_counts
+        rank = np.arange(len(agents)) - new_starts[agents]
+        buffer[indptr[agents] + old_counts[agents] + rank] = days
+
+        self.indptr = indptr
+        self._days = buffer
+
+    def days(self, agent):
+        """
+        The days on which an agent attended, as a read-only array.
+        """
+        self.compact()
+
+        days = self._days[self.indptr[agent] : self.indptr[agent + 1]]
+        days.flags.writeable = False
+
+        return days
+
+    def agent_days(self, agent_indices):
+        """
+        The days on which each of the agents attended.
+
+        Returns
+        -------
+
+        A list of read-only arrays, aligned with agent_indices.
+        """
+        self.compact()
+
+        view = self._days[: self.indptr[-1]]
+        view.flags.writeable = False
+
+        return [view[self.indptr[i] : self.indptr[i + 1]] for i in agent_indices]
+
+    def checkpoint(self):
+        """
+        Returns the log as plain data.
+        """
+        self.compact()
+
+        return {
+            "indptr": self.indptr.copy(),
+            "days": self._days[: self.indptr[-1]].copy(),
+        }
+
+    def restore(self, checkpoint):
+        """
+        Restores the log from a checkpoint.
+        """
+        indptr = np.asarray(checkpoint["indptr"], dtype=np.int64)
+
+        if len(indptr) != self.n_agents + 1:
+            raise ValueError(
+                f"Checkpoint has {len(indptr) - 1} agents, "
+                + f"but the log has {self.n_agents}."
+            )
+
+        days = np.asarray(checkpoint["days"], dtype=np.int32)
+
+        self.indptr = indptr.copy()
+        self._days = np.empty(max(len(self._days), 2 * len(days)), dtype=np.int32)
+        self._days[: len(days)] = days
+        self._pending = []
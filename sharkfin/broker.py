@@ -86,6 +86,58 @@ class Broker:
 
         return buy_sell, self.market.daily_rate_of_price_return(), price, dividend
 
+    def checkpoint(self):
+        """
+        Returns the order limits and trading history as plain data.
+        """
+        return {
+            "buy_limit": self.buy_limit,
+            "sell_limit": self.sell_limit,
+            "buy_orders_macro": self.buy_orders_macro,
+            "sell_orders_macro": self.sell_orders_macro,
+            "buy_sell_history": list(self.buy_sell_history),
+            "buy_sell_macro_history": list(self.buy_sell_macro_history),
+        }
+
+    def restore(self, checkpoint):
+        """
+        Restores the order limits and trading history from a checkpoint.
+        """
+        self.buy_limit = checkpoint["buy_limit"]
+        self.sell_limit = checkpoint["sell_limit"]
+        self.buy_orders_macro = checkpoint["buy_orders_macro"]
+        self.sell_orders_macro = checkpoint["sell_orders_macro"]
+        self.buy_sell_history = list(checkpoint["buy_sell_history"])
+        self.buy_sell_macro_history = list(checkpoint["buy_sell_macro_history"])
+
+    def trade_path(self, n_days):
+        """
+        Broker runs the market for n_days days with no orders placed.
+
+        Output: arrays of the prices and dividends of those days.
+        """
+        if self.market.order_responsive:
+            return self.trade_batch([(0, 0)] * n_days)
+
+        self.buy_sell_history.extend([(0, 0)] * n_days)
+        self.buy_sell_macro_history.extend([(0, 0)] * n_days)
+
+        return self.market.run_market_path(n_days)
+
+    def trade_batch(self, buy_sells):
+        """
+        Broker runs the market for one day for each of the given
+        (buy, sell) orders, known in advance.
+
+        Output: arrays of the prices and dividends of those days.
+        """
+        buy_sells = [(int(buy), int(sell)) for buy, sell in buy_sells]
+
+        self.buy_sell_history.extend(buy_sells)
+        self.buy_sell_macro_history.extend([(0, 0)] * len(buy_sells))
+
+        return self.market.run_market_batch(buy_sells, run_args=self.broker_args)
+
     def close(self):
         self.market.close_market()
 
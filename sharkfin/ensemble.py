@@ -0,0 +1,170 @@
+"""
+Ensembles of simulations forked from one warmed-up simulation.
+
+Building and solving a population and running the burn-in are the
+expensive parts of a simulation. Here they are done once, in the parent
+process, and each scenario of the ensemble runs in a child process
+forked from that state, sharing its memory copy-on-write.
+
+Forking requires the 'fork' start method, so this is not available
+on Windows. Markets that hold a connection to another process
+(such as the AMMPS RPC market) cannot be shared by forked children.
+"""
+
+import multiprocessing
+
+import numpy as np
+
+# The function run by fork_map, inherited by the forked children.
+_forked = None
+
+
+def reseed_simulation(sim, seed):
+    """
+    Reseeds the random number generators of a simulation:
+    its own, its market's and its population's.
+    A generator shared between them is reseeded once.
+    """
+    generators = []
+
+    for rng in [
+        getattr(sim, "rng", None),
+        sim.market.rng,
+        getattr(getattr(sim, "pop", None), "rng", None),
+    ]:
+        if rng is not None and not any(rng is g for g in generators):
+            generators.append(rng)
+
+    seeds = np.random.SeedSequence(seed).spawn(len(generators))
+
+    for rng, child_seed in zip(generators, seeds):
+        rng.bit_generator.state = type(rng.bit_generator)(child_seed).state
+
+    sim.seed = seed
+
+
+def apply_scenario(sim, scenario):
+    """
+    Applies a scenario to a simulation.
+
+    Parameters
+    ----------
+
+    scenario: dict - with any of the keys:
+        seed: int - reseeds the simulation with reseed_simulation
+        a: float - attention rate
+        fm_args: dict - options for the expectations model, overriding
+            those it was created with
+    """
+    if "seed" in scenario:
+        reseed_simulation(sim, scenario["seed"])
+
+    if "a" in scenario:
+        sim.attention_rate = scenario["a"]
+
+    if "fm_args" in scenario:
+        options = dict(sim.fm.options or {})
+        options.update(scenario["fm_args"])
+
+        fm = sim.fm.__class__(
+            sim.market, days_per_quarter=sim.days_per_quarter, options=options
+        )
+        fm.restore(sim.fm.checkpoint())
+        fm.timer = sim.fm.timer
+
+        # the latest expectations are recomputed with the new options
+        fm.expected_ror_list.pop()
+        fm.expected_std_list.pop()
+        fm.calculate_risky_expectations()
+
+        sim.fm = fm
+
+
+def simulate_scenario(sim):
+    """
+    Runs a warmed-up simulation to the end and returns its daily data
+    and statistics. The default for fork_simulations.
+    """
+    sim.simulate(start=False)
+
+    return {"daily_data": sim.daily_data(), "sim_stats": sim.sim_stats()}
+
+
+def _call_forked(item):
+    return _forked(item)
+
+
+def fork_map(function, items, processes=None):
+    """
+    Calls function on each item, each call in a child process forked
+    from this one. The children share this process's memory
+    copy-on-write, so function may use objects that cannot be pickled,
+    such as solved populations. Each child makes a single call, so
+    every call starts from the state of this process.
+
+    Parameters
+    ----------
+
+    function: function - called with each item. Its results must be picklable.
+
+    items: list - the arguments of the calls
+
+    processes: int or None - number of calls run at once.
+        Defaults to the number of CPUs.
+
+    Returns
+    -------
+
+    The results of the calls, in order.
+    """
+    global _forked
+
+    _forked = function
+
+    try:
+        context = multiprocessing.get_context("fork")
+
+        with context.Pool(processes, maxtasksperchild=1) as pool:
+            results = pool.map(_call_forked, items, chunksize=1)
+    finally:
+        _forked = None
+
+    return results
+
+
+def fork_simulations(sim, scenarios, run=simulate_scenario, burn_in=None, processes=None):
+    """
+    Runs an ensemble of scenarios, each in a child process forked
+    from one warmed-up simulation.
+
+    Parameters
+    ----------
+
+    sim: MarketSimulation - a simulation that has been started,
+        with start_simulation(), and not yet simulated.
+
+    scenarios: [dict] - the scenarios to run. See apply_scenario.
+
+    run: function - runs a child's simulation and returns its results,
+        which must be picklable.
+
+    burn_in: int or None - if not None, the simulation is first started
+        with this many burn-in days, in the parent.
+
+    processes: int or None - number of scenarios run at once.
+        Defaults to the number of CPUs.
+
+    Returns
+    -------
+
+    The results of run for each scenario, in order.
+    """
+    if burn_in is not None:
+        sim.start_simulation(burn_in)
+
+    def run_scenario(scenario):
+        apply_scenario(sim, scenario)
+
+        return run(sim)
+
+    return fork_map(run_scenario, scenarios, processes=processes)
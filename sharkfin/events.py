@@ -0,0 +1,248 @@
+"""
+A structured log of the events of a simulation, such as a day of the
+market or a warning about an agent's solution, in place of printing them.
+
+Each event has a name, a level and named fields. The log counts every
+event by name, and passes the events at or above its level to its sinks:
+functions called with each event, as a dict. With no sinks, which is the
+default, an event costs only its count.
+
+The log used across SHARKFin is the module-level `events`:
+
+    from sharkfin.events import events, JSONLinesSink
+
+    events.add_sink(JSONLinesSink("events.jsonl"))
+    events.set_level("debug")
+
+A simulation counts its own events apart from those of the simulations
+running alongside it in other threads, with counting():
+
+    with events.counting(self.event_counts):
+        ...
+"""
+
+import json
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+import numpy as np
+
+# The levels of events, from the least to the most severe
+EVENT_LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+
+
+def _json_default(obj):
+    """
+    Converts the NumPy values of events for json.dumps.
+    """
+    if isinstance(obj, np.integer):
+        return int(obj)
+    if isinstance(obj, np.floating):
+        return float(obj)
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+
+    return str(obj)
+
+
+class JSONLinesSink:
+    """
+    Writes each event as a line of JSON.
+
+    Parameters
+    ----------
+
+    target: str or file - a path, opened for appending, or an open file
+    """
+
+    def __init__(self, target):
+        if isinstance(target, str):
+            # line buffered, so that processes sharing the file write whole lines
+            self.file = open(target, "a", buffering=1)
+            self.owns_file = True
+        else:
+            self.file = target
+            self.owns_file = False
+
+    def __call__(self, event):
+        self.file.write(json.dumps(event, default=_json_default) + "\n")
+
+    def close(self):
+        if self.owns_file:
+            self.file.close()
+        else:
+            self.file.flush()
+
+
+class PrintSink:
+    """
+    Prints each event as a line of text, as the print statements it replaces did.
+    """
+
+    def __init__(self, file=None):
+        self.file = file
+
+    def __call__(self, event):
+        fields = ", ".join(
+            f"{k}: {v}" for k, v in event.items() if k not in ("event", "level", "time")
+        )
+
+        print(
+            f"{event['level'].upper()} {event['event']}" + (f" - {fields}" if fields else ""),
+            file=self.file if self.file is not None else sys.stdout,
+        )
+
+
+class EventLog:
+    """
+    Counts events, and passes those at or above a level to its sinks.
+    See the module documentation.
+
+    Parameters
+    ----------
+
+    level: str - one of EVENT_LEVELS
+
+    sinks: [function] - called with each event passed on, as a dict
+    """
+
+    def __init__(self, level="info", sinks=()):
+        self.set_level(level)
+        self.sinks = list(sinks)
+
+        # the level of each event counted
+        self.levels = {}
+
+        # events are emitted from the threads of concurrent simulations.
+        # Each thread counts its events in its own Counter, without a lock,
+        # and the Counters are added up when the counts are read.
+        self.local = threading.local()
+        self.thread_counts = []
+
+        # guards the list of the Counters of the threads
+        self.lock = threading.Lock()
+
+    def set_level(self, level):
+        if level not in EVENT_LEVELS:
+            raise ValueError(f"Unknown event level {level}. Options: {list(EVENT_LEVELS)}")
+
+        self.level = level
+        self.threshold = EVENT_LEVELS[level]
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def remove_sink(self, sink):
+        """
+        Removes a sink, closing it if it can be closed.
+        """
+        self.sinks.remove(sink)
+
+        if hasattr(sink, "close"):
+            sink.close()
+
+    def enabled(self, level):
+        """
+        Whether events at a level are passed to any sink.
+        Fields that are costly to compute can be left out when they are not.
+        """
+        return bool(self.sinks) and EVENT_LEVELS[level] >= self.threshold
+
+    def emit(self, name, level="info", **fields):
+        """
+        Records an event.
+
+        Parameters
+        ----------
+
+        name: str - the name of the event, by which it is counted
+
+        level: str - one of EVENT_LEVELS
+
+        fields: the values describing the event
+        """
+        local = self.local
+
+        try:
+            local.all_counts[name] += 1
+        except AttributeError:
+            local.all_counts = Counter({name: 1})
+
+            with self.lock:
+                self.thread_counts.append(local.all_counts)
+
+        self.levels[name] = level
+
+        counts = getattr(local, "counts", None)
+
+        if counts is not None:
+            counts[name] += 1
+
+        if not self.sinks or EVENT_LEVELS[level] < self.threshold:
+            return
+
+        event = {"event": name, "level": level, "time": time.time()}
+        event.update(fields)
+
+        for sink in self.sinks:
+            sink(event)
+
+    def snapshot(self):
+        """
+        A copy of the counts so far, for counts_since().
+        """
+        with self.lock:
+            thread_counts = list(self.thread_counts)
+
+        snapshot = Counter()
+
+        for counts in thread_counts:
+            # dict() copies a Counter in one step, while its thread may add to it
+            snapshot.update(dict(counts))
+
+        return snapshot
+
+    @property
+    def counts(self):
+        """
+        The counts of all the events so far, by name.
+        """
+        return self.snapshot()
+
+    def counts_since(self, snapshot=None, level="debug"):
+        """
+        The counts of the events at or above a level since a snapshot,
+        by name, leaving out those that did not happen.
+        """
+        return self.at_level(self.snapshot() - (snapshot or Counter()), level)
+
+    @contextmanager
+    def counting(self, counts):
+        """
+        Also counts the events emitted by this thread within the block
+        in counts, a Counter, leaving out those of other threads.
+        """
+        previous = getattr(self.local, "counts", None)
+        self.local.counts = counts
+
+        try:
+            yield counts
+        finally:
+            self.local.counts = previous
+
+    def at_level(self, counts, level="debug"):
+        """
+        The counts of the events at or above a level, by name,
+        leaving out those that did not happen.
+        """
+        return {
+            name: count
+            for name, count in counts.items()
+            if EVENT_LEVELS[self.levels[name]] >= EVENT_LEVELS[level]
+        }
+
+
+events = EventLog()
@@ -8,7 +8,9 @@ from typing import Tuple
 
 from HARK.distribution import Lognormal
 import math
-from scipy.stats import lognorm, ks_1samp
+from scipy.stats import lognorm, kstwo
+
+from sharkfin.markets import SeriesBuffer
 
 def scipy_stats_lognorm_from_mean_std(mean, std):
     hark_lognorm = Lognormal.from_mean_std(mean, std)
@@ -20,6 +22,47 @@ def scipy_stats_lognorm_from_mean_std(mean, std):
 
     return dist
 
+def ks_statistics(samples):
+    """
+    The two-sided Kolmogorov-Smirnov statistics of several samples at once.
+
+    Parameters
+    ----------
+
+    samples: [np.array] - for each sample, the values of the CDF of the
+        hypothesized distribution at its observations, in any order.
+        Samples may have different sizes, but not be empty.
+
+    Returns
+    -------
+
+    np.array with the statistic D of each sample, computed as
+    scipy.stats.ks_1samp does.
+    """
+    n = np.array([len(sample) for sample in samples])
+    starts = np.cumsum(n) - n
+
+    group = np.repeat(np.arange(len(samples)), n)
+    values = np.concatenate(samples)
+
+    # sorted by sample, and within each sample by value
+    values = values[np.lexsort((values, group))]
+
+    rank = np.arange(len(values)) - np.repeat(starts, n)
+    size = np.repeat(n, n).astype(float)
+
+    distance = np.maximum((rank + 1.0) / size - values, values - rank / size)
+
+    return np.maximum.reduceat(distance, starts)
+
+def ks_pvalue_bound(D, n):
+    """
+    An upper bound on the p-value of the two-sided Kolmogorov-Smirnov
+    statistic D of a sample of size n: the Dvoretzky-Kiefer-Wolfowitz
+    inequality, with Massart's constant.
+    """
+    return 2 * np.exp(-2 * n * np.square(D))
+
 class AbstractExpectations(ABC):
     '''
     Abstract class from which Expectations should inherit
@@ -27,6 +70,9 @@ class AbstractExpectations(ABC):
     defines common methods for all market models.
     '''
 
+    # A PhaseTimer counting the Kolmogorov-Smirnov tests, if set
+    timer = None
+
     @property
     @abstractmethod
     def market(self):
@@ -52,6 +98,23 @@ class AbstractExpectations(ABC):
         """
         pass
 
+    def bring_forward(self, n_days):
+        """
+        Brings the expectations forward over n_days days of new market
+        data at once, in place of a call to calculate_risky_expectations
+        on each day.
+
+        Only the expectations of the final day are computed. The days
+        skipped are recorded as nan.
+        """
+        if n_days <= 0:
+            return
+
+        self.expected_ror_list.extend([np.nan] * (n_days - 1))
+        self.expected_std_list.extend([np.nan] * (n_days - 1))
+
+        self.calculate_risky_expectations()
+
     @abstractmethod
     def risky_expectations(self, agent = None):
         """
@@ -66,6 +129,31 @@ class AbstractExpectations(ABC):
         """
         pass
 
+    def attention_risky_expectations(self, attention_days):
+        """
+        The quarterly expectations for the risky asset of several agents
+        that have observed the market on the given days.
+        By default, the expectations do not depend on the days observed.
+
+        Params
+        -------
+
+        attention_days: [list of int] -- for each agent, the days whose
+            rates of return it has observed. May be empty.
+
+        Returns
+        -------
+
+        A dict of np.arrays aligned with attention_days,
+        with the keys 'RiskyAvg' and 'RiskyStd'.
+        """
+        expectations = self.risky_expectations()
+
+        return {
+            key: np.full(len(attention_days), value)
+            for key, value in expectations.items()
+        }
+
     @abstractmethod
     def reset(self):
         """
@@ -73,6 +161,24 @@ class AbstractExpectations(ABC):
         """
         pass
 
+    def checkpoint(self):
+        """
+        Returns the data stores as plain data.
+        """
+        return {
+            "prices": list(self.prices),
+            "expected_ror_list": list(self.expected_ror_list),
+            "expected_std_list": list(self.expected_std_list),
+        }
+
+    def restore(self, checkpoint):
+        """
+        Restores the data stores from a checkpoint.
+        """
+        self.prices = list(checkpoint["prices"])
+        self.expected_ror_list = list(checkpoint["expected_ror_list"])
+        self.expected_std_list = list(checkpoint["expected_std_list"])
+
 class UsualExpectations(AbstractExpectations):
     """
     The Lucas "usual" expectations of the market.
@@ -156,6 +262,13 @@ class UsualExpectations(AbstractExpectations):
         expected_std = self.daily_std
         self.expected_std_list.append(expected_std)
 
+    def bring_forward(self, n_days):
+        """
+        Repeats the constant belief parameters for n_days days.
+        """
+        self.expected_ror_list.extend([self.daily_ror] * n_days)
+        self.expected_std_list.extend([self.daily_std] * n_days)
+
     def rap(self):
         """
         Returns the current risky asset price. MOVE TO MARKET
@@ -263,8 +376,53 @@ class FinanceModel(AbstractExpectations):
         self.expected_ror_list = []
         self.expected_std_list = []
 
+        self.reset_memory()
+
         self.options = options
 
+    def reset_memory(self):
+        """
+        Clears the running statistics of the market's rates of return.
+        They are recomputed from the market data on the next update.
+        """
+        # number of rates of return included
+        self.memory_count = 0
+        # sum of the weights of the rates of return,
+        # scaled so that the weight of the latest one is 1
+        self.memory_weight = 0.0
+        # weighted mean of the rates of return
+        self.memory_mean = 0.0
+        # weighted sum of squared deviations from the mean
+        self.memory_m2 = 0.0
+
+    def update_memory(self):
+        """
+        Adds the market's new rates of return to the running statistics.
+
+        Each day the weights of the past rates of return shrink by a factor
+        of exp(-a), so the statistics are updated in constant time per day.
+        This is the weighted incremental algorithm of West (1979).
+        """
+        if len(self.market.prices) - 1 < self.memory_count:
+            # the market was reset
+            self.reset_memory()
+
+        decay = math.exp(-self.a)
+
+        for ror in self.market.ror_list(self.memory_count):
+            weight = decay * self.memory_weight + 1
+            delta = ror - self.memory_mean
+
+            self.memory_mean = self.memory_mean + delta / weight
+            self.memory_m2 = decay * self.memory_m2 + delta * (ror - self.memory_mean)
+            self.memory_weight = weight
+            self.memory_count += 1
+
+    def restore(self, checkpoint):
+        super().restore(checkpoint)
+
+        self.reset_memory()
+
     def asset_price_stats(self):
         """
         Get statistics on the price of the asset for final reporting.
@@ -286,33 +444,35 @@ class FinanceModel(AbstractExpectations):
         has to be called on a schedule... this should be fixed.
         """
 
-        ror_list = self.market.ror_list()
+        self.update_memory()
 
         # note use of data store lists for time tracking here -- not ideal
-        D_t = sum([math.exp(self.a * (l + 1)) for l in range(len(ror_list))])
         S_t = math.exp(
             self.b * (len(self.market.prices) - 1)
         )  # because p_0 is included in this list.
 
+        # the rates of return share the weight 1 - S_t
+        # in proportion to exp(a * (t + 1)), summed in the memory
         w_0 = S_t
-        w_t = [
-            (1 - S_t) * math.exp(self.a * (t + 1)) / D_t
-            for t in range(len(ror_list))
-        ]
 
-        expected_ror = w_0 * self.sp500_ror + sum(
-            [w_ror[0] * w_ror[1] for w_ror in zip(w_t, ror_list)]
-        )
+        expected_ror = w_0 * self.sp500_ror
+
+        if self.memory_count > 0:
+            expected_ror += (1 - w_0) * self.memory_mean
+
         self.expected_ror_list.append(expected_ror)
 
-        expected_std = math.sqrt(
-            w_0 * pow(self.sp500_std, 2)
-            + sum(
-                [
-                    w_ror_er[0] * pow(w_ror_er[1] - expected_ror, 2)
-                    for w_ror_er in zip(w_t, ror_list)
-                ]
+        # weighted squared deviations from expected_ror
+        ror_variance = 0.0
+
+        if self.memory_count > 0:
+            ror_variance = (
+                self.memory_m2 / self.memory_weight
+                + pow(self.memory_mean - expected_ror, 2)
             )
+
+        expected_std = math.sqrt(
+            w_0 * pow(self.sp500_std, 2) + (1 - w_0) * ror_variance
         )
         self.expected_std_list.append(expected_std)
 
@@ -347,6 +507,8 @@ class FinanceModel(AbstractExpectations):
         self.expected_ror_list = []
         self.expected_std_list = []
 
+        self.reset_memory()
+
 
 class InferentialExpectations(FinanceModel):
     """
@@ -390,58 +552,152 @@ class InferentialExpectations(FinanceModel):
         if 'zeta' in options:
             self.zeta = options['zeta']
 
-    def risky_expectations(self, agent = None):
+        self.reset_usual_cdf()
+
+    def reset_usual_cdf(self):
         """
-        Return quarterly expectations for the risky asset.
-        
-        Stochastically determine whether to use the USUAL expectations, 
-        or the STRANGE expectations resulting from the FinanceModel, based
-        on the goodness-of-fit of the USUAL expectations and the zeta threshold
-        parameter.
+        Clears the table of usual CDF values of the market's rates of return.
+        It is recomputed from the market data on the next update.
         """
+        # the CDF of the USUAL distribution of returns,
+        # at one plus each day's rate of return
+        self.usual_cdf = SeriesBuffer()
+        self.usual_parameters = (self.daily_ror, self.daily_std)
+        self.usual_dist = scipy_stats_lognorm_from_mean_std(
+            1 + self.daily_ror, self.daily_std
+        )
 
-        usual_ror = self.daily_ror
-        usual_std = self.daily_std
+    def update_usual_cdf(self):
+        """
+        Extends the table of usual CDF values over the market's new rates of return.
 
-        usual_dist = scipy_stats_lognorm_from_mean_std(1 + usual_ror, usual_std)
+        The table is rebuilt if the usual expectations have changed,
+        or if the market's history is shorter than the table.
+        """
+        if (
+            self.usual_parameters != (self.daily_ror, self.daily_std)
+            or len(self.market.ror_list()) < len(self.usual_cdf)
+        ):
+            self.reset_usual_cdf()
 
-        observed_ror = None
-        if 'attention_days' in agent.parameters and len(self.market.ror_list()) > 0:
-            observed_ror = np.array(self.market.ror_list())[agent.parameters['attention_days']] + 1
+        new_ror = self.market.ror_list(len(self.usual_cdf))
 
-        strange_ror = self.expected_ror_list[-1]
-        strange_std = self.expected_std_list[-1]
-        #strange_dist = scipy_stats_lognorm_from_mean_std(1 + strange_ror, strange_std)
+        if len(new_ror) > 0:
+            self.usual_cdf.extend(self.usual_dist.cdf(new_ror + 1))
 
-        if observed_ror is not None:
-            try:
+    def calculate_risky_expectations(self):
+        super().calculate_risky_expectations()
 
-                ksd = ks_1samp(observed_ror, usual_dist.cdf)
-                #print(ksd)
-            except Exception as e:
-                print(f"observed_ror: {observed_ror}")
-                print(f"usual dist: {usual_dist.mean()}. {usual_dist.std()}")
-                print(e)
-                raise e
+        self.update_usual_cdf()
 
-            if ksd.pvalue < self.zeta:
-                #print(f"STRANGE: observed_ror: {observed_ror}, p: {ksd.pvalue} <= zeta = {self.zeta}")
-                ## TODO: Add noise to this to prevent herding....
-                ror = strange_ror
-                std = strange_std
-            else:
-                ror = usual_ror
-                std = usual_std
+    def restore(self, checkpoint):
+        super().restore(checkpoint)
 
-        else:
-            # with no observations assume usual
-            ror = usual_ror
-            std = usual_std
+        self.reset_usual_cdf()
 
-        # expected quarterly returns
-        q_ror = ror_quarterly( ror , self.days_per_quarter)
-        q_std = sig_quarterly( std , self.days_per_quarter)
+    def reset(self):
+        super().reset()
 
-        market_risky_params = {'RiskyAvg': 1 + q_ror, 'RiskyStd': q_std}
+        self.reset_usual_cdf()
 
-        return market_risky_params
+    def strange_attention(self, attention_days):
+        """
+        Whether the usual expectations are rejected by the returns observed
+        on each list of attention days: if the p-value of the
+        Kolmogorov-Smirnov test of those returns against the USUAL
+        distribution is below zeta.
+
+        The exact p-value is only computed when the upper bound of
+        ks_pvalue_bound does not already put it below zeta.
+
+        Params
+        -------
+
+        attention_days: [list of int] -- for each agent, the days whose
+            rates of return it has observed. May be empty.
+
+        Returns
+        -------
+
+        np.array of bool
+        """
+        strange = np.zeros(len(attention_days), dtype=bool)
+
+        if self.zeta <= 0:
+            return strange
+
+        self.update_usual_cdf()
+        usual_cdf = self.usual_cdf.view()
+
+        observing = [i for i, days in enumerate(attention_days) if len(days) > 0]
+
+        if len(observing) == 0 or len(usual_cdf) == 0:
+            return strange
+
+        samples = [usual_cdf[np.asarray(attention_days[i], dtype=int)] for i in observing]
+        n = np.array([len(sample) for sample in samples])
+        D = ks_statistics(samples)
+
+        clear = ks_pvalue_bound(D, n) < self.zeta
+        unclear = ~clear
+
+        if unclear.any():
+            pvalue = np.clip(kstwo.sf(D[unclear], n[unclear]), 0.0, 1.0)
+            clear[unclear] = pvalue < self.zeta
+
+        if self.timer is not None:
+            self.timer.count("ks_tests", len(observing))
+            self.timer.count("ks_exact_pvalues", int(unclear.sum()))
+
+        strange[observing] = clear
+
+        return strange
+
+    def attention_risky_expectations(self, attention_days):
+        """
+        The quarterly expectations for the risky asset of agents that have
+        observed the market on the given days. See strange_attention.
+
+        Returns
+        -------
+
+        A dict of np.arrays aligned with attention_days,
+        with the keys 'RiskyAvg' and 'RiskyStd'.
+        """
+        strange = self.strange_attention(attention_days)
+
+        usual_avg = 1 + ror_quarterly(self.daily_ror, self.days_per_quarter)
+        usual_std = sig_quarterly(self.daily_std, self.days_per_quarter)
+
+        if not strange.any():
+            return {
+                'RiskyAvg': np.full(len(strange), usual_avg),
+                'RiskyStd': np.full(len(strange), usual_std),
+            }
+
+        ## TODO: Add noise to this to prevent herding....
+        strange_avg = 1 + ror_quarterly(self.expected_ror_list[-1], self.days_per_quarter)
+        strange_std = sig_quarterly(self.expected_std_list[-1], self.days_per_quarter)
+
+        return {
+            'RiskyAvg': np.where(strange, strange_avg, usual_avg),
+            'RiskyStd': np.where(strange, strange_std, usual_std),
+        }
+
+    def risky_expectations(self, agent = None):
+        """
+        Return quarterly expectations for the risky asset.
+        
+        Stochastically determine whether to use the USUAL expectations, 
+        or the STRANGE expectations resulting from the FinanceModel, based
+        on the goodness-of-fit of the USUAL expectations and the zeta threshold
+        parameter.
+        """
+        expectations = self.attention_risky_expectations(
+            [agent.parameters.get('attention_days', [])]
+        )
+
+        return {
+            'RiskyAvg': expectations['RiskyAvg'][0].item(),
+            'RiskyStd': expectations['RiskyStd'][0].item(),
+        }
@@ -0,0 +1,332 @@
+"""
+The daily history of a simulation, stored in preallocated NumPy arrays.
+
+A simulation tracks two kinds of values each day:
+
+- metrics, single numbers such as the total assets of the population.
+  Each metric is a column of one (days x metrics) array.
+
+- frames, tables such as the statistics of each class of agents.
+  A frame is recorded as one or more arrays of fixed shape each day,
+  stored in (days x ...) arrays, and turned into a DataFrame by a
+  function given with it, only when that day's table is read.
+
+The arrays grow geometrically if a simulation runs longer than expected.
+
+A TrackingPolicy sets how much of the history a simulation records,
+and on which days.
+"""
+
+from collections.abc import Mapping, Sequence
+from dataclasses import dataclass
+
+import numpy as np
+
+# The levels of detail of a history, from the least to the most detailed:
+#   none - nothing is recorded
+#   aggregate - daily metrics of the whole population
+#   class - also the statistics of each class of agents, as class_stats
+#   agent - also the values of every agent, as total_pop_stats
+TRACKING_LEVELS = ["none", "aggregate", "class", "agent"]
+
+
+def _reserve(array, size):
+    """
+    Returns array, or a copy of it with room for at least size rows.
+    """
+    if size <= len(array):
+        return array
+
+    grown = np.empty((max(size, 2 * len(array)),) + array.shape[1:], dtype=array.dtype)
+    grown[: len(array)] = array
+
+    return grown
+
+
+@dataclass
+class TrackingPolicy:
+    """
+    How much of its history a simulation records, and on which days.
+
+    The state before the first day is recorded at every level but none.
+
+    Parameters
+    ----------
+
+    level: str - one of TRACKING_LEVELS
+
+    every: int - the history is recorded on every this many days,
+        starting with the first
+
+    quarter_end: bool - whether the history is also recorded
+        on the last day of each quarter
+    """
+
+    level: str = "agent"
+    every: int = 1
+    quarter_end: bool = True
+
+    def __post_init__(self):
+        if self.level not in TRACKING_LEVELS:
+            raise ValueError(
+                f"Unknown tracking level {self.level}. Options: {TRACKING_LEVELS}"
+            )
+
+        if self.every < 1:
+            raise ValueError(f"Tracking every {self.every} days is not possible.")
+
+    def includes(self, level):
+        """
+        Whether this policy records the history at least at level.
+        """
+        return TRACKING_LEVELS.index(self.level) >= TRACKING_LEVELS.index(level)
+
+    def tracks(self, day, days_per_quarter):
+        """
+        Whether the history is recorded on a day, counted from 0 at the
+        start of the simulation. Day -1 is the state before the first day.
+        """
+        if self.level == "none":
+            return False
+
+        if day < 0 or day % self.every == 0:
+            return True
+
+        return self.quarter_end and (day + 1) % days_per_quarter == 0
+
+    def tracked_days(self, days, days_per_quarter):
+        """
+        The most days recorded in a simulation of this many days.
+        """
+        if self.level == "none":
+            return 0
+
+        quarter_ends = days // days_per_quarter if self.quarter_end else 0
+
+        return 1 + -(-days // self.every) + quarter_ends
+
+
+class FrameSequence(Sequence):
+    """
+    The daily DataFrames of a frame of a HistoryRecorder,
+    each built when it is accessed.
+    """
+
+    def __init__(self, arrays, length, build):
+        self.arrays = arrays
+        self.length = length
+        self.build = build
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.length))]
+
+        if index < 0:
+            index += self.length
+
+        if not 0 <= index < self.length:
+            raise IndexError("history index out of range")
+
+        return self.build(*[array[index] for array in self.arrays])
+
+
+class HistoryRecorder(Mapping):
+    """
+    The daily history of a simulation. See the module documentation.
+
+    It can be read like the dict of lists it replaces:
+    a metric is read as a read-only array of its values,
+    and a frame as a sequence of DataFrames.
+
+    Parameters
+    ----------
+
+    metrics: [str] - the names of the metrics
+
+    days: int - the number of days to allocate room for
+    """
+
+    def __init__(self, metrics=(), days=64):
+        self.days = max(days, 1)
+
+        # the names of the metrics and frames, in the order they were added
+        self.names = []
+
+        self.metric_index = {}
+        self.metric_values = np.empty((self.days, 0))
+        self.metric_lengths = np.zeros(0, dtype=int)
+
+        # for each frame: its function, its arrays and its number of days
+        self.frame_builders = {}
+        self.frame_arrays = {}
+        self.frame_lengths = {}
+
+        self.add_metrics(metrics)
+
+    def add_metrics(self, metrics):
+        """
+        Adds metrics to the history, with no values yet.
+        """
+        metrics = [m for m in metrics if m not in self.metric_index]
+
+        for m in metrics:
+            self.metric_index[m] = len(self.metric_index)
+            self.names.append(m)
+
+        self.metric_values = np.concatenate(
+            (self.metric_values, np.full((len(self.metric_values), len(metrics)), np.nan)),
+            axis=1,
+        )
+        self.metric_lengths = np.concatenate(
+            (self.metric_lengths, np.zeros(len(metrics), dtype=int))
+        )
+
+    def add_frame(self, name, build):
+        """
+        Adds a frame to the history, with no values yet.
+
+        Parameters
+        ----------
+
+        name: str
+
+        build: function - called with the arrays recorded on a day,
+            returns that day's DataFrame
+        """
+        if name not in self.frame_builders:
+            self.names.append(name)
+
+        self.frame_builders[name] = build
+        self.frame_arrays[name] = None
+        self.frame_lengths[name] = 0
+
+    def record(self, **values):
+        """
+        Appends a value to each of the given metrics.
+        """
+        for name, value in values.items():
+            column = self.metric_index[name]
+            row = self.metric_lengths[column]
+
+            self.metric_values = _reserve(self.metric_values, row + 1)
+            self.metric_values[row, column] = value
+            self.metric_lengths[column] = row + 1
+
+    def record_frame(self, name, *arrays):
+        """
+        Appends a day to a frame: the arrays its DataFrame is built from.
+        On every day, the arrays must have the same shapes.
+        """
+        length = self.frame_lengths[name]
+
+        if self.frame_arrays[name] is None:
+            self.frame_arrays[name] = [
+                np.empty((self.days,) + np.shape(a), dtype=np.asarray(a).dtype)
+                for a in arrays
+            ]
+
+        stored = self.frame_arrays[name]
+
+        for i, array in enumerate(arrays):
+            stored[i] = _reserve(stored[i], length + 1)
+            stored[i][length] = array
+
+        self.frame_lengths[name] = length + 1
+
+    @property
+    def nbytes(self):
+        """
+        The memory allocated for the history, in bytes.
+        """
+        return self.metric_values.nbytes + sum(
+            a.nbytes for arrays in self.frame_arrays.values() if arrays for a in arrays
+        )
+
+    def __getitem__(self, name):
+        if name in self.metric_index:
+            column = self.metric_index[name]
+            values = self.metric_values[: self.metric_lengths[column], column]
+            values.flags.writeable = False
+
+            return values
+
+        if name in self.frame_builders:
+            return FrameSequence(
+                self.frame_arrays[name] or [],
+                self.frame_lengths[name],
+                self.frame_builders[name],
+            )
+
+        raise KeyError(name)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def checkpoint(self):
+        """
+        Returns the recorded values as plain data.
+        """
+        return {
+            "metrics": {name: self[name].copy() for name in self.metric_index},
+            "frames": {
+                name: [a[: self.frame_lengths[name]].copy() for a in arrays]
+                if arrays
+                else None
+                for name, arrays in self.frame_arrays.items()
+            },
+        }
+
+    def clear(self, days=None):
+        """
+        Drops the recorded values, keeping the metrics and frames.
+
+        If days is given, the history is allocated again with room for
+        that many days; otherwise it keeps the room it has.
+        """
+        if days is not None:
+            self.days = max(days, 1)
+            self.metric_values = np.empty((self.days, len(self.metric_index)))
+            self.frame_arrays = {name: None for name in self.frame_arrays}
+
+        self.metric_lengths[:] = 0
+        self.frame_lengths = {name: 0 for name in self.frame_lengths}
+
+    def drain(self):
+        """
+        Returns the recorded values, as checkpoint() does, and clears the history.
+        """
+        checkpoint = self.checkpoint()
+        self.clear()
+
+        return checkpoint
+
+    def restore(self, checkpoint):
+        """
+        Restores the recorded values from a checkpoint.
+        The metrics and frames must have been added as in the checkpointed history.
+        """
+        for name, values in checkpoint["metrics"].items():
+            column = self.metric_index[name]
+
+            self.metric_values = _reserve(self.metric_values, len(values))
+            self.metric_values[: len(values), column] = values
+            self.metric_lengths[column] = len(values)
+
+        for name, arrays in checkpoint["frames"].items():
+            if arrays is None:
+                self.frame_arrays[name] = None
+                self.frame_lengths[name] = 0
+                continue
+
+            length = len(arrays[0])
+
+            self.frame_arrays[name] = [
+                _reserve(np.array(a), self.days) for a in arrays
+            ]
+            self.frame_lengths[name] = length
@@ -1,8 +1,109 @@
 from abc import ABC, abstractmethod
+from copy import deepcopy
 import math
 import numpy as np
 from typing import Tuple
 
+from sharkfin.events import events
+
+
+class SeriesBuffer:
+    """
+    A daily series of floats, such as a market's prices, stored in a NumPy
+    array that grows geometrically as values are appended.
+
+    It can be used like a list. Slices, and view(), are read-only NumPy
+    views of the series, not copies.
+
+    Parameters
+    ----------
+
+    values: iterable of float - the initial values of the series
+
+    capacity: int - the initial size of the array
+    """
+
+    def __init__(self, values=(), capacity=64):
+        values = np.asarray(values, dtype=float).ravel()
+
+        self._data = np.empty(max(capacity, 2 * len(values)))
+        self._data[: len(values)] = values
+        self._size = len(values)
+
+        # earliest position changed by assignment since changed_from() was last called
+        self._changed = None
+
+    def _reserve(self, size):
+        if size > len(self._data):
+            data = np.empty(max(size, 2 * len(self._data)))
+            data[: self._size] = self._data[: self._size]
+            self._data = data
+
+    def append(self, value):
+        self._reserve(self._size + 1)
+        self._data[self._size] = value
+        self._size += 1
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+
+        self._reserve(self._size + len(values))
+        self._data[self._size : self._size + len(values)] = values
+        self._size += len(values)
+
+    def truncate(self, size):
+        """
+        Drops the values from position size on.
+        """
+        self._size = min(self._size, size)
+
+    def view(self):
+        """
+        A read-only view of the values of the series.
+        """
+        view = self._data[: self._size]
+        view.flags.writeable = False
+
+        return view
+
+    def changed_from(self):
+        """
+        The earliest position whose value has been assigned since the
+        last call, or None.
+        """
+        changed = self._changed
+        self._changed = None
+
+        return changed
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, key):
+        return self.view()[key]
+
+    def __setitem__(self, key, value):
+        self._data[: self._size][key] = value
+
+        positions = np.arange(self._size)[key]
+        first = int(np.min(positions)) if np.size(positions) > 0 else None
+
+        if first is not None:
+            self._changed = first if self._changed is None else min(self._changed, first)
+
+    def __iter__(self):
+        return iter(self.view())
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            return self.view() if not copy else self.view().copy()
+
+        return self.view().astype(dtype)
+
+    def __repr__(self):
+        return f"SeriesBuffer({self.view().tolist()})"
+
+
 class AbstractMarket(ABC):
     '''
     Abstract class from which market models should inherit
@@ -10,11 +111,19 @@ class AbstractMarket(ABC):
     defines common methods for all market models.
     '''
 
+    # Whether the market's prices respond to the orders placed on it.
+    # Markets that do not can run a whole path of days at once.
+    order_responsive = True
+
+    # Whether the market runs many days, with orders known in advance,
+    # in one call to run_market_batch, rather than one day at a time.
+    batched = False
+
     @property
     @abstractmethod
     def prices(self):
         """
-        A list of prices, beginning with the default price.
+        A SeriesBuffer of prices, beginning with the default price.
         """
         pass
 
@@ -22,7 +131,7 @@ class AbstractMarket(ABC):
     @abstractmethod
     def dividends(self):
         """
-        A list of dividends, beginning with the default price.
+        A SeriesBuffer of dividends, beginning with the default price.
         """
         pass
 
@@ -59,6 +168,33 @@ class AbstractMarket(ABC):
         dividend = 5.0 / 60
         return price, dividend
 
+    def run_market_path(self, n_days):
+        """
+        Runs the market for n_days days with no orders.
+        Returns arrays of the new prices and dividends.
+
+        By default, runs the market one day at a time.
+        """
+        return self.run_market_batch([(0, 0)] * n_days)
+
+    def run_market_batch(self, buy_sells, run_args = None):
+        """
+        Runs the market for one day for each of the given (buy, sell)
+        orders, which are known in advance.
+        Returns arrays of the new prices and dividends.
+
+        By default, runs the market one day at a time.
+        """
+        path = [
+            self.run_market(buy_sell=buy_sell, run_args=run_args)
+            for buy_sell in buy_sells
+        ]
+
+        prices = np.array([price for price, dividend in path], dtype=float)
+        dividends = np.array([dividend for price, dividend in path], dtype=float)
+
+        return prices, dividends
+
     @abstractmethod
     def get_simulation_price(self, seed: int, buy_sell: Tuple[int, int]):
         # does this need to be an abstract method or can it be encapsulated in daily_rate_of_return?
@@ -107,34 +243,112 @@ class AbstractMarket(ABC):
         
         return price, dividend
 
-    def ror_list(self):
+    def checkpoint(self):
+        """
+        Returns the state of the market as plain data: the price,
+        dividend and range series, and the state of the rng.
+
+        For a market run by a remote server, this is only the
+        client-side state; the server itself is not checkpointed.
         """
-        Get a list of the rates of return, INCLUDING the dividend.
+        return {
+            "prices": np.asarray(self.prices, dtype=float).tolist(),
+            "dividends": np.asarray(self.dividends, dtype=float).tolist(),
+            "ranges": np.asarray(getattr(self, "ranges", []), dtype=float).tolist(),
+            "latest_price": getattr(self, "latest_price", None),
+            "rng": deepcopy(self.rng.bit_generator.state),
+        }
+
+    def restore(self, checkpoint):
+        """
+        Restores the state of the market from a checkpoint.
+        """
+        self.prices = SeriesBuffer(checkpoint["prices"])
+        self.dividends = SeriesBuffer(checkpoint["dividends"])
+        self.ranges = SeriesBuffer(checkpoint["ranges"])
+        self.latest_price = checkpoint["latest_price"]
+        self.rng.bit_generator.state = deepcopy(checkpoint["rng"])
+
+        self.reset_returns()
+
+    def reset_returns(self):
+        """
+        Clears the series of rates of return, which are then
+        recomputed from the prices and dividends when next needed.
+        """
+        self.returns = SeriesBuffer()
+        self.log_returns = SeriesBuffer()
+        self.returns_source = (self.prices, self.dividends)
+
+    def update_returns(self):
+        """
+        Brings the series of rates of return and log returns up to date
+        with the prices and dividends, computing only the new values,
+        and those whose prices or dividends were changed.
+        """
+        if getattr(self, "returns_source", None) != (self.prices, self.dividends):
+            # the price or dividend series were replaced
+            self.reset_returns()
+
+        start = len(self.returns)
+
+        for series in (self.prices, self.dividends):
+            changed = series.changed_from()
+
+            if changed is not None:
+                start = min(start, max(changed - 1, 0))
+
+        end = min(len(self.prices), len(self.dividends)) - 1
+        start = min(start, max(end, 0))
+
+        self.returns.truncate(start)
+        self.log_returns.truncate(start)
+
+        if end > start:
+            prices = self.prices.view()
+            dividends = self.dividends.view()
+
+            gross = (prices[start + 1 : end + 1] + dividends[start + 1 : end + 1]) / prices[start:end]
+
+            self.returns.extend(gross - 1)
+            self.log_returns.extend(np.log(gross))
+
+    def ror_list(self, start=0):
+        """
+        Get the rates of return, INCLUDING the dividend.
         Note the difference with daily_rate_of_return.
         This should be refactored for clarity.
 
+        If start is given, only the rates of return from that one on are given.
+
+        Returns a read-only array, which is a view of the market's series.
+
         TODO: THIS WON'T WORK WITH SOME MARKETS WITH A DIFFERENT ROR CALCULATION?
         """
-        return [((self.prices[i+1] + self.dividends[i + 1])/ self.prices[i]) - 1 for i in range(len(self.prices) - 1)]
+        self.update_returns()
+
+        return self.returns[start:]
 
 
     def log_return_list(self):
         """
-        Get a list of the log returns....
+        Get the log returns....
 
         Log returns are defined as the log(price_t+1 / price_t).
 
         --- These should not _include_ the dividend because the price _reflects_ the dividend
+
+        Returns a read-only array, which is a view of the market's series.
         """
-        return [np.log((self.prices[i+1]  + self.dividends[i + 1]) / self.prices[i]) for i in range(len(self.prices) - 1)]
+        self.update_returns()
 
-    def next_dividend(self):
+        return self.log_returns.view()
+
+    def dividend_shock_params(self):
         """
-        Gets a new dividend value from the old dividend value.
-        Uses the dividend growth rate and std.
-        A lognormal walk by default, can be overridden.
+        Returns the mean and standard deviation of the normal distribution
+        underlying the lognormal dividend shock.
         """
-
         div_psi_ror = 1
         # target variance of the price distribution with no broker impact
         div_psi_std = self.dividend_shock_std
@@ -144,8 +358,29 @@ class AbstractMarket(ABC):
         # standard deviation of underlying distribution
         exp_std = np.sqrt(np.log(1 + div_psi_std ** 2 / div_psi_ror ** 2))
 
+        return exp_ror, exp_std
+
+    def next_dividend(self):
+        """
+        Gets a new dividend value from the old dividend value.
+        Uses the dividend growth rate and std.
+        A lognormal walk by default, can be overridden.
+        """
+        exp_ror, exp_std = self.dividend_shock_params()
+
         return self.dividends[-1] * self.rng.lognormal(exp_ror, exp_std) * self.dividend_growth_rate
 
+    def next_dividends(self, n_days):
+        """
+        Gets the next n_days dividend values of the lognormal walk at once.
+        Draws from the rng the same shocks as n_days calls to next_dividend.
+        """
+        exp_ror, exp_std = self.dividend_shock_params()
+
+        shocks = self.rng.lognormal(exp_ror, exp_std, size=n_days)
+
+        return self.dividends[-1] * np.cumprod(shocks * self.dividend_growth_rate)
+
 
 class MockMarket(AbstractMarket):
     """
@@ -175,6 +410,9 @@ class MockMarket(AbstractMarket):
 
     rng = None
 
+    # prices follow the dividends, whatever the orders
+    order_responsive = False
+
     def __init__(
         self,
         dividend_growth_rate = 1.000628,
@@ -190,9 +428,10 @@ class MockMarket(AbstractMarket):
         self.dividend_growth_rate = dividend_growth_rate
         self.dividend_shock_std = dividend_std  / math.sqrt(dividend_growth_rate)
 
-        self.prices = [self.default_sim_price]
-        self.dividends = [self.default_sim_price / self.price_to_dividend_ratio]
-        self.ranges = []
+        self.prices = SeriesBuffer([self.default_sim_price])
+        self.dividends = SeriesBuffer([self.default_sim_price / self.price_to_dividend_ratio])
+        self.ranges = SeriesBuffer()
+        self.reset_returns()
 
         self.rng = rng if rng is not None else np.random.default_rng()
 
@@ -203,22 +442,42 @@ class MockMarket(AbstractMarket):
         self.last_seed = seed
         self.last_buy_sell = buy_sell
 
-        print("run_market, buy_sell: " + str(buy_sell))
-        print(run_args)
-
         new_dividend = self.next_dividend()
         new_price = new_dividend * self.price_to_dividend_ratio
 
         self.prices.append(new_price) ## TODO: Should this be when the new rate of return is computed?
 
-        print('price: ' + str(new_price))
-        print('dividend: ' + str(new_dividend))
+        events.emit(
+            "market_run",
+            "debug",
+            buy_sell=buy_sell,
+            run_args=run_args,
+            price=new_price,
+            dividend=new_dividend,
+        )
 
         self.dividends.append(new_dividend)
         self.ranges.append(new_price / 10) # entirely arbitrary value for now.
 
         return new_price, new_dividend
 
+    def run_market_path(self, n_days):
+        """
+        Runs the market for n_days days at once.
+        As orders have no effect, the whole dividend walk is drawn in one pass.
+        Returns arrays of the new prices and dividends.
+        """
+        self.last_buy_sell = (0, 0)
+
+        new_dividends = self.next_dividends(n_days)
+        new_prices = new_dividends * self.price_to_dividend_ratio
+
+        self.prices.extend(new_prices)
+        self.dividends.extend(new_dividends)
+        self.ranges.extend(new_prices / 10)
+
+        return new_prices, new_dividends
+
     def get_simulation_price(self):
         """
         Get the price from the simulation run.
@@ -1,5 +1,6 @@
 from sharkfin.utilities import *
-from sharkfin.markets import AbstractMarket
+from sharkfin.events import events
+from sharkfin.markets import AbstractMarket, SeriesBuffer
 import math
 import numpy as np
 import json
@@ -7,12 +8,112 @@ import pika
 import uuid
 import os
 import time
+from collections import deque, namedtuple
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# The encodings of the messages to and from the market, by content type
+ENCODINGS = {
+    "json": "application/json",
+    "msgpack": "application/msgpack",
+}
+
+# A response from the market, as received by a transport
+Message = namedtuple("Message", ["correlation_id", "body", "content_type"])
+
 
 class MarketFailureError(Exception):
     pass
 
 
+class MarketTimeoutError(MarketFailureError):
+    """
+    Raised when the market does not respond before the deadline.
+    """
+    pass
+
+
+class PikaTransport:
+    """
+    Carries the messages of a ClientRPCMarket over RabbitMQ.
+
+    A transport sends requests to a market queue with send(), and hands
+    over the responses it has received, one at a time, with receive().
+    See also the transports of sharkfin.markets.ammps_local.
+
+    Parameters
+    ----------
+
+    host: str - the RabbitMQ server
+    """
+
+    def __init__(self, host='localhost'):
+        self.connection = pika.BlockingConnection(
+            pika.ConnectionParameters(host=host)
+        )
+
+        self.channel = self.connection.channel()
+
+        result = self.channel.queue_declare(queue='', exclusive=False)
+        self.callback_queue = result.method.queue
+
+        self.received = deque()
+
+        self.channel.basic_consume(
+            queue=self.callback_queue,
+            on_message_callback=self.on_message,
+            auto_ack=True,
+        )
+
+    def on_message(self, ch, method, props, body):
+        self.received.append(Message(props.correlation_id, body, props.content_type))
+
+    def send(self, queue_name, body, content_type=None, correlation_id=None):
+        self.channel.basic_publish(
+            exchange='',
+            routing_key=queue_name,
+            properties=pika.BasicProperties(
+                reply_to=self.callback_queue,
+                correlation_id=correlation_id,
+                content_type=content_type,
+            ),
+            body=body,
+        )
+
+    def receive(self, time_limit=None):
+        """
+        The next message received, waiting up to time_limit seconds
+        for one, or None.
+        """
+        if not self.received:
+            # returns as soon as a message has been dispatched to on_message
+            self.connection.process_data_events(time_limit=time_limit)
+
+        return self.received.popleft() if self.received else None
+
+    def close(self):
+        self.channel.queue_delete(self.callback_queue)
+        self.connection.close()
+
+
 class ClientRPCMarket(AbstractMarket):
+    """
+    A market run by an AMMPS server, reached by RPC over RabbitMQ.
+
+    Each day is a request {'bl', 'sl', 'dividend', 'end_simulation'}, with
+    the buy and sell limits, answered by {'ClosingPrice', 'DailyRange'} and
+    possibly 'MarketState'.
+
+    If batched, days with orders known in advance are sent in one request,
+    {'days': [{'bl', 'sl', 'dividend'}, ...], 'end_simulation'}, answered
+    with lists of the 'ClosingPrice' and 'DailyRange' of each day.
+
+    The messages are carried by a transport: by default, a PikaTransport
+    to the RabbitMQ server at host.
+    """
 
     dividend_growth_rate = None
     
@@ -27,6 +128,27 @@ class ClientRPCMarket(AbstractMarket):
     macro_price_field = None
     range_field = None
 
+    # Seconds to wait for the market's response to a request before
+    # raising a MarketTimeoutError. If None, wait indefinitely.
+    timeout = None
+
+    # Longest time, in seconds, that the client blocks on the connection
+    # at once while waiting for a response.
+    poll_interval = 1.0
+
+    # Whether days with orders known in advance, such as the burn-in,
+    # are sent to the market in one batched request.
+    # The market must support batched requests.
+    batched = False
+
+    # The encoding of requests: "json", or "msgpack".
+    # The market replies in the encoding it supports, named by the
+    # content type of its response.
+    encoding = "json"
+
+    # Carries the messages to and from the market
+    transport = None
+
     def __init__(self,
         seed=None,
         queue_name='',
@@ -36,7 +158,12 @@ class ClientRPCMarket(AbstractMarket):
         price_to_dividend_ratio = 60 / 0.05,
         rng = None,
         macro_price_field = None,
-        range_field = None
+        range_field = None,
+        timeout = None,
+        poll_interval = None,
+        batched = False,
+        encoding = None,
+        transport = None
         ):
 
         # discounted future value, divided by days per quarter
@@ -51,9 +178,10 @@ class ClientRPCMarket(AbstractMarket):
         self.rng = rng if rng is not None else np.random.default_rng()
 
         self.latest_price = None
-        self.prices = [self.default_sim_price]
-        self.dividends = [self.default_sim_price / self.price_to_dividend_ratio]
-        self.ranges = []
+        self.prices = SeriesBuffer([self.default_sim_price])
+        self.dividends = SeriesBuffer([self.default_sim_price / self.price_to_dividend_ratio])
+        self.ranges = SeriesBuffer()
+        self.reset_returns()
 
         self.rpc_queue_name = queue_name
         self.rpc_host_name = host
@@ -66,6 +194,24 @@ class ClientRPCMarket(AbstractMarket):
             if range_field is not None \
             else "DailyRange"
 
+        self.timeout = timeout
+
+        if poll_interval is not None:
+            self.poll_interval = poll_interval
+
+        self.batched = batched
+
+        if encoding is not None:
+            if encoding not in ENCODINGS:
+                raise ValueError(f"Unknown encoding {encoding}. Options: {list(ENCODINGS)}")
+
+            if encoding == "msgpack" and msgpack is None:
+                raise ImportError("The msgpack encoding requires msgpack.")
+
+            self.encoding = encoding
+
+        self.transport = transport
+
         self.init_rpc()
 
     def _get_rpc_market_host(self):
@@ -89,33 +235,42 @@ class ClientRPCMarket(AbstractMarket):
         return rpc_queue_name
 
     def init_rpc(self):
-        self.connection = pika.BlockingConnection(
-            pika.ConnectionParameters(host=self.rpc_host_name)
-        )
+        if self.transport is None:
+            self.transport = PikaTransport(self.rpc_host_name)
 
-        self.channel = self.connection.channel()
-
-        result = self.channel.queue_declare(queue='', exclusive=False)
-        self.callback_queue = result.method.queue
+    def on_response(self, message):
+        if self.corr_id == message.correlation_id:
+            self.response = self.decode_response(message.body, message.content_type)
 
-        self.channel.basic_consume(
-            queue=self.callback_queue,
-            on_message_callback=self.on_response,
-            auto_ack=True,
-        )
+    def encode_request(self, data):
+        """
+        The body and content type of a request to the market.
+        """
+        if self.encoding == "msgpack":
+            return msgpack.packb(data), ENCODINGS["msgpack"]
 
-    def on_response(self, ch, method, props, body):
-        if self.corr_id == props.correlation_id:
-            try:
-                ## If the body is just a number, it's the closing price.
-                ## This is an option that will be deprecated one day
-                self.response = { self.macro_price_field  : float(body)}
-            except ValueError:
-                ## Moving forward, the body should be JSON.
-                self.response = json.loads(body)
+        return json.dumps(data), ENCODINGS["json"]
 
-    def run_market(self, buy_sell=(0, 0), run_args = None):
+    def decode_response(self, body, content_type=None):
+        """
+        The dict of a response body from the market.
+        """
+        if content_type == ENCODINGS["msgpack"]:
+            return msgpack.unpackb(body)
 
+        try:
+            ## If the body is just a number, it's the closing price.
+            ## This is an option that will be deprecated one day
+            return { self.macro_price_field  : float(body)}
+        except ValueError:
+            ## Moving forward, the body should be JSON.
+            return json.loads(body)
+
+    def market_request(self, buy_sell=(0, 0), run_args = None):
+        """
+        Draws the next dividend and returns the request for a day of
+        the market with the given orders.
+        """
         self.last_buy_sell = buy_sell
 
         new_dividend = self.next_dividend()
@@ -131,27 +286,23 @@ class ClientRPCMarket(AbstractMarket):
         if run_args is not None:
             data.update(run_args)
 
-        self.response = None
-
-        self.publish(data)
+        return data
 
-        print('waiting for response...')
+    def market_response(self, request, response):
+        """
+        Records the market's response to a request for a day.
+        Returns the new price and dividend.
 
-        while self.response is None:
-            time.sleep(4)
-            self.connection.process_data_events()
+        Raises a MarketFailureError if the market has stopped.
+        """
+        self.response = response
 
-        print(f'response received:{self.response}')
+        events.emit("market_response", "debug", response=self.response)
 
         if 'MarketState' in self.response and self.response['MarketState'].startswith('Stopped'):
-            print("The market stopped! Do something!")
-            self.close_connection()
+            events.emit("market_stopped", "error", response=self.response)
 
-            self.latest_price = np.nan
-            self.prices.append(np.nan)
-            self.ranges.append(np.nan)
-
-            raise MarketFailureError(f"AMMPS Market Failure: {self.response['MarketState']}")
+            self.fail(MarketFailureError(f"AMMPS Market Failure: {self.response['MarketState']}"))
 
         else:
 
@@ -159,33 +310,165 @@ class ClientRPCMarket(AbstractMarket):
             self.prices.append(float(self.response[ self.macro_price_field ]))
             self.ranges.append(float(self.response[self.range_field]))
         
-            return self.latest_price, new_dividend
+            return self.latest_price, request['dividend']
+
+    def run_market(self, buy_sell=(0, 0), run_args = None):
+
+        data = self.market_request(buy_sell, run_args)
+
+        return self.market_response(data, self.round_trip(data))
+
+    def run_market_batch(self, buy_sells, run_args = None):
+        """
+        Runs the market for one day for each of the given orders.
+
+        If the market is batched, all the days are sent in one request,
+        and the response has the prices and ranges of each day.
+        Otherwise, the days are run one at a time.
+        """
+        if not self.batched:
+            return super().run_market_batch(buy_sells, run_args=run_args)
+
+        days = [
+            {key: request[key] for key in ('bl', 'sl', 'dividend')}
+            for request in [self.market_request(buy_sell) for buy_sell in buy_sells]
+        ]
+
+        data = {'days': days, 'end_simulation': False}
+
+        if run_args is not None:
+            data.update(run_args)
+
+        try:
+            response = self.round_trip(data)
+        except MarketFailureError:
+            # with no response, only the first day is recorded, as missing
+            self.dividends.truncate(len(self.dividends) - len(days) + 1)
+            raise
+
+        return self.market_batch_response(data, response)
+
+    def market_batch_response(self, request, response):
+        """
+        Records the market's response to a batched request.
+        Returns arrays of the new prices and dividends.
+
+        Raises a MarketFailureError if the market has stopped, once the
+        days it ran before stopping are recorded.
+        """
+        self.response = response
+
+        events.emit("market_response", "debug", response=self.response)
+
+        days = request['days']
+
+        prices = np.asarray(self.response.get(self.macro_price_field, []), dtype=float)[: len(days)]
+        ranges = np.asarray(self.response.get(self.range_field, []), dtype=float)[: len(prices)]
+
+        if len(prices) < len(days):
+            # the dividends of the days after the failing one are dropped
+            self.dividends.truncate(len(self.dividends) - (len(days) - len(prices)) + 1)
+
+        self.prices.extend(prices)
+        self.ranges.extend(ranges)
+
+        if 'MarketState' in self.response and self.response['MarketState'].startswith('Stopped'):
+            events.emit("market_stopped", "error", response=self.response)
+
+            # a market that stopped after running every day has no missing day to record
+            self.fail(
+                MarketFailureError(f"AMMPS Market Failure: {self.response['MarketState']}"),
+                missing_day=len(prices) < len(days),
+            )
+
+        if len(prices) < len(days):
+            self.fail(MarketFailureError(
+                f"AMMPS Market Failure: Incomplete batch: {len(prices)} of {len(days)} days"
+            ))
+
+        self.latest_price = prices[-1] if len(prices) > 0 else self.latest_price
+
+        return prices, np.array([day['dividend'] for day in days], dtype=float)
+
+    def round_trip(self, data):
+        """
+        Sends a request to the market and returns its response.
+        """
+        self.response = None
+
+        self.publish(data)
+
+        events.emit("market_request", "debug", request=data)
+
+        self.wait_for_response()
+
+        return self.response
+
+    def wait_for_response(self):
+        """
+        Blocks on the transport until on_response receives the
+        response to the latest request.
+
+        Raises a MarketTimeoutError if there is no response within
+        timeout seconds.
+        """
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+
+        while self.response is None:
+            time_limit = self.poll_interval
+
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+
+                if remaining <= 0:
+                    events.emit("market_timeout", "error", timeout=self.timeout)
+
+                    self.fail(MarketTimeoutError(
+                        f"AMMPS Market Failure: Timed out: no response within {self.timeout} seconds"
+                    ))
+
+                time_limit = min(time_limit, remaining)
+
+            message = self.transport.receive(time_limit=time_limit)
+
+            if message is not None:
+                self.on_response(message)
+
+    def fail(self, error, missing_day=True):
+        """
+        Closes the connection, records the day as missing, if there is
+        one, and raises the error.
+        """
+        self.close_connection()
+
+        if missing_day:
+            self.latest_price = np.nan
+            self.prices.append(np.nan)
+            self.ranges.append(np.nan)
+
+        raise error
 
     def get_simulation_price(self, buy_sell=(0, 0)):
         return self.latest_price
 
     def publish(self, data):
         self.corr_id = str(uuid.uuid4())
-        self.channel.basic_publish(
-            exchange='',
-            routing_key=self.rpc_queue_name,
-            properties=pika.BasicProperties(
-                reply_to=self.callback_queue,
-                correlation_id=self.corr_id,
-            ),
-            body=json.dumps(data),
-        )
 
+        body, content_type = self.encode_request(data)
+
+        self.transport.send(
+            self.rpc_queue_name,
+            body,
+            content_type=content_type,
+            correlation_id=self.corr_id,
+        )
 
     def close_market(self):
         self.publish({'seed': 0, 'bl': 0, 'sl': 0, 'dividend' : 0, 'end_simulation': True})
         self.close_connection()
 
     def close_connection(self):
-        self.channel.queue_delete(self.callback_queue)
-        
         try:
-            self.connection.close()
+            self.transport.close()
         except Exception as e:
-            print("Connetion is already closed?")
-            print(e)
+            events.emit("connection_already_closed", "warning", error=str(e))
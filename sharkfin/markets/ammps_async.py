@@ -0,0 +1,256 @@
+"""
+Running many AMMPS-backed simulations concurrently in one process.
+
+A ClientRPCMarket blocks its simulation on each round trip to the market,
+so a process running one simulation is idle most of the time.
+Here, one AsyncRPCClient holds a single asyncio connection to RabbitMQ
+for many AsyncClientRPCMarkets, each with its own market queue.
+simulate_concurrently runs their simulations at once: while some wait on
+their markets, the others compute.
+
+The simulations themselves are unchanged. Each runs in a worker thread,
+and its market hands each request over to the client's event loop and
+waits for the response there. Requires aio-pika.
+
+    async def main():
+        async with AsyncRPCClient(host="localhost") as client:
+            simulations = [
+                AttentionSimulation(
+                    pop, fm, market=AsyncClientRPCMarket(client, queue_name=queue), ...
+                )
+                for pop, queue in ...
+            ]
+
+            await simulate_concurrently(simulations, burn_in=30)
+
+    asyncio.run(main())
+"""
+
+import asyncio
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from sharkfin.events import events
+from sharkfin.markets.ammps import ClientRPCMarket, MarketTimeoutError
+
+try:
+    import aio_pika
+except ImportError:
+    aio_pika = None
+
+
+class AsyncRPCClient:
+    """
+    An asyncio RPC client of AMMPS markets.
+
+    It holds one connection and one callback queue for all of its markets.
+    Responses are matched to requests by their correlation id.
+
+    Use it as an async context manager, or call connect() and close().
+
+    Parameters
+    ----------
+
+    host: str - the RabbitMQ server
+    """
+
+    def __init__(self, host="localhost"):
+        if aio_pika is None:
+            raise ImportError("The asyncio RPC client requires aio-pika.")
+
+        self.host = host
+
+        self.loop = None
+        self.connection = None
+        self.channel = None
+        self.callback_queue = None
+
+        # the futures of the requests awaiting a response, by correlation id
+        self.futures = {}
+
+    async def connect(self):
+        self.loop = asyncio.get_running_loop()
+
+        self.connection = await aio_pika.connect_robust(host=self.host)
+        self.channel = await self.connection.channel()
+
+        self.callback_queue = await self.channel.declare_queue(exclusive=True)
+        await self.callback_queue.consume(self.on_response, no_ack=True)
+
+        return self
+
+    async def close(self):
+        for future in self.futures.values():
+            future.cancel()
+
+        self.futures = {}
+
+        if self.connection is not None:
+            await self.connection.close()
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def on_response(self, message):
+        future = self.futures.pop(message.correlation_id, None)
+
+        if future is not None and not future.done():
+            future.set_result((message.body, message.content_type))
+
+    async def publish(self, queue_name, body, content_type=None, correlation_id=None):
+        if isinstance(body, str):
+            body = body.encode()
+
+        await self.channel.default_exchange.publish(
+            aio_pika.Message(
+                body=body,
+                content_type=content_type,
+                correlation_id=correlation_id,
+                reply_to=self.callback_queue.name,
+            ),
+            routing_key=queue_name,
+        )
+
+    async def call(self, queue_name, body, content_type=None, timeout=None):
+        """
+        Sends a request body to a market queue and returns the body
+        and content type of the response.
+
+        Raises a MarketTimeoutError if there is no response within
+        timeout seconds.
+        """
+        correlation_id = str(uuid.uuid4())
+        future = self.loop.create_future()
+        self.futures[correlation_id] = future
+
+        try:
+            await self.publish(
+                queue_name, body, content_type=content_type, correlation_id=correlation_id
+            )
+
+            return await asyncio.wait_for(future, timeout)
+
+        except asyncio.TimeoutError:
+            raise MarketTimeoutError(
+                f"AMMPS Market Failure: Timed out: no response within {timeout} seconds"
+            )
+
+        finally:
+            self.futures.pop(correlation_id, None)
+
+    def call_from_thread(self, queue_name, body, content_type=None, timeout=None):
+        """
+        Makes a call from a thread other than the event loop's,
+        blocking that thread until the response.
+        """
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        if running is self.loop:
+            raise RuntimeError(
+                "Markets of an AsyncRPCClient cannot be run on its event loop. "
+                "Run their simulations with simulate_concurrently."
+            )
+
+        return asyncio.run_coroutine_threadsafe(
+            self.call(queue_name, body, content_type=content_type, timeout=timeout),
+            self.loop,
+        ).result()
+
+
+class AsyncClientRPCMarket(ClientRPCMarket):
+    """
+    An AMMPS market reached through a shared AsyncRPCClient.
+
+    It behaves like a ClientRPCMarket, but must be run from a thread
+    other than the client's event loop, as simulate_concurrently does.
+
+    Parameters
+    ----------
+
+    client: AsyncRPCClient - a connected client
+
+    Other parameters are those of ClientRPCMarket,
+    except the host, which is the client's.
+    """
+
+    def __init__(self, client, **kwargs):
+        self.client = client
+
+        super().__init__(host=client.host, **kwargs)
+
+    def init_rpc(self):
+        # the connection is the client's
+        pass
+
+    def round_trip(self, data):
+
+        self.response = None
+
+        events.emit("market_request", "debug", request=data)
+
+        try:
+            body, content_type = self.client.call_from_thread(
+                self.rpc_queue_name, *self.encode_request(data), timeout=self.timeout
+            )
+        except MarketTimeoutError as e:
+            events.emit("market_timeout", "error", timeout=self.timeout)
+            self.fail(e)
+
+        self.response = self.decode_response(body, content_type)
+
+        return self.response
+
+    def close_market(self):
+        asyncio.run_coroutine_threadsafe(
+            self.client.publish(
+                self.rpc_queue_name,
+                *self.encode_request(
+                    {'seed': 0, 'bl': 0, 'sl': 0, 'dividend' : 0, 'end_simulation': True}
+                ),
+            ),
+            self.client.loop,
+        ).result()
+
+    def close_connection(self):
+        # the connection is the client's, and stays open for its other markets
+        pass
+
+
+async def simulate_concurrently(simulations, max_workers=None, **kwargs):
+    """
+    Runs many simulations at once, each in a worker thread, so that the
+    round trips of their markets overlap with each other's computation.
+
+    Parameters
+    ----------
+
+    simulations: [MarketSimulation] - simulations with markets that do not
+        block the event loop, such as AsyncClientRPCMarkets
+
+    max_workers: int or None - the number of simulations run at once.
+        Defaults to all of them.
+
+    kwargs: passed on to the simulate() of each simulation
+
+    Returns
+    -------
+
+    The simulations, in order, once they have all finished.
+    """
+    loop = asyncio.get_running_loop()
+
+    with ThreadPoolExecutor(max_workers=max_workers or max(1, len(simulations))) as executor:
+        await asyncio.gather(
+            *(
+                loop.run_in_executor(executor, lambda sim=sim: sim.simulate(**kwargs))
+                for sim in simulations
+            )
+        )
+
+    return simulations
@@ -0,0 +1,439 @@
+"""
+A local stand-in for the AMMPS market server, so that the ClientRPCMarket
+can be tested and benchmarked without RabbitMQ or AMMPS.
+
+LocalAMMPS speaks the AMMPS protocol of the ClientRPCMarket, including
+batched requests and the msgpack encoding, with a simple price-impact
+model: the price is the dividend times the price-to-dividend ratio,
+moved by a decaying impact of the net orders of each day.
+It can also be made to fail as AMMPS does: by leaving its price range,
+by running past its final day, or by not responding at all.
+
+It is reached by a ClientRPCMarket through a transport:
+
+ - QueueTransport: in this process, served from a background thread
+ - SocketTransport: over a TCP socket to a LocalAMMPSServer,
+   which may run in another process:
+
+        python -m sharkfin.markets.ammps_local --port 5700
+
+For example:
+
+    market = ClientRPCMarket(transport=QueueTransport(LocalAMMPS(price_impact=1e-6)))
+"""
+
+import argparse
+import json
+import math
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+from sharkfin.markets.ammps import ENCODINGS, Message
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# The lengths of the header and body of a frame on a socket
+FRAME_PREFIX = struct.Struct("!II")
+
+
+class LocalAMMPS:
+    """
+    A stand-in for an AMMPS market. See the module documentation.
+
+    Parameters
+    ----------
+
+    price_to_dividend_ratio: float - the ratio of the price to the dividend,
+        without the impact of orders
+
+    price_impact: float - the change in the log price per share of net orders
+
+    impact_decay: float - the share of the impact of past orders that
+        remains each day
+
+    range_fraction: float - the daily range, as a fraction of the price,
+        on a day with no change in price
+
+    price_range: (float, float) - the lowest and highest prices the market
+        maker accepts. Outside of them, the market stops.
+
+    max_days: int or None - the number of days the market runs.
+        It stops on a request for the day after.
+
+    respond_days: int or None - the number of days the market responds to.
+        Later requests get no response, to test timeouts.
+
+    delay: float - seconds taken to respond to each request
+    """
+
+    def __init__(
+        self,
+        price_to_dividend_ratio=60 / 0.05,
+        price_impact=1e-6,
+        impact_decay=0.5,
+        range_fraction=0.01,
+        price_range=(1.0, 10000.0),
+        max_days=None,
+        respond_days=None,
+        delay=0.0,
+    ):
+        self.price_to_dividend_ratio = price_to_dividend_ratio
+        self.price_impact = price_impact
+        self.impact_decay = impact_decay
+        self.range_fraction = range_fraction
+        self.price_range = price_range
+        self.max_days = max_days
+        self.respond_days = respond_days
+        self.delay = delay
+
+        # the number of days run, and the requests received
+        self.day = 0
+        self.requests = 0
+
+        self.impact = 0.0
+        self.price = None
+
+        # the state of the market once it has stopped
+        self.stopped = None
+        self.ended = False
+
+    def run_day(self, bl, sl, dividend):
+        """
+        Runs the market for one day.
+
+        Returns
+        -------
+
+        The closing price and daily range, or None and None if the
+        market has stopped, and the state of the market.
+        """
+        if self.stopped is not None:
+            return None, None, self.stopped
+
+        self.day += 1
+
+        if self.max_days is not None and self.day > self.max_days:
+            self.stopped = "Stopped: Simulated final day but did not receive signal to end"
+            return None, None, self.stopped
+
+        self.impact = self.impact_decay * self.impact + self.price_impact * (bl - sl)
+
+        # compared in logs, as the impact of large orders may overflow the price
+        log_price = math.log(dividend * self.price_to_dividend_ratio) + self.impact
+
+        low, high = self.price_range
+
+        if not math.log(low) <= log_price <= math.log(high):
+            self.stopped = (
+                "Stopped: Hit market maker price range, shutting market down. "
+                f"Log price {log_price} is outside range {low} , {high}"
+            )
+            return None, None, self.stopped
+
+        price = math.exp(log_price)
+
+        daily_range = price * self.range_fraction
+
+        if self.price is not None:
+            daily_range += abs(price - self.price)
+
+        self.price = price
+
+        return price, daily_range, "Running"
+
+    def handle(self, request):
+        """
+        The response to a request, as a dict, or None if there is none.
+        """
+        self.requests += 1
+
+        if request.get("end_simulation", False):
+            self.ended = True
+            return None
+
+        if self.respond_days is not None and self.day >= self.respond_days:
+            return None
+
+        if "days" in request:
+            prices = []
+            ranges = []
+            state = "Running"
+
+            for day in request["days"]:
+                price, daily_range, state = self.run_day(
+                    day["bl"], day["sl"], day["dividend"]
+                )
+
+                if price is None:
+                    break
+
+                prices.append(price)
+                ranges.append(daily_range)
+
+            return {"ClosingPrice": prices, "DailyRange": ranges, "MarketState": state}
+
+        price, daily_range, state = self.run_day(
+            request["bl"], request["sl"], request["dividend"]
+        )
+
+        return {"ClosingPrice": price, "DailyRange": daily_range, "MarketState": state}
+
+    def respond(self, body, content_type=None):
+        """
+        The body and content type of the response to the body of a request,
+        or None if there is none. The response is in the encoding of the
+        request, if the market supports it, and JSON otherwise.
+        """
+        msgpack_request = content_type == ENCODINGS["msgpack"] and msgpack is not None
+
+        request = msgpack.unpackb(body) if msgpack_request else json.loads(body)
+
+        response = self.handle(request)
+
+        if response is None:
+            return None
+
+        if self.delay:
+            time.sleep(self.delay)
+
+        if msgpack_request:
+            return msgpack.packb(response), ENCODINGS["msgpack"]
+
+        return json.dumps(response), ENCODINGS["json"]
+
+
+class QueueTransport:
+    """
+    Carries the messages of a ClientRPCMarket to a LocalAMMPS in this
+    process, which answers them from a background thread.
+    See PikaTransport for the interface of a transport.
+
+    Parameters
+    ----------
+
+    market: LocalAMMPS or None - the market. Defaults to a LocalAMMPS.
+    """
+
+    def __init__(self, market=None):
+        self.market = market if market is not None else LocalAMMPS()
+
+        self.requests = queue.Queue()
+        self.responses = queue.Queue()
+
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        while True:
+            request = self.requests.get()
+
+            if request is None:
+                return
+
+            correlation_id, body, content_type = request
+
+            response = self.market.respond(body, content_type)
+
+            if response is not None:
+                self.responses.put(Message(correlation_id, *response))
+
+    def send(self, queue_name, body, content_type=None, correlation_id=None):
+        self.requests.put((correlation_id, body, content_type))
+
+    def receive(self, time_limit=None):
+        try:
+            return self.responses.get(timeout=time_limit)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        # the requests sent before closing are answered first
+        self.requests.put(None)
+        self.thread.join()
+
+
+def pack_frame(header, body):
+    """
+    A frame of a message on a socket: the lengths of its JSON header
+    and of its body, then the header and body.
+    """
+    header = json.dumps(header).encode()
+
+    if isinstance(body, str):
+        body = body.encode()
+
+    return FRAME_PREFIX.pack(len(header), len(body)) + header + body
+
+
+def unpack_frame(buffer):
+    """
+    The header and body of the first frame in a buffer, and the rest
+    of the buffer, or None if the buffer has no complete frame.
+    """
+    if len(buffer) < FRAME_PREFIX.size:
+        return None
+
+    header_length, body_length = FRAME_PREFIX.unpack_from(buffer)
+    end = FRAME_PREFIX.size + header_length + body_length
+
+    if len(buffer) < end:
+        return None
+
+    header = json.loads(buffer[FRAME_PREFIX.size : FRAME_PREFIX.size + header_length])
+    body = bytes(buffer[FRAME_PREFIX.size + header_length : end])
+
+    return header, body, buffer[end:]
+
+
+class SocketTransport:
+    """
+    Carries the messages of a ClientRPCMarket over a TCP socket
+    to a LocalAMMPSServer.
+    See PikaTransport for the interface of a transport.
+
+    Parameters
+    ----------
+
+    host: str - the server
+
+    port: int - the port of the server
+    """
+
+    def __init__(self, host="localhost", port=5700):
+        self.socket = socket.create_connection((host, port))
+        self.buffer = b""
+
+    def send(self, queue_name, body, content_type=None, correlation_id=None):
+        self.socket.sendall(
+            pack_frame({"correlation_id": correlation_id, "content_type": content_type}, body)
+        )
+
+    def receive(self, time_limit=None):
+        frame = unpack_frame(self.buffer)
+
+        if frame is None:
+            self.socket.settimeout(None if time_limit is None else max(time_limit, 1e-3))
+
+            try:
+                chunk = self.socket.recv(65536)
+            except socket.timeout:
+                return None
+
+            if not chunk:
+                raise ConnectionError("The market server closed the connection.")
+
+            self.buffer += chunk
+
+            frame = unpack_frame(self.buffer)
+
+            if frame is None:
+                return None
+
+        header, body, self.buffer = frame
+
+        return Message(header["correlation_id"], body, header["content_type"])
+
+    def close(self):
+        self.socket.close()
+
+
+class LocalAMMPSHandler(socketserver.BaseRequestHandler):
+    """
+    Serves one client of a LocalAMMPSServer with its own LocalAMMPS.
+    """
+
+    def handle(self):
+        market = self.server.make_market()
+        buffer = b""
+
+        while True:
+            frame = unpack_frame(buffer)
+
+            if frame is None:
+                chunk = self.request.recv(65536)
+
+                if not chunk:
+                    return
+
+                buffer += chunk
+                continue
+
+            header, body, buffer = frame
+
+            response = market.respond(body, header.get("content_type"))
+
+            if response is not None:
+                body, content_type = response
+
+                self.request.sendall(
+                    pack_frame(
+                        {
+                            "correlation_id": header.get("correlation_id"),
+                            "content_type": content_type,
+                        },
+                        body,
+                    )
+                )
+
+
+class LocalAMMPSServer(socketserver.ThreadingTCPServer):
+    """
+    A TCP server of LocalAMMPS markets, one for each client connection,
+    as AMMPS runs one market for each queue.
+
+    Parameters
+    ----------
+
+    address: (str, int) - the host and port. Port 0 picks a free port,
+        which is then in server_address.
+
+    market_args: the parameters of the LocalAMMPS of each client
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=("localhost", 0), **market_args):
+        self.market_args = market_args
+
+        super().__init__(address, LocalAMMPSHandler)
+
+    def make_market(self):
+        return LocalAMMPS(**self.market_args)
+
+    def serve_in_thread(self):
+        """
+        Serves from a background thread, until shutdown() is called.
+        """
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+
+        return thread
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--host", help="host to serve on", default="localhost")
+parser.add_argument("--port", help="port to serve on", type=int, default=5700)
+parser.add_argument("--pdr", help="price to dividend ratio", type=float, default=60 / 0.05)
+parser.add_argument("--impact", help="change in log price per net share", type=float, default=1e-6)
+parser.add_argument("--delay", help="seconds taken to respond", type=float, default=0.0)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    with LocalAMMPSServer(
+        (args.host, args.port),
+        price_to_dividend_ratio=args.pdr,
+        price_impact=args.impact,
+        delay=args.delay,
+    ) as server:
+        print(f"Serving LocalAMMPS on {server.server_address}")
+        server.serve_forever()
@@ -0,0 +1,275 @@
+"""
+Policy functions of a population, tabulated on dense grids.
+
+A merged solution represents each policy function of a solution class
+as a grid of 1D interpolators, one for each combination of the ex-post
+heterogeneous parameters (the agents' expectations). HARK evaluates
+such an interpolator one grid cell at a time, and each class separately.
+
+A TabulatedPolicy holds the values of a policy function of every class
+in one dense array, with a dimension for the class, one for each ex-post
+parameter and one for normalized assets (or market resources), and
+evaluates it for a whole population at once by multilinear interpolation.
+"""
+
+import itertools
+from collections import OrderedDict
+
+import numpy as np
+
+
+def _brackets(grid, values):
+    """
+    Finds, for each value, the cell of the grid that contains it,
+    and its position within that cell.
+
+    Values outside the grid are placed in the nearest cell,
+    so that they are extrapolated linearly, as HARK's interpolators do.
+
+    Returns
+    -------
+
+    The index of the upper end of each cell, and the weight of that end.
+    """
+    upper = np.clip(np.searchsorted(grid, values), 1, len(grid) - 1)
+    weight = (values - grid[upper - 1]) / (grid[upper] - grid[upper - 1])
+
+    return upper, weight
+
+
+def _asset_grid(functions, max_points=None):
+    """
+    The grid of assets on which the functions are tabulated: the knots of
+    all the functions, thinned out evenly to at most max_points, if given.
+
+    Each function is linear between its own first and last knots, so while
+    no knots are dropped, the table of a function is exact within them.
+    Outside them, it holds the function's extrapolation, which may not be
+    linear, or nan. See TabulatedPolicy.in_range.
+    """
+    knots = np.unique(np.concatenate([f.x_list for f in functions]))
+
+    if max_points is not None and len(knots) > max_points:
+        keep = np.linspace(0, len(knots) - 1, max_points).round().astype(int)
+        knots = knots[np.unique(keep)]
+
+    return knots
+
+
+class TabulatedPolicy:
+    """
+    A policy function of several solution classes, tabulated on a dense grid.
+
+    Parameters
+    ----------
+
+    functions: list - for each class, an array of 1D interpolators with one
+        dimension for each ex-post parameter. Element (i, j, ...) is the
+        policy of the class when the ex-post parameters are
+        (grids[0][i], grids[1][j], ...).
+
+    grids: [np.array] - the values of each ex-post parameter,
+        the same for every class.
+
+    max_points: int or None - the largest number of points in the asset grid.
+        By default, the grid has every knot of the functions, and the
+        tabulated policy of a class is exact within the knots of its own
+        functions. With fewer points, knots are dropped, and the largest
+        error of the table at the knots of the functions is in max_error.
+    """
+
+    def __init__(self, functions, grids, max_points=None):
+        functions = [np.asarray(f, dtype=object) for f in functions]
+
+        self.grids = [np.asarray(g, dtype=float) for g in grids]
+
+        for f in functions:
+            if f.shape != tuple(len(g) for g in self.grids):
+                raise ValueError(
+                    "Every class must have a function for each point of the grids."
+                )
+
+        x_functions = [x_function for f in functions for x_function in f.flat]
+
+        self.x_grid = _asset_grid(x_functions, max_points)
+
+        # dimensions: class, ex-post parameters, assets
+        self.values = np.array(
+            [
+                [x_function(self.x_grid) for x_function in f.flat]
+                for f in functions
+            ]
+        ).reshape((len(functions),) + functions[0].shape + (len(self.x_grid),))
+
+        self.strides = np.array(self.values.strides) // self.values.itemsize
+
+        # for each class, the points of the asset grid within the knots
+        # of all of its functions bound the assets it is tabulated for
+        lower = [max(x_function.x_list[0] for x_function in f.flat) for f in functions]
+        upper = [min(x_function.x_list[-1] for x_function in f.flat) for f in functions]
+
+        self.x_lower = self.x_grid[np.searchsorted(self.x_grid, lower)]
+        self.x_upper = self.x_grid[np.searchsorted(self.x_grid, upper, side="right") - 1]
+
+        self.max_error = 0.0
+
+        if max_points is not None:
+            self.max_error = max(
+                np.max(
+                    np.abs(
+                        np.interp(x_function.x_list, self.x_grid, values)
+                        - x_function.y_list
+                    )
+                )
+                for x_function, values in zip(
+                    x_functions, self.values.reshape(-1, len(self.x_grid))
+                )
+            )
+
+    def in_range(self, class_id, x):
+        """
+        Whether each value of x is within the knots of the functions of
+        its class, where the table holds the class's policy. Outside them,
+        the policy should be evaluated by the class's own functions.
+        """
+        class_id = np.asarray(class_id)
+
+        return (self.x_lower[class_id] <= x) & (x <= self.x_upper[class_id])
+
+    def slice(self, class_id, expectations):
+        """
+        The policy of one class with the given values of the ex-post
+        parameters, as its values on the asset grid.
+        """
+        values = self.values[class_id]
+
+        for grid, value in zip(self.grids, expectations):
+            upper, weight = _brackets(grid, value)
+            values = (1 - weight) * values[upper - 1] + weight * values[upper]
+
+        return values
+
+    def __call__(self, class_id, x, *expectations):
+        """
+        Evaluates the policy.
+
+        Parameters
+        ----------
+
+        class_id: np.array of int - the solution class of each agent
+
+        x: np.array - the assets (or market resources) of each agent,
+            within the asset grid
+
+        expectations: np.array - the value of each ex-post parameter
+            for each agent, in the order of the grids
+
+        Returns
+        -------
+
+        np.array with the policy of each agent.
+        """
+        base = np.asarray(class_id) * self.strides[0]
+        corners = []
+
+        for grid, values, stride in zip(
+            self.grids + [self.x_grid], list(expectations) + [x], self.strides[1:]
+        ):
+            upper, weight = _brackets(grid, np.asarray(values, dtype=float))
+            base = base + (upper - 1) * stride
+            corners.append(((0, 1 - weight), (stride, weight)))
+
+        flat = self.values.ravel()
+        result = np.zeros(len(base))
+
+        for corner in itertools.product(*corners):
+            offset = sum(c[0] for c in corner)
+            weight = np.prod([c[1] for c in corner], axis=0)
+            result += weight * flat[base + offset]
+
+        return result
+
+
+class PolicySlices:
+    """
+    Evaluates a TabulatedPolicy through a bounded, least recently used
+    cache of its 1D slices, keyed by the class and the quantized values of
+    the ex-post parameters.
+
+    Agents often share their expectations: a FinanceModel gives the same
+    expectations to every agent on a day. Those agents are evaluated
+    together, from one slice, by linear interpolation on the asset grid.
+
+    Parameters
+    ----------
+
+    policy: TabulatedPolicy
+
+    maxsize: int - the largest number of slices kept
+
+    quantum: float - the ex-post parameters are rounded to multiples of this
+
+    max_groups: int - if more combinations of class and expectations than
+        this are evaluated at once, the policy is evaluated directly instead
+    """
+
+    def __init__(self, policy, maxsize=256, quantum=1e-10, max_groups=64):
+        self.policy = policy
+        self.maxsize = maxsize
+        self.quantum = quantum
+        self.max_groups = max_groups
+
+        self.slices = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def slice(self, key):
+        """
+        The slice for a key of a class and quantized expectations.
+        """
+        if key in self.slices:
+            self.hits += 1
+            self.slices.move_to_end(key)
+
+            return self.slices[key]
+
+        self.misses += 1
+
+        values = self.policy.slice(
+            int(key[0]), [q * self.quantum for q in key[1:]]
+        )
+
+        self.slices[key] = values
+
+        if len(self.slices) > self.maxsize:
+            self.slices.popitem(last=False)
+
+        return values
+
+    def __call__(self, class_id, x, *expectations):
+        """
+        Evaluates the policy. See TabulatedPolicy.
+        """
+        keys = np.column_stack(
+            [class_id] + [np.round(np.asarray(e) / self.quantum) for e in expectations]
+        ).astype(float)
+
+        # each row of keys as a single value, which is faster to sort
+        rows = keys.view(np.dtype((np.void, keys.itemsize * keys.shape[1]))).ravel()
+        _, first, inverse = np.unique(rows, return_index=True, return_inverse=True)
+
+        if len(first) > self.max_groups:
+            return self.policy(class_id, x, *expectations)
+
+        if len(first) == 1:
+            return np.interp(x, self.policy.x_grid, self.slice(tuple(keys[0])))
+
+        result = np.empty(len(x))
+
+        for g, i in enumerate(first):
+            these = inverse == g
+            result[these] = np.interp(
+                x[these], self.policy.x_grid, self.slice(tuple(keys[i]))
+            )
+
+        return result
@@ -1,7 +1,8 @@
+import itertools
+import multiprocessing
 from copy import deepcopy
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 from functools import partial
-from pprint import pprint
 from typing import NewType
 
 import HARK.ConsumptionSaving.ConsIndShockModel as cism
@@ -10,11 +11,79 @@ import pandas as pd
 from HARK.core import AgentPopulation
 from HARK.interpolation import BilinearInterpOnInterp1D, TrilinearInterpOnInterp1D
 
+from sharkfin.attention import AttentionLog
+from sharkfin.events import events
+from sharkfin.policy import PolicySlices, TabulatedPolicy
 from sharkfin.utilities import *
 
 ParameterDict = NewType("ParameterDict", dict)
 
 
+def _fixed_expectations_policy(func, x, RiskyAvg, RiskyStd):
+    """
+    Wraps a policy function of a single argument so that it can be
+    called like a merged solution, ignoring the risky expectations.
+    """
+    return func(x)
+
+
+# The policy functions of a solution used by the simulations.
+POLICY_NAMES = ["cFuncAdj", "ShareFuncAdj", "SequentialShareFuncAdj"]
+
+# The values of each agent reported by agent_data and summarized by class_stats.
+REPORTED_FIELDS = ["aLvl", "mNrm", "cNrm", "mNrm_ratio_StE"]
+
+# The attributes of an AgentType set by solving it.
+SOLUTION_ATTRIBUTES = [
+    "solution",
+    "solution_terminal",
+    "solution_distance",
+    "completed_cycles",
+]
+
+
+def _solve_agent(agent_type, parameters):
+    """
+    Creates and solves an agent, returning only its SOLUTION_ATTRIBUTES.
+    Run by the worker processes of SharkPopulation.solve_distributed_agents.
+    """
+    agent = agent_type(**parameters)
+    agent.solve()
+
+    return {key: getattr(agent, key) for key in SOLUTION_ATTRIBUTES}
+
+
+@dataclass
+class PopulationState:
+    """
+    The simulation state of a SharkPopulation, stored as contiguous
+    arrays with one entry per simulated agent.
+
+    An AgentType with AgentCount = n owns n consecutive rows.
+    agent_index maps each row back to its AgentType in pop.agents,
+    type_id to the distributed agent type that sets its income process,
+    and class_id to the solution class used to compute its policies.
+    """
+
+    agent_index: np.ndarray
+    type_id: np.ndarray
+    class_id: np.ndarray
+    aNrm: np.ndarray
+    aLvl: np.ndarray
+    pLvl: np.ndarray
+    mNrm: np.ndarray
+    cNrm: np.ndarray
+    Share: np.ndarray
+    shares: np.ndarray
+    RiskyAvg: np.ndarray
+    RiskyStd: np.ndarray
+    macro_day: np.ndarray
+    t_age: np.ndarray
+
+    def __len__(self):
+        return len(self.agent_index)
+
+
 @dataclass
 class SharkPopulation(AgentPopulation):
     dollars_per_hark_money_unit: float = 1500
@@ -24,38 +93,137 @@ class SharkPopulation(AgentPopulation):
         super().__post_init__()
         self.stored_class_stats = None
 
-    def agent_data(self):
+        # index of the distributed agent type each agent was created from
+        self.type_index = None
+
+        # simulation state, built by init_simulation()
+        self.state = None
+
+        # random number generator for the macro updates
+        self.rng = None
+
+        # the days on which each agent attended, built by init_simulation()
+        self.attention_log = None
+
+        # for reporting, found by reported_values() and report_classes()
+        self.report_mNrmStE = None
+        self.report_class_parameters = None
+        self.report_class_id = None
+
+        # policy functions tabulated for all solution classes, by classify_agents()
+        self.policy_tables = {}
+        self.policy_slices = {}
+        self.policy_states = []
+
+        # a PhaseTimer counting the policy evaluations, if set
+        self.timer = None
+
+    def reported_values(self):
+        """
+        The REPORTED_FIELDS of each row of the population state,
+        as an array with one column per field.
+        """
+        state = self.state
+
+        if self.report_mNrmStE is None:
+            self.report_mNrmStE = np.array([agent.mNrmStE for agent in self.agents])
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mNrm_ratio_StE = state.mNrm / self.report_mNrmStE[state.agent_index]
+
+        return np.column_stack((state.aLvl, state.mNrm, state.cNrm, mNrm_ratio_StE))
+
+    def report_classes(self):
+        """
+        The classes of agents that class_stats reports on: the combinations
+        of the ex-ante heterogeneous parameters, in sorted order.
+
+        Returns
+        -------
+
+        A DataFrame with the parameters of each class,
+        and an array with the class of each row of the population state.
+        """
+        if self.report_class_id is None:
+            params = self.ex_ante_hetero_params
+
+            if params is None or len(params) == 0:
+                self.report_class_parameters = pd.DataFrame(index=[0])
+                agent_class = np.zeros(len(self.agents), dtype=int)
+            else:
+                grouped = self.agent_database[params].groupby(params)
+
+                self.report_class_parameters = grouped.size().reset_index()[params]
+                agent_class = grouped.ngroup().to_numpy()
+
+            self.report_class_id = agent_class[self.state.agent_index]
+
+        return self.report_class_parameters, self.report_class_id
+
+    def class_moments(self, values):
+        """
+        The mean and standard deviation of each column of values within
+        each class of class_stats, skipping missing values.
+
+        Parameters
+        ----------
+
+        values: np.array - with one row per row of the population state
+
+        Returns
+        -------
+
+        The means and the standard deviations,
+        as arrays with one row per class and one column per column of values.
+        """
+        classes, class_id = self.report_classes()
+        n_classes = len(classes)
+
+        present = ~np.isnan(values)
+
+        def class_sums(columns):
+            return np.stack(
+                [
+                    np.bincount(class_id, weights=column, minlength=n_classes)
+                    for column in columns.T
+                ],
+                axis=1,
+            )
+
+        counts = class_sums(present.astype(float))
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            means = class_sums(np.where(present, values, 0.0)) / counts
+
+            deviations = np.where(present, values - means[class_id], 0.0)
+            variances = class_sums(deviations**2) / (counts - 1)
+
+        stds = np.where(counts > 1, np.sqrt(variances), np.nan)
+
+        return means, stds
+
+    def agent_data(self, values=None):
         """
         Output a dataframe for agent attributes
          -- this is not the same as the agent_database,
             but rather is a specially designed dataframe
             used for reporting.
 
+        Has one row per simulated agent, read from the population state.
+
+        values: np.array or None - the REPORTED_FIELDS of each row,
+            as given by reported_values(). Defaults to the current ones.
+
         returns agent_data from class_stats
         """
-
-        # suppress assignment warnings
-        pdomca = pd.options.mode.chained_assignment = None
-        pd.options.mode.chained_assignment = None  # default='warn'
+        if values is None:
+            values = self.reported_values()
 
         agent_data = self.agent_database[self.ex_ante_hetero_params + ["agents"]]
+        agent_data = agent_data.iloc[self.state.agent_index].copy()
 
-        data_calls = {
-            "aLvl": lambda a: a.state_now["aLvl"],
-            "mNrm": lambda a: a.state_now["mNrm"],
-            "cNrm": lambda a: a.controls["cNrm"]
-            if "cNrm" in a.controls
-            else np.full(a.AgentCount, np.nan),
-            "mNrm_ratio_StE": lambda a: a.state_now["mNrm"] / a.mNrmStE,
-        }
-
-        for dc in data_calls:
-            col = agent_data.loc[:, "agents"].apply(data_calls[dc])
-            agent_data[dc] = col
-
-        agent_data = agent_data.explode(list(data_calls.keys()))
-
-        pd.options.mode.chained_assignment = pdomca
+        for field, column in zip(REPORTED_FIELDS, values.T):
+            agent_data[field] = column
 
         return agent_data
 
@@ -65,51 +233,89 @@ class SharkPopulation(AgentPopulation):
 
         Currently limited to asset level in the final simulated period (aLvl_T)
         """
-        agent_data = self.agent_data().drop(columns="agents")
+        cs = self.class_stats_frame(*self.class_moments(self.reported_values()))
 
-        if self.ex_ante_hetero_params is None or len(self.ex_ante_hetero_params) == 0:
-            cs = agent_data.aggregate(["mean", "std"])
+        if store:
+            self.stored_class_stats = cs
 
-            mean_data = cs.loc["mean"].to_dict()
-            std_data = cs.loc["std"].to_dict()
+        return cs
 
+    def class_stats_frame(self, means, stds):
+        """
+        Builds the DataFrame of class_stats from the class_moments of
+        the REPORTED_FIELDS.
+        """
+        if self.ex_ante_hetero_params is None or len(self.ex_ante_hetero_params) == 0:
             # this collapse the data into one row with appropriate column names
-            all_data = {k + "_mean": [mean_data[k]] for k in mean_data}
-            all_data.update({k + "_std": [std_data[k]] for k in std_data})
+            all_data = {k + "_mean": [means[0, i]] for i, k in enumerate(REPORTED_FIELDS)}
+            all_data.update(
+                {k + "_std": [stds[0, i]] for i, k in enumerate(REPORTED_FIELDS)}
+            )
             all_data["label"] = ["all"]
 
-            cs = pd.DataFrame.from_dict(all_data)
+            return pd.DataFrame.from_dict(all_data)
 
-        else:
-            cs = (
-                agent_data.groupby(self.ex_ante_hetero_params)
-                .aggregate(["mean", "std"])
-                .reset_index()
-            )
+        classes, _ = self.report_classes()
+        cs = classes.copy()
 
-            label = ""
+        for i, k in enumerate(REPORTED_FIELDS):
+            cs[k + "_mean"] = means[:, i]
+            cs[k + "_std"] = stds[:, i]
 
-            for param in self.ex_ante_hetero_params:
-                label += round(cs[param], 2).apply(lambda x: f"{param}={x}, ")
+        label = ""
 
-            cs["label"] = label.str[:-2]
+        for param in self.ex_ante_hetero_params:
+            label += round(cs[param], 2).apply(lambda x: f"{param}={x}, ")
 
-            cs.columns = ["_".join(col).strip("_") for col in cs.columns.values]
-
-        if store:
-            self.stored_class_stats = cs
+        cs["label"] = label.str[:-2]
 
         return cs
 
-    def solve_distributed_agents(self):
-        # see Market class for an example of how to solve distributed agents in parallel
+    def solve_distributed_agents(self, processes=None, cache=None):
+        """
+        Solves each distributed agent type.
+
+        Parameters
+        ----------
 
-        for agent in self.agents:
-            agent.solve()
+        processes: int or None - if greater than 1, the agents are solved
+            in parallel by a pool of this many processes. Each process is sent
+            an agent's parameters, and sends back only its solution.
+            Otherwise, the agents are solved one after another.
+
+        cache: SolutionCache or None - if given, agents whose solutions
+            are in the cache load them instead of being solved,
+            and the solutions of the others are stored in it.
+        """
+        unsolved = [
+            i
+            for i, agent in enumerate(self.agents)
+            if cache is None or not cache.load(agent)
+        ]
+
+        if processes is None or processes <= 1:
+            for i in unsolved:
+                self.agents[i].solve()
+        else:
+            jobs = [
+                (self.agent_type, self.population_parameters[i]) for i in unsolved
+            ]
+
+            with multiprocessing.Pool(processes) as pool:
+                solutions = pool.starmap(_solve_agent, jobs, chunksize=1)
+
+            for i, solution in zip(unsolved, solutions):
+                for key, value in solution.items():
+                    setattr(self.agents[i], key, value)
+
+        if cache is not None:
+            for i in unsolved:
+                cache.store(self.agents[i])
 
     def explode_agents(self, num):
         exploded_agents = []
         exploded_dicts = []
+        type_index = []
 
         rng = np.random.default_rng(self.seed)
 
@@ -121,9 +327,11 @@ class SharkPopulation(AgentPopulation):
                 double_agent.update_income_process()
                 exploded_agents.append(double_agent)
                 exploded_dicts.append(deepcopy(self.population_parameters[i]))
+                type_index.append(i)
 
         self.agents = exploded_agents
         self.population_parameters = exploded_dicts
+        self.type_index = type_index
 
         self.create_database()
 
@@ -131,6 +339,9 @@ class SharkPopulation(AgentPopulation):
         """
         Sets up the agents with their state for the state of the simulation
         """
+        self.rng = np.random.default_rng(self.seed)
+        self.attention_log = AttentionLog(len(self.agents))
+
         for agent in self.agents:
             agent.track_vars += ["pLvl", "mNrm", "cNrm", "Share", "Risky"]
             agent.T_sim = T_sim
@@ -162,16 +373,272 @@ class SharkPopulation(AgentPopulation):
             #].cFuncAdj(agent.state_now["mNrm"])
             #agent.state_now["aLvl"] = agent.state_now["aNrm"] * agent.state_now["pLvl"]
 
-    def solve(self, merge_by=None):
-        self.solve_distributed_agents()
+        self.pack_state()
+
+    def pack_state(self):
+        """
+        Gathers the simulation state of every agent into a PopulationState,
+        so that the daily phases of a simulation can operate on the whole
+        population with array operations.
+
+        The agents must have been initialized for simulation.
+        """
+        self.agent_counts = np.array([agent.AgentCount for agent in self.agents])
+        self.agent_starts = np.concatenate(([0], np.cumsum(self.agent_counts)[:-1]))
+        self.one_row_per_agent = bool(np.all(self.agent_counts == 1))
+
+        def gather(values):
+            return np.concatenate(
+                [
+                    np.broadcast_to(np.asarray(v, dtype=float), agent.AgentCount)
+                    for v, agent in zip(values, self.agents)
+                ]
+            )
+
+        type_index = np.array(
+            self.type_index
+            if self.type_index is not None
+            else range(len(self.agents)),
+            dtype=int,
+        )
+
+        # one agent of each distributed type, for its income process
+        self.type_agents = {
+            t: self.agents[i] for i, t in reversed(list(enumerate(type_index)))
+        }
+
+        # the macro updates use the parameters of a single period
+        for agent in self.type_agents.values():
+            if agent.T_cycle != 1:
+                raise ValueError(
+                    "The macro updates of a SharkPopulation only support agents "
+                    f"with one period in their cycle. Got T_cycle={agent.T_cycle}."
+                )
+
+        self.state = PopulationState(
+            agent_index=np.repeat(np.arange(len(self.agents)), self.agent_counts),
+            type_id=np.repeat(type_index, self.agent_counts),
+            class_id=np.repeat(self.classify_agents(), self.agent_counts),
+            aNrm=gather([agent.state_now["aNrm"] for agent in self.agents]),
+            aLvl=gather([agent.state_now["aLvl"] for agent in self.agents]),
+            pLvl=gather([agent.state_now["pLvl"] for agent in self.agents]),
+            mNrm=gather([agent.state_now["mNrm"] for agent in self.agents]),
+            cNrm=gather(
+                [agent.controls.get("cNrm", np.nan) for agent in self.agents]
+            ),
+            Share=gather([agent.controls["Share"] for agent in self.agents]),
+            shares=gather([getattr(agent, "shares", 0.0) for agent in self.agents]),
+            RiskyAvg=gather([agent.parameters["RiskyAvg"] for agent in self.agents]),
+            RiskyStd=gather([agent.parameters["RiskyStd"] for agent in self.agents]),
+            macro_day=np.zeros(self.agent_counts.sum(), dtype=int),
+            t_age=np.concatenate([agent.t_age for agent in self.agents]).astype(int),
+        )
+
+        self.assign_macro_days(np.zeros(len(self.agents), dtype=int))
+
+        self.report_mNrmStE = None
+        self.report_class_id = None
+
+    def checkpoint(self):
+        """
+        Returns the simulation state of the population as plain data:
+        the state arrays, the state of the rng, and the attention log.
+        """
+        return {
+            "state": {
+                field.name: getattr(self.state, field.name).copy()
+                for field in fields(self.state)
+            },
+            "rng": deepcopy(self.rng.bit_generator.state),
+            "attention_log": self.attention_log.checkpoint(),
+        }
+
+    def restore(self, checkpoint):
+        """
+        Restores the simulation state of the population from a checkpoint.
+
+        The population must have been built and initialized for
+        simulation in the same way as the checkpointed one.
+        """
+        self.attention_log.restore(checkpoint["attention_log"])
+
+        self.state = PopulationState(
+            **{name: values.copy() for name, values in checkpoint["state"].items()}
+        )
+        self.assign_macro_days(self.state.macro_day[self.agent_starts])
+
+        self.rng.bit_generator.state = deepcopy(checkpoint["rng"])
+
+    def classify_agents(self):
+        """
+        Sorts the agents into solution classes: agents in the same class
+        share their policy functions.
+
+        With a merged solution, a class is a combination of the ex-ante
+        heterogeneous parameters. Otherwise, it is the distributed agent
+        type from which the agent was created.
+
+        Stores the policy functions of each class in self.class_policies,
+        indexed by class, and, where possible, tabulated for all classes
+        in self.policy_tables. The class of each key is in self.class_ids.
+        Returns the class of each agent.
+        """
+        ex_ante_hetero_params = getattr(self, "ex_ante_hetero_params", None)
+        merged = ex_ante_hetero_params is not None and len(ex_ante_hetero_params) > 0
+
+        type_index = (
+            self.type_index
+            if self.type_index is not None
+            else range(len(self.agents))
+        )
+
+        self.class_ids = {}
+        classes = self.class_ids
+        class_index = []
+        self.class_policies = []
+        class_functions = []
+
+        for agent, agent_type in zip(self.agents, type_index):
+            if merged:
+                key = tuple(agent.parameters[key] for key in ex_ante_hetero_params)
+            else:
+                key = agent_type
+
+            if key not in classes:
+                classes[key] = len(self.class_policies)
+
+                if merged:
+                    functions = self.solution.solution_database.loc[key]
+                    class_functions.append(self.solution.class_functions(key))
+                else:
+                    functions = {
+                        name: partial(
+                            _fixed_expectations_policy,
+                            getattr(agent.solution[0], name),
+                        )
+                        for name in POLICY_NAMES
+                    }
+                    class_functions.append(
+                        {
+                            name: np.array(getattr(agent.solution[0], name))
+                            for name in POLICY_NAMES
+                        }
+                    )
+
+                self.class_policies.append(
+                    {
+                        name: functions[name]
+                        for name in POLICY_NAMES
+                    }
+                )
+
+            class_index.append(classes[key])
+
+        self.tabulate_policies(class_functions, merged)
+
+        return np.array(class_index, dtype=int)
+
+    def agent_rows(self, agent_indices):
+        """
+        Returns the rows of the population state that belong to the
+        given agents (positions in self.agents).
+        """
+        agent_indices = np.asarray(agent_indices, dtype=int)
+
+        if self.one_row_per_agent:
+            return agent_indices
+
+        counts = self.agent_counts[agent_indices]
+        starts = self.agent_starts[agent_indices]
+
+        offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+
+        return offsets + np.arange(counts.sum())
+
+    def agent_means(self, values):
+        """
+        Averages an array of per-row values within each agent.
+        """
+        if self.one_row_per_agent:
+            return values
+
+        return np.add.reduceat(values, self.agent_starts) / self.agent_counts
+
+    def assign_macro_days(self, macro_days):
+        """
+        Assigns each agent the day of the quarter on which
+        it has its macro update, and buckets the agents by that day.
+        """
+        macro_days = np.asarray(macro_days, dtype=int)
+
+        self.state.macro_day = np.repeat(macro_days, self.agent_counts)
+
+        self.macro_day_order = np.argsort(macro_days, kind="stable")
+        self.macro_day_bounds = np.searchsorted(
+            macro_days[self.macro_day_order],
+            np.arange(macro_days.max(initial=0) + 2),
+        )
+
+    def macro_day_agents(self, day):
+        """
+        Returns the positions of the agents whose macro update falls on this day.
+        """
+        if day < 0 or day + 1 >= len(self.macro_day_bounds):
+            return self.macro_day_order[:0]
+
+        return self.macro_day_order[
+            self.macro_day_bounds[day] : self.macro_day_bounds[day + 1]
+        ]
+
+    def tabulate_policies(self, class_functions, merged):
+        """
+        Tabulates the policy functions of all the solution classes,
+        as TabulatedPolicies stored in self.policy_tables, each evaluated
+        through a cache of its slices in self.policy_slices.
+
+        With a merged solution, the tables have a dimension for each
+        continuous state of the merge, which must be part of the population
+        state, such as the risky expectations. Otherwise, the policies
+        do not depend on the expectations.
+
+        Policies that cannot be tabulated are left out.
+        """
+        self.policy_tables = {}
+        self.policy_slices = {}
+        self.policy_states = []
+        grids = []
+
+        if merged:
+            self.policy_states = list(self.solution.continuous_states)
+            grids = self.solution.continuous_grids
+
+            state_fields = [f.name for f in fields(PopulationState)]
+
+            if any(s not in state_fields for s in self.policy_states):
+                return
+
+        for name in POLICY_NAMES:
+            functions = [f[name] for f in class_functions]
+
+            # only piecewise linear functions can be tabulated
+            if not all(
+                hasattr(x_function, "x_list") for f in functions for x_function in f.flat
+            ):
+                continue
+
+            self.policy_tables[name] = TabulatedPolicy(functions, grids)
+            self.policy_slices[name] = PolicySlices(self.policy_tables[name])
+
+    def solve(self, merge_by=None, processes=None, cache=None):
+        self.solve_distributed_agents(processes=processes, cache=cache)
 
         self.solution = SharkPopulationSolution(self)
         self.solution.merge_solutions(continuous_states=merge_by)
         self.ex_ante_hetero_params = self.solution.ex_ante_hetero_params
 
-    def attend(self, agent, price, risky_expectations, day=None):
+    def attend(self, agent_indices, price, risky_expectations, day=None):
         """
-        Cause the agent to attend to the financial model.
+        Cause a group of agents to attend to the financial model.
 
         This will update their expectations of the risky asset.
         They will then adjust their owned risky asset shares to meet their
@@ -179,34 +646,45 @@ class SharkPopulation(AgentPopulation):
 
         Return the delta of risky asset shares ordered through the brokers.
 
-        NOTE: This MUTATES the agents with their new target share amounts.
+        NOTE: This MUTATES the population state with the new target share amounts.
 
         Params
         ------
-        day: None or int -- If int, then record the day on the agent.
+        agent_indices: array of int -- positions in self.agents of the attending agents.
+        risky_expectations: dict -- 'RiskyAvg' and 'RiskyStd', each a scalar or
+            an array aligned with agent_indices.
+        day: None or int -- If int, then record the day in the attention log.
         """
-        # It's a little weird using assign_parameters for this but...
-        if day is not None and "attention_days" in agent.parameters:
-            attention_days = agent.parameters["attention_days"]
-            attention_days.append(day)
-            agent.assign_parameters(**{"attention_days": attention_days})
-        elif day is not None:
-            agent.assign_parameters(**{"attention_days": [day]})
+        agent_indices = np.asarray(agent_indices, dtype=int)
 
-        # Note: this mutates the underlying agent
-        # we should also assign their solution
-        agent.assign_parameters(**risky_expectations)
-        self.assign_solution(agent)
+        if day is not None:
+            self.attention_log.record(agent_indices, day)
+
+        rows = self.agent_rows(agent_indices)
+        counts = self.agent_counts[agent_indices]
+
+        self.state.RiskyAvg[rows] = np.repeat(
+            np.broadcast_to(risky_expectations["RiskyAvg"], agent_indices.shape),
+            counts,
+        )
+        self.state.RiskyStd[rows] = np.repeat(
+            np.broadcast_to(risky_expectations["RiskyStd"], agent_indices.shape),
+            counts,
+        )
 
-        target_shares = self.compute_share_demand(agent, price)
+        target_shares = self.compute_share_demand(price, rows)
 
-        delta_shares = target_shares - agent.shares
+        delta_shares = target_shares - self.state.shares[rows]
 
-        # NOTE: This mutates the agent
-        agent.shares = target_shares
+        # NOTE: This mutates the population state
+        self.state.shares[rows] = target_shares
 
-        if np.any(agent.shares < 0):
-            print("ERROR: Agent has negative shares after attention.")
+        if np.any(target_shares < 0):
+            events.emit(
+                "negative_shares_after_attention",
+                "error",
+                agents=int((target_shares < 0).sum()),
+            )
 
         return delta_shares
 
@@ -220,14 +698,9 @@ class SharkPopulation(AgentPopulation):
             return
 
         # assign solution before simulating
-        # get master solution
-        pop_solution = self.solution.solution_database
-
-        # get solution for agent subgroup
-        # functions = pop_solution.loc[agent.CRRA, agent.DiscFac]
-
-        keys = [agent.parameters[key] for key in self.ex_ante_hetero_params]
-        functions = pop_solution.loc[tuple(keys)]
+        # get solution for agent subgroup, by its class
+        keys = tuple(agent.parameters[key] for key in self.ex_ante_hetero_params)
+        functions = self.class_policies[self.class_ids[keys]]
 
         # Using their expectations, construct function depending on
         # perceptions/beliefs about the stock market
@@ -244,122 +717,277 @@ class SharkPopulation(AgentPopulation):
         agent.solution[0].cFuncAdj = cFuncAdj
         agent.solution[0].SequentialShareFuncAdj = SequentialShareFuncAdj
 
-    def compute_share_demand(self, agent, price):
+    def evaluate_policy(self, name, x, rows):
+        """
+        Evaluates a policy function ('cFuncAdj', 'ShareFuncAdj' or
+        'SequentialShareFuncAdj') at x for the given rows of the population
+        state, using each row's solution class and risky expectations.
+
+        Rows whose x is within the grid of the tabulated policy are evaluated
+        all at once; the others by the policy functions of their class.
+        """
+        class_id = self.state.class_id[rows]
+        RiskyAvg = self.state.RiskyAvg[rows]
+        RiskyStd = self.state.RiskyStd[rows]
+
+        table = self.policy_tables.get(name)
+
+        if table is not None:
+            inside = table.in_range(class_id, x)
+
+            if self.timer is not None:
+                self.timer.count("policy_evaluations", len(x))
+                self.timer.count("policy_table_misses", int((~inside).sum()))
+            expectations = [getattr(self.state, s)[rows] for s in self.policy_states]
+
+            policy = self.policy_slices[name]
+
+            if np.all(inside):
+                return policy(class_id, x, *expectations)
+
+            values = np.empty(len(x))
+            values[inside] = policy(
+                class_id[inside], x[inside], *[e[inside] for e in expectations]
+            )
+
+            outside = ~inside
+            values[outside] = self._evaluate_class_policies(
+                name, x[outside], class_id[outside], RiskyAvg[outside], RiskyStd[outside]
+            )
+
+            return values
+
+        if self.timer is not None:
+            self.timer.count("policy_evaluations", len(x))
+            self.timer.count("policy_table_misses", len(x))
+
+        return self._evaluate_class_policies(name, x, class_id, RiskyAvg, RiskyStd)
+
+    def _evaluate_class_policies(self, name, x, class_id, RiskyAvg, RiskyStd):
+        """
+        Evaluates a policy function with the policy functions of each class.
+        """
+        classes = np.unique(class_id)
+
+        if len(classes) == 1:
+            return np.asarray(
+                self.class_policies[classes[0]][name](x, RiskyAvg, RiskyStd),
+                dtype=float,
+            )
+
+        values = np.empty(len(x))
+
+        for c in classes:
+            these = class_id == c
+            values[these] = self.class_policies[c][name](
+                x[these], RiskyAvg[these], RiskyStd[these]
+            )
+
+        return values
+
+    def compute_share_demand(self, price, rows=None):
         """
-        Computes the number of shares an agent _wants_ to own.
+        Computes the number of shares agents _want_ to own.
 
         Inputs:
-         - an agent
          - current asset price
+         - rows of the population state; all agents if None
 
         This involves:
           - Computing a solution function based on their
             expectations and personal properties
-          - Using the solution and the agent's current normalized
+          - Using the solution and the agents' current normalized
             assets to compute a share number
         """
+        if rows is None:
+            rows = np.arange(len(self.state))
 
-        asset_normalized = agent.state_now["aNrm"]
+        asset_normalized = self.state.aNrm[rows]
 
         if np.any(asset_normalized < 0):
-            print("ERROR: An agent has negative assets after compute demand.")
+            events.emit(
+                "negative_assets_before_demand",
+                "error",
+                agents=int((asset_normalized < 0).sum()),
+            )
 
         # ShareFuncAdj takes normalized market resources as argument
         # SequentialShareFuncAdj takes normalized assets as argument
-        risky_share = agent.solution[0].SequentialShareFuncAdj(asset_normalized)
+        risky_share = self.evaluate_policy(
+            "SequentialShareFuncAdj", asset_normalized, rows
+        )
         # risky_share = np.clip(risky_share, 0, 1)
 
+        # clipped to [0, 1]. Need to fix solution!
         if np.any(risky_share < 0):
-            print(
-                "Warning: An agent has negative risky share. Setting to 0. Need to fix solution!"
+            low = risky_share < 0
+            events.emit(
+                "risky_share_clipped_to_0",
+                "warning",
+                RiskyAvg=self.state.RiskyAvg[rows][low],
+                RiskyStd=self.state.RiskyStd[rows][low],
             )
-            print(f"RiskyAvg: {agent.RiskyAvg}, RiskyStd: {agent.RiskyStd}")
-            risky_share[risky_share < 0] = 0.0
+            risky_share[low] = 0.0
 
         if np.any(risky_share > 1):
-            print(
-                "Warning: An agent has risky share > 1.0. Setting to 1. Need to fix solution!"
+            high = risky_share > 1
+            events.emit(
+                "risky_share_clipped_to_1",
+                "warning",
+                RiskyAvg=self.state.RiskyAvg[rows][high],
+                RiskyStd=self.state.RiskyStd[rows][high],
             )
-            print(f"RiskyAvg: {agent.RiskyAvg}, RiskyStd: {agent.RiskyStd}")
-            risky_share[risky_share > 1] = 1.0
+            risky_share[high] = 1.0
 
         # denormalize the risky share. See https://github.com/econ-ark/HARK/issues/986
         risky_asset_wealth = (
             risky_share
             * asset_normalized
-            * agent.state_now["pLvl"]
+            * self.state.pLvl[rows]
             * self.dollars_per_hark_money_unit
         )
 
         shares = risky_asset_wealth / price
 
         if (np.isnan(shares)).any():
-            print("ERROR: Agent desires nan shares")
+            events.emit("nan_share_target", "error", agents=int(np.isnan(shares).sum()))
 
         if np.any(shares < 0):
-            print("ERROR: Agent has negative share target")
+            events.emit("negative_share_target", "error", agents=int((shares < 0).sum()))
 
         return shares
 
-    def macro_update(self, agent, price):
+    def macro_update(self, agent_indices, price):
         """
-        Input: an agent, current asset price
+        Input: positions in self.agents of the updating agents, current asset price
 
-        Simulates one "macro" period for the agent (quarterly by assumption).
+        Simulates one "macro" period for the agents (quarterly by assumption).
         For the purposes of the simulation, award the agent dividend income
         but not capital gains on the risky asset.
 
         Output: The difference in shares (really, sales of shares) in order
         to finance consumption; must be passed to a broker.
         """
+        rows = self.agent_rows(agent_indices)
 
-        true_risky_expectations = {
-            "RiskyAvg": agent.parameters["RiskyAvg"],
-            "RiskyStd": agent.parameters["RiskyStd"],
-        }
+        self.simulate_macro_period(rows)
+
+        # Selling off shares if necessary to
+        # finance this period's consumption
+        asset_level_in_shares = (
+            self.state.aLvl[rows] * self.dollars_per_hark_money_unit / price
+        )
 
-        # assigning solution based on agent's true expectations
-        # the true agent's expectations should already be assigned
-        self.assign_solution(agent)
+        delta = asset_level_in_shares - self.state.shares[rows]
+        delta[delta > 0] = 0
 
-        # No change -- both capital gains and dividends awarded daily. See #100
-        macro_risky_params = {
-            "RiskyAvg": 1,
-            "RiskyStd": 0,
-        }
+        self.state.shares[rows] = self.state.shares[rows] + delta
+
+        return delta
 
-        # Now that the agent has their true expectations policy assigned,
-        # simulate using the no change marco expectations to avoid
-        # realization of market returns and asset growth
-        agent.assign_parameters(**macro_risky_params)
-        agent.simulate(sim_periods=1)
+    def simulate_macro_period(self, rows):
+        """
+        Simulates one macro period for the given rows of the population
+        state at once, with the timing of HARK's portfolio consumer:
+        mortality, income shocks, transition to market resources, and then
+        consumption and risky share from each row's policy functions.
 
-        if np.any(agent.state_now["aNrm"]) < 0:
-            print("ERROR: Agent has negative assets after macro update.")
+        Capital gains and dividends are awarded daily (see #100), so
+        the risky asset returns nothing over the macro period.
 
-        if np.any(agent.controls["Share"]) < 0:
-            print("ERROR: Agent has negative risky share after macro update.")
-            print(true_risky_expectations)
+        The agents' parameters are those of their single period
+        (see pack_state). Only the population state is updated,
+        not the agents' own HARK state and history.
+        """
+        state = self.state
+        rng = self.rng
 
-        if np.any(agent.controls["Share"]) > 1:
-            print("ERROR: Agent has share > 1 after macro update.")
-            print(true_risky_expectations)
+        aNrmPrev = state.aNrm[rows]
+        pLvlPrev = state.pLvl[rows]
+        SharePrev = state.Share[rows]
+        t_age = state.t_age[rows]
 
-        ## put back the expectations that include capital gains now
-        agent.assign_parameters(**true_risky_expectations)
+        PermShk = np.empty(len(rows))
+        TranShk = np.empty(len(rows))
+        Rfree = np.empty(len(rows))
 
-        # Selling off shares if necessary to
-        # finance this period's consumption
-        asset_level_in_shares = (
-            agent.state_now["aLvl"] * self.dollars_per_hark_money_unit / price
-        )
+        type_id = state.type_id[rows]
 
-        delta = asset_level_in_shares - agent.shares
-        delta[delta > 0] = 0
+        for t in np.unique(type_id):
+            these = np.flatnonzero(type_id == t)
+            agent = self.type_agents[t]
 
-        agent.shares = agent.shares + delta
+            # agents who die are replaced by newborns
+            DiePrb = 1.0 - np.atleast_1d(agent.LivPrb)[0]
+            born = these[rng.random(len(these)) < DiePrb]
 
-        return delta
+            aNrmPrev[born] = rng.lognormal(
+                agent.aNrmInitMean, agent.aNrmInitStd, len(born)
+            )
+            pLvlPrev[born] = rng.lognormal(
+                agent.pLvlInitMean, agent.pLvlInitStd, len(born)
+            )
+            SharePrev[born] = 0.0
+            t_age[born] = 0
+
+            IncShkDstn = agent.IncShkDstn[0]
+            shock_index = rng.choice(
+                len(IncShkDstn.pmv), size=len(these), p=IncShkDstn.pmv
+            )
+
+            # permanent "shock" includes expected growth
+            PermShk[these] = (
+                IncShkDstn.atoms[0][shock_index] * np.atleast_1d(agent.PermGroFac)[0]
+            )
+            TranShk[these] = IncShkDstn.atoms[1][shock_index]
+
+            if not getattr(agent, "NewbornTransShk", False):
+                TranShk[these[t_age[these] == 0]] = 1.0
+
+            Rfree[these] = np.atleast_1d(agent.Rfree)[0]
+
+        Risky = 1.0
+        Rport = SharePrev * Risky + (1.0 - SharePrev) * Rfree
+
+        pLvl = pLvlPrev * PermShk
+        mNrm = Rport / PermShk * aNrmPrev + TranShk
+
+        # policies are evaluated at each agent's true expectations
+        cNrm = self.evaluate_policy("cFuncAdj", mNrm, rows)
+        Share = self.evaluate_policy("ShareFuncAdj", mNrm, rows)
+
+        aNrm = mNrm - cNrm
+
+        if np.any(aNrm < 0):
+            events.emit(
+                "negative_assets_after_macro_update",
+                "error",
+                agents=int((aNrm < 0).sum()),
+            )
+
+        if np.any(Share < 0):
+            events.emit(
+                "negative_share_after_macro_update",
+                "error",
+                RiskyAvg=state.RiskyAvg[rows][Share < 0],
+                RiskyStd=state.RiskyStd[rows][Share < 0],
+            )
+
+        if np.any(Share > 1):
+            events.emit(
+                "share_above_1_after_macro_update",
+                "error",
+                RiskyAvg=state.RiskyAvg[rows][Share > 1],
+                RiskyStd=state.RiskyStd[rows][Share > 1],
+            )
+
+        state.aNrm[rows] = aNrm
+        state.aLvl[rows] = aNrm * pLvl
+        state.pLvl[rows] = pLvl
+        state.mNrm[rows] = mNrm
+        state.cNrm[rows] = cNrm
+        state.Share[rows] = Share
+        state.t_age[rows] = t_age + 1
 
     def update_agent_wealth_capital_gains(self, new_share_price, pror, dividend):
         """
@@ -370,46 +998,83 @@ class SharkPopulation(AgentPopulation):
         update the agent's wealth level to adjust
         for the most recent round of capital gains.
         """
+        state = self.state
 
         old_share_price = new_share_price / (1 + pror)
 
-        for agent in self.agents:
-            old_raw = agent.shares * old_share_price
-            new_raw = agent.shares * new_share_price
-            dividends = agent.shares * dividend
+        old_raw = state.shares * old_share_price
+        new_raw = state.shares * new_share_price
+        dividends = state.shares * dividend
 
-            delta_aNrm = (new_raw - old_raw + dividends) / (
-                self.dollars_per_hark_money_unit * agent.state_now["pLvl"]
+        delta_aNrm = (new_raw - old_raw + dividends) / (
+            self.dollars_per_hark_money_unit * state.pLvl
+        )
+
+        # update normalized market assets
+        state.aNrm = state.aNrm + delta_aNrm
+
+        negative = state.aNrm < 0
+
+        if negative.any():
+            # Setting normalized assets and shares to 0.
+            events.emit(
+                "negative_assets_after_capital_gains",
+                "error",
+                agents=int(negative.sum()),
+                CRRA=np.unique(
+                    [
+                        self.agents[i].parameters["CRRA"]
+                        for i in state.agent_index[negative]
+                    ]
+                ),
+                aNrm=state.aNrm[negative],
+                shares=state.shares[negative],
+                pLvl=state.pLvl[negative],
+                delta_aNrm=delta_aNrm[negative],
+                dividend=dividend,
+                pror=pror,
             )
+            state.aNrm[negative] = 0.0
+            ## TODO: This change in shares needs to be registered with the Broker.
+            state.shares[(state.aNrm == 0)] = 0
 
-            # update normalized market assets
-            # if agent.state_now['aNrm'] < delta_aNrm:
-            #     breakpoint()
+        # update non-normalized market assets
+        state.aLvl = state.aNrm * state.pLvl
 
-            agent.state_now["aNrm"] = agent.state_now["aNrm"] + delta_aNrm
+    def update_agent_wealth_capital_gains_path(self, prices, dividends):
+        """
+        For all agents, with shares held fixed over a path of days,
+        update the agent's wealth level for the capital gains and
+        dividends of the whole path in a single step.
 
-            if (agent.state_now["aNrm"] < 0).any():
-                print(
-                    f"ERROR: Agent with CRRA {agent.parameters['CRRA']}"
-                    + "has negative aNrm after capital gains update."
-                )
-                pprint(
-                    {
-                        "aNrm": agent.state_now["aNrm"],
-                        "shares": agent.shares,
-                        "pLvl": agent.state_now["pLvl"],
-                        "delta_aNrm": delta_aNrm,
-                        "dividend": dividend,
-                        "pror": pror,
-                    }
-                )
-                print("Setting normalize assets and shares to 0.")
-                agent.state_now["aNrm"][(agent.state_now["aNrm"] < 0)] = 0.0
-                ## TODO: This change in shares needs to be registered with the Broker.
-                agent.shares[(agent.state_now["aNrm"] == 0)] = 0
+        prices: the share prices, beginning with the price before the path
+        dividends: the dividends paid on each day of the path
+
+        Returns False, leaving the state unchanged, if some agent's assets
+        would become negative along the way. The days must then be
+        applied one at a time with update_agent_wealth_capital_gains.
+        """
+        state = self.state
+
+        if len(dividends) == 0:
+            return True
+
+        # cumulative capital gains and dividends per share
+        gains = np.asarray(prices[1:]) - prices[0] + np.cumsum(dividends)
+
+        aNrm_per_gain = state.shares / (self.dollars_per_hark_money_unit * state.pLvl)
 
-            # update non-normalized market assets
-            agent.state_now["aLvl"] = agent.state_now["aNrm"] * agent.state_now["pLvl"]
+        # shares are never negative, so assets are lowest on the worst day
+        if np.any(state.aNrm + aNrm_per_gain * min(gains.min(), 0) < 0):
+            return False
+
+        # update normalized market assets
+        state.aNrm = state.aNrm + aNrm_per_gain * gains[-1]
+
+        # update non-normalized market assets
+        state.aLvl = state.aNrm * state.pLvl
+
+        return True
 
 
 class SharkPopulationSolution:
@@ -420,6 +1085,11 @@ class SharkPopulationSolution:
         self.agent_database = self.agent_population.agent_database
 
     def merge_solutions(self, continuous_states):
+        self.continuous_states = list(continuous_states or [])
+        self.continuous_grids = [
+            np.unique(self.agent_database[state]) for state in self.continuous_states
+        ]
+
         if continuous_states is None or continuous_states == []:
             if self.distributed_params is None or self.distributed_params == []:
                 self.solution_database = self.agent_database
@@ -442,6 +1112,40 @@ class SharkPopulationSolution:
             elif len(continuous_states) == 3:
                 self._merge_solutions_3d(continuous_states)
 
+    def class_functions(self, key):
+        """
+        The policy functions of the agent types in the solution class
+        with these values of the ex-ante heterogeneous parameters.
+
+        Returns
+        -------
+
+        A dict with, for each policy, an array of 1D policy functions with
+        a dimension for each continuous state. Element (i, j, ...) is the
+        function of the agent type with the continuous states
+        (continuous_grids[0][i], continuous_grids[1][j], ...).
+        """
+        group = self.agent_database
+
+        for param, value in zip(self.ex_ante_hetero_params, key):
+            group = group[group[param] == value]
+
+        agents = group.set_index(self.continuous_states)["agents"]
+        nodes = list(itertools.product(*self.continuous_grids))
+        shape = tuple(len(grid) for grid in self.continuous_grids)
+
+        functions = {}
+
+        for name in POLICY_NAMES:
+            array = np.empty(len(nodes), dtype=object)
+
+            for i, node in enumerate(nodes):
+                array[i] = getattr(agents.loc[node].solution[0], name)
+
+            functions[name] = array.reshape(shape)
+
+        return functions
+
     def _merge_solutions_2d(self, continuous_states):
         discrete_params = list(set(self.distributed_params) - set(continuous_states))
         discrete_params.sort()
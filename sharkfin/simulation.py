@@ -1,6 +1,11 @@
 from abc import ABC, abstractmethod
+from collections import Counter
+from functools import wraps
 from sharkfin.utilities import *
+from copy import deepcopy
 from datetime import datetime
+import os
+import pickle
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
@@ -12,9 +17,26 @@ from sharkfin.markets.ammps import (
     MarketFailureError,
 )  ## TODO: Move this error to higher level module
 from sharkfin.broker import Broker
+from sharkfin.events import events
+from sharkfin.history import HistoryRecorder, TrackingPolicy
+from sharkfin.timing import PhaseTimer
 import sharkfin.stylized_facts as stylized_facts
 
 
+def counts_events(simulate):
+    """
+    Counts the events emitted while a simulation runs in its event_counts,
+    apart from those of simulations running in other threads.
+    """
+
+    @wraps(simulate)
+    def simulate_counting_events(self, *args, **kwargs):
+        with events.counting(self.event_counts):
+            return simulate(self, *args, **kwargs)
+
+    return simulate_counting_events
+
+
 class AbstractSimulation(ABC):
     """
     Abstract class from which simulation classews should inherit
@@ -94,6 +116,15 @@ class MarketSimulation(AbstractSimulation):
     # A holder for an error message
     error_message = None
 
+    # Where the main loop stands: the quarter and run about to begin,
+    # and the day counters. simulate() resumes from a restored clock.
+    clock = None
+
+    # If set, simulate() saves a checkpoint to checkpoint_path
+    # at the start of every checkpoint_every-th run.
+    checkpoint_path = None
+    checkpoint_every = None
+
     def __init__(self, q=1, r=None, market=None, days_per_quarter=60, broker_args=None):
         """
         q - number of quarters
@@ -120,6 +151,12 @@ class MarketSimulation(AbstractSimulation):
         self.history = {}
         self.history["buy_sell"] = []
 
+        # the events of this simulation, by name
+        self.event_counts = Counter()
+
+        # the time spent in each phase of the simulation
+        self.timer = PhaseTimer()
+
     def burn_in(self, n_days):
         """
         Runs for n_days days with no broker activity.
@@ -127,28 +164,36 @@ class MarketSimulation(AbstractSimulation):
 
         Tracking is disabled during the burn-in period.
         """
+        if not self.market.order_responsive or self.market.batched:
+            self.broker.trade_path(n_days)
+            return
+
         for day in range(n_days):
             self.broker.transact(np.zeros(1))
 
             buy_sell, ror, price, dividend = self.broker.trade()
 
-    def daily_data(self):
+    def daily_data(self, start=0):
         """
         Returns a Pandas DataFrame of the data from the simulation run.
+
+        If start is given, only the rows of the days from that one on are built.
         """
         ## DEBUGGING
         data = None
 
+        first = self.burn_in_val + start
+
         data_dict = {
-            "t": range(len(self.market.prices[self.burn_in_val + 1 :])),
-            "prices": self.market.prices[self.burn_in_val + 1 :],
-            "dividends": self.market.dividends[self.burn_in_val + 1 :],
-            "buy": [bs[0] for bs in self.broker.buy_sell_history][self.burn_in_val :],
-            "sell": [bs[1] for bs in self.broker.buy_sell_history][self.burn_in_val :],
-            "ror": self.market.ror_list()[self.burn_in_val :],
+            "t": range(start, len(self.market.prices) - self.burn_in_val - 1),
+            "prices": self.market.prices[first + 1 :],
+            "dividends": self.market.dividends[first + 1 :],
+            "buy": [bs[0] for bs in self.broker.buy_sell_history[first:]],
+            "sell": [bs[1] for bs in self.broker.buy_sell_history[first:]],
+            "ror": self.market.ror_list(first),
         }
 
-        print(f"Ran for {len(data_dict['t'])} days")
+        events.emit("daily_data", "debug", days=len(data_dict["t"]))
 
         try:
             data = pd.DataFrame.from_dict(data_dict)
@@ -166,10 +211,12 @@ class MarketSimulation(AbstractSimulation):
         # Initialize share ownership for agents
 
         if burn_in is not None:
-            self.burn_in(burn_in)
+            with self.timer.phase("burn_in"):
+                self.burn_in(burn_in)
 
         self.burn_in_val = burn_in if burn_in is not None else 0
 
+    @counts_events
     def simulate(self, quarters=None, start=True, burn_in=None):
         """
         DUMMY METHOD -- need to functionalize/parameterize out.
@@ -183,25 +230,30 @@ class MarketSimulation(AbstractSimulation):
            If not None, then an int number of days with no broker activity to run before starting the simulation.
         """
 
-        if start:
-            self.start_simulation(burn_in)
+        if self.clock is None:
+            if start:
+                self.start_simulation(burn_in)
 
-        self.track(-1)
+            self.track(-1)
 
-        day = 0
+            self.start_clock()
+
+        day = self.clock["day"]
 
         if quarters is None:
             quarters = self.quarters_per_simulation
 
         # Main loop
-        for quarter in range(quarters):
-            print(f"Q-{quarter}")
+        for quarter in range(self.clock["quarter"], quarters):
+            events.emit("quarter", "info", quarter=quarter)
 
-            day_in_quarter = 0
+            day_in_quarter = self.clock["day_of_quarter"]
 
-            for run in range(self.runs_per_quarter):
+            for run in range(self.clock["run"], self.runs_per_quarter):
                 # print(f"Q-{quarter}:R-{run}")
 
+                self.advance_clock(quarter, run, day, day_in_quarter)
+
                 # Basic simulation has an attention rate of 1
                 self.broker.transact(np.zeros(1))
 
@@ -225,11 +277,126 @@ class MarketSimulation(AbstractSimulation):
                     day = day + 1
                     day_in_quarter = day_in_quarter + 1
 
+            self.set_clock(quarter + 1, 0, day, 0)
+
+        self.clock = None
+
         self.broker.close()
 
         self.end_time = datetime.now()
         self.end_day = day
 
+    def start_clock(self):
+        """
+        Sets the clock to the beginning of the main loop.
+        """
+        self.clock = {"quarter": 0, "run": 0, "day": 0, "day_of_quarter": 0}
+
+        if self.start_time is None:
+            self.start_time = datetime.now()
+
+    def set_clock(self, quarter, run, day, day_of_quarter):
+        """
+        Sets the clock to the start of a run.
+        """
+        self.clock = {
+            "quarter": quarter,
+            "run": run,
+            "day": day,
+            "day_of_quarter": day_of_quarter,
+        }
+
+    def advance_clock(self, quarter, run, day, day_of_quarter):
+        """
+        Moves the clock to the start of a run, saving a periodic
+        checkpoint if one is due.
+        """
+        self.set_clock(quarter, run, day, day_of_quarter)
+
+        if (
+            self.checkpoint_path is not None
+            and self.checkpoint_every
+            and (quarter * self.runs_per_quarter + run) % self.checkpoint_every == 0
+        ):
+            self.save_checkpoint(self.checkpoint_path)
+
+    def checkpoint(self):
+        """
+        Returns a checkpoint of the simulation: the state needed to
+        continue it, as plain data that can be pickled.
+
+        A simulation built in the same way and restored from this
+        checkpoint continues identically.
+        """
+        return deepcopy(
+            {
+                "simulation_class": self.__class__.__name__,
+                "clock": self.clock,
+                "burn_in_val": getattr(self, "burn_in_val", 0),
+                "end_day": self.end_day,
+                "error_message": self.error_message,
+                "history": self.history_checkpoint(),
+                "market": self.market.checkpoint(),
+                "broker": self.broker.checkpoint(),
+            }
+        )
+
+    def history_checkpoint(self):
+        """
+        Returns the history of the simulation to store in a checkpoint.
+        """
+        return self.history
+
+    def restore_history(self, history):
+        """
+        Restores the history of the simulation from a checkpoint.
+        """
+        self.history = history
+
+    def restore_checkpoint(self, checkpoint):
+        """
+        Restores the simulation from a checkpoint.
+        A following call to simulate() resumes from the checkpointed run.
+        """
+        if checkpoint["simulation_class"] != self.__class__.__name__:
+            raise ValueError(
+                f"Cannot restore a {checkpoint['simulation_class']} checkpoint "
+                + f"into a {self.__class__.__name__}."
+            )
+
+        checkpoint = deepcopy(checkpoint)
+
+        self.start_time = datetime.now()
+
+        self.clock = checkpoint["clock"]
+        self.burn_in_val = checkpoint["burn_in_val"]
+        self.end_day = checkpoint["end_day"]
+        self.error_message = checkpoint["error_message"]
+        self.restore_history(checkpoint["history"])
+
+        self.market.restore(checkpoint["market"])
+        self.broker.restore(checkpoint["broker"])
+
+    def save_checkpoint(self, path):
+        """
+        Saves a checkpoint of the simulation to a file.
+        The file is replaced in one step, so a run that dies while
+        saving leaves the previous checkpoint intact.
+        """
+        tmp_path = f"{path}.tmp"
+
+        with open(tmp_path, "wb") as f:
+            pickle.dump(self.checkpoint(), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(tmp_path, path)
+
+    def load_checkpoint(self, path):
+        """
+        Restores the simulation from a checkpoint file.
+        """
+        with open(path, "rb") as f:
+            self.restore_checkpoint(pickle.load(f))
+
     def ror_volatility(self):
         """
         Returns the volatility of the rate of return.
@@ -299,6 +466,9 @@ class MarketSimulation(AbstractSimulation):
         if "Simulated final day but did not receive signal to end" in message:
             "AMMPS Market Failure: Stopped: Simulated final day but did not receive signal to end"
             return "3"
+        if "Timed out" in message:
+            "AMMPS Market Failure: Timed out: no response within 600 seconds"
+            return "5"
         else:
             return "4"
 
@@ -331,6 +501,12 @@ class MarketSimulation(AbstractSimulation):
         sim_stats["seconds"] = (self.end_time - self.start_time).seconds
         sim_stats["end_day"] = self.end_day
 
+        # the number of warnings and errors of each kind
+        for name, count in events.at_level(self.event_counts, "warning").items():
+            sim_stats[f"{name}_count"] = count
+
+        sim_stats.update(self.timer.stats())
+
         try:
             clean_log_returns = [
                 r for r in self.market.log_return_list() if not np.isnan(r)
@@ -381,6 +557,18 @@ class MacroSimulation(MarketSimulation):
 
     pop = None
 
+    # If set, the history and the daily data are written to stream,
+    # a StreamWriter, every stream_every days, and dropped from the history.
+    stream = None
+    stream_every = None
+
+    # The number of rows of daily data written to the stream so far
+    streamed_days = 0
+
+    # The day being simulated, counted from 0 across quarters,
+    # or -1 before the first: the row of daily_data for that day
+    day = -1
+
     # A FinanceModel
     fm = None
 
@@ -394,6 +582,7 @@ class MacroSimulation(MarketSimulation):
         days_per_quarter=60,
         broker_args=None,
         fm_args={"p1": 0.1, "p2": 0.1, "delta_t1": 60, "delta_t2": 60},
+        tracking=None,
     ):
         """
         pop - agent population
@@ -407,6 +596,10 @@ class MacroSimulation(MarketSimulation):
 
         p1,p2,d1,d2 -- memory function parameters for the financial model. TODO: move to attention simulation only.
 
+        tracking -- a TrackingPolicy, or the name of a tracking level:
+            how much of the history is recorded, and on which days.
+            Defaults to every agent on every day.
+
         """
 
         #
@@ -427,22 +620,43 @@ class MacroSimulation(MarketSimulation):
         )
         self.fm.calculate_risky_expectations()
 
-        self.history = {}
-        self.history["buy_sell"] = []
-        self.history["owned_shares"] = []
-        self.history["total_assets"] = []
-        self.history["mean_income_level"] = []
-        self.history["mean_log_income_level"] = []
-        self.history["stdev_log_income_level"] = []
-        self.history["total_consumption_level"] = []
-        self.history["permshock_std"] = []
-        self.history["class_stats"] = []
-        self.history["total_pop_stats"] = []
+        # the population and expectations count their costly calls
+        self.pop.timer = self.timer
+        self.fm.timer = self.timer
+
+        if tracking is None:
+            tracking = TrackingPolicy()
+        elif isinstance(tracking, str):
+            tracking = TrackingPolicy(tracking)
+
+        self.tracking = tracking
+
+        days = self.quarters_per_simulation * self.days_per_simulated_quarter()
+
+        self.history = HistoryRecorder(
+            [
+                "t",
+                "buy_sell",
+                "owned_shares",
+                "total_assets",
+                "mean_income_level",
+                "mean_log_income_level",
+                "stdev_log_income_level",
+                "total_consumption_level",
+                "permshock_std",
+            ],
+            days=self.tracking.tracked_days(days, self.days_per_simulated_quarter()),
+        )
+
+        if self.tracking.includes("class"):
+            self.history.add_frame("class_stats", self.pop.class_stats_frame)
+
+        if self.tracking.includes("agent"):
+            self.history.add_frame("total_pop_stats", self.pop.agent_data)
 
         # assign macro-days to each agent
         # This is a somewhat frustrating artifact to be cleaned up...
-        for agent in self.pop.agents:
-            agent.macro_day = 0
+        self.pop.assign_macro_days(np.zeros(len(self.pop.agents), dtype=int))
 
     def burn_in(self, n_days):
         """
@@ -450,7 +664,28 @@ class MacroSimulation(MarketSimulation):
         Used for warming up the agents in the market.
 
         Tracking is disabled during the burn-in period.
+
+        If the market does not respond to orders, or runs batches of days,
+        the whole burn-in path is run at once, and the agents' wealth and
+        the expectations are brought forward over it in a single step.
         """
+        if not self.market.order_responsive or self.market.batched:
+            prices, dividends = self.broker.trade_path(n_days)
+
+            prices = np.concatenate(([self.market.prices[-n_days - 1]], prices))
+
+            if not self.pop.update_agent_wealth_capital_gains_path(prices, dividends):
+                for day in range(n_days):
+                    ror = (prices[day + 1] - prices[day]) / prices[day]
+
+                    self.pop.update_agent_wealth_capital_gains(
+                        prices[day + 1], ror, dividends[day]
+                    )
+
+            self.fm.bring_forward(n_days)
+
+            return
+
         for day in range(n_days):
             self.broker.transact(np.zeros(1))
 
@@ -460,32 +695,43 @@ class MacroSimulation(MarketSimulation):
 
             self.fm.calculate_risky_expectations()
 
-    def daily_data(self):
+    def daily_data(self, start=0):
         """
         Returns a Pandas DataFrame of the data from the simulation run.
+
+        If start is given, only the rows of the days from that one on are built.
         """
-        data = MarketSimulation.daily_data(self)
+        data = MarketSimulation.daily_data(self, start=start)
 
         ## Total hacks to fix a weird bug:
         ## - Depending on whether the market chose in Mock or RPC, we get getting different lengths of broker macro history
         days_ran = len(data["t"])
 
+        # the tracked days, which may not be all of them
+        t = self.history["t"].astype(int) - start
+        tracked = (t >= 0) & (t < days_ran)
+
+        def daily(name):
+            values = np.full(days_ran, np.nan)
+            values[t[tracked]] = self.history[name][tracked]
+
+            return values
+
+        def last_days(values):
+            return values[len(values) - days_ran :]
+
         data_dict = {
-            "buy_macro": [bs[0] for bs in self.broker.buy_sell_macro_history][
-                -days_ran:
-            ],
-            "sell_macro": [bs[1] for bs in self.broker.buy_sell_macro_history][
-                -days_ran:
-            ],
-            "owned": self.history["owned_shares"][-days_ran:],
-            "total_assets": self.history["total_assets"][-days_ran:],
-            "mean_income": self.history["mean_income_level"][-days_ran:],
-            "mean_log_income": self.history["mean_log_income_level"][-days_ran:],
-            "stdev_log_income": self.history["stdev_log_income_level"][-days_ran:],
-            "total_consumption": self.history["total_consumption_level"][-days_ran:],
+            "buy_macro": [bs[0] for bs in last_days(self.broker.buy_sell_macro_history)],
+            "sell_macro": [bs[1] for bs in last_days(self.broker.buy_sell_macro_history)],
+            "owned": daily("owned_shares"),
+            "total_assets": daily("total_assets"),
+            "mean_income": daily("mean_income_level"),
+            "mean_log_income": daily("mean_log_income_level"),
+            "stdev_log_income": daily("stdev_log_income_level"),
+            "total_consumption": daily("total_consumption_level"),
             #'permshock_std': self.history['permshock_std'][1:],
-            "expected_ror": self.fm.expected_ror_list[-days_ran:],
-            "expected_std": self.fm.expected_std_list[-days_ran:],
+            "expected_ror": last_days(self.fm.expected_ror_list),
+            "expected_std": last_days(self.fm.expected_std_list),
         }
 
         try:
@@ -501,11 +747,11 @@ class MacroSimulation(MarketSimulation):
 
     def start_simulation(self, burn_in=None):
         # Initialize share ownership for agents
-        for agent in self.pop.agents:
-            agent.shares = self.pop.compute_share_demand(agent, self.market.prices[-1])
+        self.pop.state.shares = self.pop.compute_share_demand(self.market.prices[-1])
 
         MarketSimulation.start_simulation(self, burn_in=burn_in)
 
+    @counts_events
     def simulate(self, quarters=None, start=True, burn_in=None):
         """
         DUMMY METHOD -- need to functionalize/parameterize out.
@@ -520,42 +766,53 @@ class MacroSimulation(MarketSimulation):
            If not None, then an int number of days with no broker activity to run before starting the simulation.
         """
 
-        if start:
-            self.start_simulation(burn_in)
+        if self.clock is None:
+            if start:
+                self.start_simulation(burn_in)
 
-        self.track(-1)
+            self.day = -1
+            self.track(-1)
+
+            self.start_clock()
 
         if quarters is None:
             quarters = self.quarters_per_simulation
 
         # Main loop
-        for quarter in range(quarters):
-            print(f"Q-{quarter}")
+        for quarter in range(self.clock["quarter"], quarters):
+            events.emit("quarter", "info", quarter=quarter)
 
-            day = 0
+            day = self.clock["day_of_quarter"]
 
-            for run in range(self.runs_per_quarter):
+            for run in range(self.clock["run"], self.runs_per_quarter):
                 # print(f"Q-{quarter}:R-{run}")
 
-                for agent in self.pop.agents:
+                self.advance_clock(quarter, run, day, day)
+
+                with self.timer.phase("attend"):
                     self.broker.transact(
                         self.pop.attend(
-                            agent, self.market.prices[-1], self.fm.risky_expectations()
+                            np.arange(len(self.pop.agents)),
+                            self.market.prices[-1],
+                            self.fm.risky_expectations(),
                         )
                     )
 
-                buy_sell, ror, price, dividend = self.broker.trade()
+                with self.timer.phase("trade"):
+                    buy_sell, ror, price, dividend = self.broker.trade()
                 # print("ror: " + str(ror))
 
                 new_run = True
 
                 for day_in_run in range(int(self.days_per_run)):
-                    updates = 0
-                    for agent in self.pop.agents:
-                        if agent.macro_day == day:
-                            updates = updates + 1
+                    self.day = quarter * self.days_per_simulated_quarter() + day
+
+                    with self.timer.phase("macro_update"):
+                        macro_agents = self.pop.macro_day_agents(day)
+                        updates = len(macro_agents)
+                        if updates > 0:
                             self.broker.transact(
-                                self.pop.macro_update(agent, price), macro=True
+                                self.pop.macro_update(macro_agents, price), macro=True
                             )
 
                     if new_run:
@@ -565,56 +822,171 @@ class MacroSimulation(MarketSimulation):
                         # putting 0,0 here is a stopgap to make plotting code simpler
                         self.broker.track((0, 0), (0, 0))
 
-                    self.pop.update_agent_wealth_capital_gains(price, ror, dividend)
+                    with self.timer.phase("capital_gains"):
+                        self.pop.update_agent_wealth_capital_gains(price, ror, dividend)
 
-                    self.track(day)
+                    with self.timer.phase("track"):
+                        self.track(day)
 
                     # combine these steps?
                     # add_ror appends to internal history list
                     # self.fm.add_ror(ror)
-                    self.fm.calculate_risky_expectations()
+                    with self.timer.phase("expectations"):
+                        self.fm.calculate_risky_expectations()
+
+                    with self.timer.phase("stream"):
+                        self.flush_stream()
 
                     day = day + 1
 
+            self.set_clock(quarter + 1, 0, day, 0)
+
+        self.flush_stream(final=True)
+
+        self.clock = None
+
         self.broker.close()
 
         self.end_time = datetime.now()
         self.end_day = day
 
-    def track(self, day, time_delta=0):
+    def stream_to(self, stream, every=30):
         """
-        Tracks the current state of agent's total assets and owned shares
+        Writes the history and the daily data to a StreamWriter every few
+        days as the simulation runs, and at its end. Only the history of
+        the days not yet written is kept in memory.
+
+        The tables written are "data", the rows of daily_data(),
+        "history", the daily metrics, and "history_<frame>" for each
+        frame of the history, such as class_stats, with a column t.
         """
+        self.stream = stream
+        self.stream_every = every
+        self.streamed_days = 0
 
-        tal = (
-            sum([agent.state_now["aLvl"].sum() for agent in self.pop.agents])
-            * self.pop.dollars_per_hark_money_unit
+        self.history.clear(
+            days=self.tracking.tracked_days(every, self.days_per_simulated_quarter())
         )
-        os = sum([sum(agent.shares) for agent in self.pop.agents])
 
-        mpl = (
-            mean([agent.state_now["pLvl"].mean() for agent in self.pop.agents])
-            * self.pop.dollars_per_hark_money_unit
-        )
+    def flush_stream(self, final=False):
+        """
+        Writes the days not yet written to the stream, if it is the
+        last day of a chunk of stream_every days, or if final.
+        """
+        if self.stream is None:
+            return
 
-        mlpl = (
-            mean([np.log(agent.state_now["pLvl"].mean() * self.pop.dollars_per_hark_money_unit)
-                  for agent in self.pop.agents])
-        )
+        if not final and (self.tracked_day() + 1) % self.stream_every != 0:
+            return
 
-        slpl = (
-            stdev([np.log(agent.state_now["pLvl"].mean() * self.pop.dollars_per_hark_money_unit)
-                   for agent in self.pop.agents])
+        days = len(self.market.prices) - self.burn_in_val - 1
+
+        # only the rows of the days not yet written are built
+        if days > self.streamed_days:
+            data = self.daily_data(start=self.streamed_days)
+
+            if data is not None:
+                self.stream.write("data", data)
+                self.streamed_days = days
+
+        history = self.history.drain()
+        t = history["metrics"]["t"]
+
+        if len(t) == 0:
+            return
+
+        self.stream.write(
+            "history",
+            pd.DataFrame({k: pd.Series(v) for k, v in history["metrics"].items()}),
         )
 
-        tcl = (
-            sum(
+        for name, arrays in history["frames"].items():
+            if arrays is None:
+                continue
+
+            build = self.history.frame_builders[name]
+
+            # frames are recorded on the same days as the metrics.
+            # The agent objects cannot be written.
+            frame = pd.concat(
                 [
-                    (agent.controls["cNrm"] * agent.state_now["pLvl"]).sum()
-                    for agent in self.pop.agents
-                    if agent.macro_day == day
-                ]
-            )
+                    build(*[a[i] for a in arrays]).assign(t=t[i])
+                    for i in range(len(arrays[0]))
+                ],
+                ignore_index=True,
+            ).drop(columns="agents", errors="ignore")
+
+            self.stream.write(f"history_{name}", frame)
+
+    def history_checkpoint(self):
+        return self.history.checkpoint()
+
+    def restore_history(self, history):
+        self.history.restore(history)
+
+    def checkpoint(self):
+        checkpoint = super().checkpoint()
+
+        checkpoint["pop"] = self.pop.checkpoint()
+        checkpoint["fm"] = self.fm.checkpoint()
+        checkpoint["streamed_days"] = self.streamed_days
+
+        return checkpoint
+
+    def restore_checkpoint(self, checkpoint):
+        super().restore_checkpoint(checkpoint)
+
+        self.pop.restore(checkpoint["pop"])
+        self.fm.restore(checkpoint["fm"])
+        self.streamed_days = checkpoint.get("streamed_days", 0)
+
+    def days_per_simulated_quarter(self):
+        """
+        The number of days simulated in each quarter.
+        """
+        return self.runs_per_quarter * int(self.days_per_run)
+
+    def tracked_day(self):
+        """
+        The day whose state is tracked: the row of daily_data of the
+        day being simulated, or -1 before the first.
+        """
+        return self.day
+
+    def tracks(self):
+        """
+        Whether the tracking policy records the history today.
+        """
+        return self.tracking.tracks(self.tracked_day(), self.days_per_simulated_quarter())
+
+    def track(self, day, time_delta=0):
+        """
+        Tracks the current state of agent's total assets and owned shares,
+        as far as the tracking policy asks.
+        """
+        if not self.tracks():
+            return
+
+        state = self.pop.state
+
+        tal = state.aLvl.sum() * self.pop.dollars_per_hark_money_unit
+        os = state.shares.sum()
+
+        # income statistics are taken over the mean income of each agent
+        agent_pLvl = self.pop.agent_means(state.pLvl)
+
+        mpl = agent_pLvl.mean() * self.pop.dollars_per_hark_money_unit
+
+        log_agent_pLvl = np.log(agent_pLvl * self.pop.dollars_per_hark_money_unit)
+
+        mlpl = log_agent_pLvl.mean()
+
+        slpl = log_agent_pLvl.std(ddof=1)
+
+        macro_rows = self.pop.agent_rows(self.pop.macro_day_agents(day))
+
+        tcl = (
+            (state.cNrm[macro_rows] * state.pLvl[macro_rows]).sum()
             * self.pop.dollars_per_hark_money_unit
         )
 
@@ -627,15 +999,27 @@ class MacroSimulation(MarketSimulation):
         #    ]
         # ).std()
 
-        self.history["owned_shares"].append(os)
-        self.history["total_assets"].append(tal)
-        self.history["mean_income_level"].append(mpl)
-        self.history["mean_log_income_level"].append(mlpl)
-        self.history["stdev_log_income_level"].append(slpl)
-        self.history["total_consumption_level"].append(tcl)
-        # self.history['permshock_std'].append(permshock_std)
-        self.history["class_stats"].append(self.pop.class_stats(store=False))
-        self.history["total_pop_stats"].append(self.pop.agent_data())
+        self.history.record(
+            t=self.tracked_day(),
+            owned_shares=os,
+            total_assets=tal,
+            mean_income_level=mpl,
+            mean_log_income_level=mlpl,
+            stdev_log_income_level=slpl,
+            total_consumption_level=tcl,
+            # permshock_std=permshock_std,
+        )
+
+        if not self.tracking.includes("class"):
+            return
+
+        # the DataFrames of class_stats and total_pop_stats are built when read
+        values = self.pop.reported_values()
+
+        self.history.record_frame("class_stats", *self.pop.class_moments(values))
+
+        if self.tracking.includes("agent"):
+            self.history.record_frame("total_pop_stats", values)
         # self.history['buy_sell'].append(self.broker.buy_sell_history[-1])
 
     def sim_stats(self):
@@ -647,8 +1031,19 @@ class MacroSimulation(MarketSimulation):
 
         sim_stats = MarketSimulation.sim_stats(self)
 
+        sim_stats["tracking"] = self.tracking.level
+        sim_stats["tracking_every"] = self.tracking.every
+
+        # the solution lookups served by the caches of policy slices
+        slices = self.pop.policy_slices.values()
+        sim_stats["count_policy_slice_hits"] = sum(p.hits for p in slices)
+        sim_stats["count_policy_slice_misses"] = sum(p.misses for p in slices)
+
+        # the final state of the population, whether or not it was tracked
+        class_stats = self.pop.class_stats()
+
         def class_stat_column_to_dict(clabel):
-            df = self.history["class_stats"][-1][["label", clabel]]
+            df = class_stats[["label", clabel]]
             # df.columns = df.columns.droplevel(1)
 
             data = df.set_index("label").to_dict()[clabel]
@@ -674,7 +1069,7 @@ class MacroSimulation(MarketSimulation):
             print(e)
             print("Most likely, the SharkPopulation does not support ")
 
-        total_pop_aLvl = self.history["total_pop_stats"][-1]["aLvl"]
+        total_pop_aLvl = pd.Series(self.pop.state.aLvl)
 
         total_pop_aLvl_mean = total_pop_aLvl.mean()
         total_pop_aLvl_std = total_pop_aLvl.std()
@@ -723,6 +1118,72 @@ class MacroSimulation(MarketSimulation):
         return sim_stats
 
 
+class AttentionCalendar:
+    """
+    The days on which each agent of a population attends to the market
+    over one quarter.
+
+    Rather than drawing, for every agent on every day, whether the agent
+    attends, the gaps between an agent's attention days are sampled from
+    a geometric distribution for the whole quarter at once. The attending
+    agents are then indexed by day.
+
+    Parameters
+    ----------
+
+    rng: numpy.random.Generator
+
+    agent_count: int - number of agents
+
+    attention_rate: float - chance per day of attending (between 0 and 1)
+
+    days: int - number of days in the calendar
+    """
+
+    def __init__(self, rng, agent_count, attention_rate, days):
+        self.days = days
+
+        agent_ids = [np.zeros(0, dtype=int)]
+        attention_days = [np.zeros(0, dtype=int)]
+
+        if attention_rate > 0:
+            # enough gaps to cover the quarter for most agents in one draw
+            expected = days * min(attention_rate, 1)
+            block = int(np.ceil(expected + 4 * np.sqrt(expected))) + 1
+
+            last_day = np.full(agent_count, -1)
+            active = np.arange(agent_count)
+
+            while len(active) > 0:
+                gaps = rng.geometric(min(attention_rate, 1), size=(len(active), block))
+                agent_days = last_day[active, None] + np.cumsum(gaps, axis=1)
+
+                within = agent_days < days
+                rows = np.nonzero(within)[0]
+
+                agent_ids.append(active[rows])
+                attention_days.append(agent_days[within])
+
+                last_day[active] = agent_days[:, -1]
+                active = active[agent_days[:, -1] < days]
+
+        agent_ids = np.concatenate(agent_ids)
+        attention_days = np.concatenate(attention_days)
+
+        order = np.lexsort((agent_ids, attention_days))
+
+        self.agent_ids = agent_ids[order]
+        self.day_bounds = np.searchsorted(
+            attention_days[order], np.arange(days + 1)
+        )
+
+    def attending(self, day):
+        """
+        Returns the indices of the agents attending on this day of the calendar.
+        """
+        return self.agent_ids[self.day_bounds[day] : self.day_bounds[day + 1]]
+
+
 class AttentionSimulation(MacroSimulation):
     """
     A simulation in which agent behavior is characterized by:
@@ -744,6 +1205,9 @@ class AttentionSimulation(MacroSimulation):
 
     market: Market
 
+    tracking: TrackingPolicy or str - how much of the history is recorded.
+        See MacroSimulation.
+
     """
 
     seed = None
@@ -751,6 +1215,9 @@ class AttentionSimulation(MacroSimulation):
     ## upping this to make more agents engaged in trade
     attention_rate = None
 
+    # AttentionCalendar for the current quarter
+    attention_calendar = None
+
     def __init__(
         self,
         pop,
@@ -764,6 +1231,7 @@ class AttentionSimulation(MacroSimulation):
         seed=None,
         broker_args=None,
         fm_args=None,
+        tracking=None,
     ):
         super().__init__(
             pop,
@@ -774,6 +1242,7 @@ class AttentionSimulation(MacroSimulation):
             days_per_quarter=days_per_quarter,
             broker_args=broker_args,
             fm_args=fm_args,
+            tracking=tracking,
         )
 
         if seed:
@@ -790,15 +1259,16 @@ class AttentionSimulation(MacroSimulation):
             self.attention_rate = 1 / self.runs_per_quarter
 
         # assign macro-days to each agent
-        for agent in self.pop.agents:
-            agent.macro_day = self.rng.integers(self.days_per_quarter)
+        self.pop.assign_macro_days(
+            [self.rng.integers(self.days_per_quarter) for agent in self.pop.agents]
+        )
 
         # Additional daily values tracked.
-        self.history["RiskyAvg_mean"] = []
-        self.history["RiskyAvg_std"] = []
-        self.history["RiskyStd_mean"] = []
-        self.history["RiskyStd_std"] = []
+        self.history.add_metrics(
+            ["RiskyAvg_mean", "RiskyAvg_std", "RiskyStd_mean", "RiskyStd_std"]
+        )
 
+    @counts_events
     def simulate(self, quarters=None, start=True, burn_in=None):
         """
         Workhorse method that runs the simulation.
@@ -813,64 +1283,84 @@ class AttentionSimulation(MacroSimulation):
         burn_in : int or None
            If not None, then an int number of days with no broker activity to run before starting the simulation.
         """
-        self.start_time = datetime.now()
+        if self.clock is None:
+            self.start_time = datetime.now()
 
-        if start:
-            self.start_simulation(burn_in)
+            if start:
+                self.start_simulation(burn_in)
 
-        day = 0
+            all_agents = np.arange(len(self.pop.agents))
 
-        for agent in self.pop.agents:
-            self.pop.attend(
-                agent,
-                self.market.prices[-1],
-                self.fm.risky_expectations(agent),
-                day=day,
-            )
+            with self.timer.phase("attend"):
+                self.pop.attend(
+                    all_agents,
+                    self.market.prices[-1],
+                    self.risky_expectations(all_agents),
+                    day=0,
+                )
 
-        self.track(-1)
+            self.day = -1
+            self.track(-1)
+
+            self.start_clock()
+
+        day = self.clock["day"]
 
         if quarters is None:
             quarters = self.quarters_per_simulation
 
         # Main loop
-        for quarter in range(quarters):
-            print(f"Q-{quarter}")
+        for quarter in range(self.clock["quarter"], quarters):
+            events.emit("quarter", "info", quarter=quarter)
 
-            day_of_quarter = 0
+            day_of_quarter = self.clock["day_of_quarter"]
 
-            for run in range(self.runs_per_quarter):
+            if self.attention_calendar is None:
+                self.attention_calendar = AttentionCalendar(
+                    self.rng,
+                    len(self.pop.agents),
+                    self.attention_rate,
+                    self.runs_per_quarter,
+                )
+
+            for run in range(self.clock["run"], self.runs_per_quarter):
                 # print(f"Q-{quarter}:R-{run}")
 
-                # Set to a number for a fixed seed, or None to rotate
-                for agent in self.pop.agents:
-                    if self.rng.random() < self.attention_rate:
+                self.advance_clock(quarter, run, day, day_of_quarter)
+
+                with self.timer.phase("attend"):
+                    attending = self.attention_calendar.attending(run)
+
+                    if len(attending) > 0:
                         self.broker.transact(
                             self.pop.attend(
-                                agent,
+                                attending,
                                 self.market.prices[-1],
-                                self.fm.risky_expectations(agent),
+                                self.risky_expectations(attending),
                                 day=day,
                             )
                         )
 
                 try:
-                    buy_sell, pror, price, dividend = self.broker.trade()
+                    with self.timer.phase("trade"):
+                        buy_sell, pror, price, dividend = self.broker.trade()
 
                 except MarketFailureError as e:
-                    print("Ending simulation")
+                    events.emit("market_failure", "error", day=day, message=str(e))
                     self.error_message = str(e)
                     break
 
                 new_run = True
 
                 for day_in_run in range(int(self.days_per_run)):
-                    updates = 0
-                    for agent in self.pop.agents:
-                        if agent.macro_day == day_of_quarter:
-                            updates = updates + 1
+                    self.day = day
+
+                    with self.timer.phase("macro_update"):
+                        macro_agents = self.pop.macro_day_agents(day_of_quarter)
+                        updates = len(macro_agents)
+                        if updates > 0:
                             self.broker.transact(
-                                self.pop.macro_update(agent, price), macro=True
+                                self.pop.macro_update(macro_agents, price), macro=True
                             )
 
                     if new_run:
@@ -885,45 +1375,82 @@ class AttentionSimulation(MacroSimulation):
 
                     # print(f"Q-{quarter}:D-{day}. {updates} macro-updates.")
 
-                    self.pop.update_agent_wealth_capital_gains(price, pror, dividend)
+                    with self.timer.phase("capital_gains"):
+                        self.pop.update_agent_wealth_capital_gains(price, pror, dividend)
 
-                    self.track(day)
+                    with self.timer.phase("track"):
+                        self.track(day)
 
                     # combine these steps?
                     # add_ror appends to internal history list
                     # self.fm.add_ror(ror)
-                    self.fm.calculate_risky_expectations()
+                    with self.timer.phase("expectations"):
+                        self.fm.calculate_risky_expectations()
+
+                    with self.timer.phase("stream"):
+                        self.flush_stream()
 
                     day = day + 1
                     day_of_quarter = day_of_quarter + 1
 
             else:  ## Super obscure syntax choice to break out of nested loop
-                print("Normal day")
+
+                self.attention_calendar = None
+                self.set_clock(quarter + 1, 0, day, 0)
+
                 continue  ## TODO: remove/revise 'runs' functionality
 
-            print("Market stopped")
+            events.emit("simulation_stopped", "error", quarter=quarter, day=day)
+            self.flush_stream(final=True)
+            self.clock = None
+            self.attention_calendar = None
             self.end_time = datetime.now()
             self.end_day = day
             return
 
+        self.flush_stream(final=True)
+
+        self.clock = None
+
         self.broker.close()
 
         self.end_time = datetime.now()
         self.end_day = day
 
+    def checkpoint(self):
+        checkpoint = super().checkpoint()
+
+        checkpoint["rng"] = deepcopy(self.rng.bit_generator.state)
+        checkpoint["attention_calendar"] = deepcopy(self.attention_calendar)
+
+        return checkpoint
+
+    def restore_checkpoint(self, checkpoint):
+        super().restore_checkpoint(checkpoint)
+
+        self.rng.bit_generator.state = deepcopy(checkpoint["rng"])
+        self.attention_calendar = deepcopy(checkpoint["attention_calendar"])
+
+    def risky_expectations(self, agent_indices):
+        """
+        Collects the risky expectations of the given agents
+        from the expectations model, as arrays aligned with agent_indices.
+        """
+        return self.fm.attention_risky_expectations(
+            self.pop.attention_log.agent_days(agent_indices)
+        )
+
     def sim_stats(self):
         sim_stats = super().sim_stats()
 
         sim_stats["attention"] = self.attention_rate
+        sim_stats["attention_log_bytes"] = self.pop.attention_log.nbytes
 
         if self.seed is not None:
             sim_stats["seed"] = self.seed
 
-
-        sim_stats['Expectations_RiskyAvg_mean_final'] = self.history["RiskyAvg_mean"][-1]
-        sim_stats["Expectations_RiskyAvg_std_final"] = self.history["RiskyAvg_std"][-1]
-        sim_stats["Expectations_RiskyStd_mean_final"] = self.history["RiskyStd_mean"][-1]
-        sim_stats["Expectations_RiskyStd_std_final"] = self.history["RiskyStd_std"][-1]
+        for name, value in self.expectations_stats().items():
+            sim_stats[f"Expectations_{name}_final"] = value
 
         return sim_stats
 
@@ -931,30 +1458,44 @@ class AttentionSimulation(MacroSimulation):
         if stat_history is None:
             stat_history = self.history["class_stats"]
 
-        for d, cs in enumerate(self.history["class_stats"]):
+        # the DataFrames of the history are built on each read
+        stat_history = list(stat_history)
+
+        for d, cs in enumerate(stat_history):
             cs["time"] = d
 
-        data = pd.concat(self.history["class_stats"])
+        data = pd.concat(stat_history)
 
         ax = sns.lineplot(data=data, x="time", y="aLvl_mean", hue="label")
         ax.set_title("mean aLvl by class subpopulation")
 
+    def expectations_stats(self):
+        """
+        The mean and standard deviation of the agents' current expectations.
+        """
+        RiskyAvg_all_agents = self.pop.state.RiskyAvg[self.pop.agent_starts]
+        RiskyStd_all_agents = self.pop.state.RiskyStd[self.pop.agent_starts]
+
+        return {
+            "RiskyAvg_mean": np.mean(RiskyAvg_all_agents),
+            "RiskyAvg_std": np.std(RiskyAvg_all_agents),
+            "RiskyStd_mean": np.mean(RiskyStd_all_agents),
+            "RiskyStd_std": np.std(RiskyStd_all_agents),
+        }
+
     def track(self, day, time_delta=0):
         """
         Tracks the current state of agent's total assets and owned shares
         """
+        if not self.tracks():
+            return
+
         super().track(
             day,
             time_delta
         )
 
-        RiskyAvg_all_agents = np.array([agent.parameters['RiskyAvg'] for agent in self.pop.agents])
-        RiskyStd_all_agents = np.array([agent.parameters['RiskyStd'] for agent in self.pop.agents])
-
-        self.history["RiskyAvg_mean"].append(np.mean(RiskyAvg_all_agents))
-        self.history["RiskyAvg_std"].append(np.std(RiskyAvg_all_agents))
-        self.history["RiskyStd_mean"].append(np.mean(RiskyStd_all_agents))
-        self.history["RiskyStd_std"].append(np.std(RiskyStd_all_agents))
+        self.history.record(**self.expectations_stats())
 
 class CalibrationSimulation(MarketSimulation):
     """
@@ -970,6 +1511,7 @@ class CalibrationSimulation(MarketSimulation):
 
         self.history["run_times"] = []
 
+    @counts_events
     def simulate(self, start=True, buy_sell_shock=(0, 0), burn_in=0):
         """
         Workhorse method that runs the simulation.
@@ -1003,7 +1545,7 @@ class CalibrationSimulation(MarketSimulation):
             self.end_day = day
 
         except MarketFailureError as e:
-            print("Ending simulation")
+            events.emit("market_failure", "error", day=day, message=str(e))
             self.end_time = datetime.now()
             self.end_day = day
             self.error_message = str(e)
@@ -1031,7 +1573,7 @@ class CalibrationSimulation(MarketSimulation):
             + [bs[0] for bs in self.broker.buy_sell_history][self.burn_in_val :],
             "sell": [None]
             + [bs[1] for bs in self.broker.buy_sell_history][self.burn_in_val :],
-            "ror": [None] + self.market.ror_list()[self.burn_in_val :],
+            "ror": np.concatenate(([np.nan], self.market.ror_list()[self.burn_in_val :])),
             "market_times": self.history["run_times"],
         }
 
@@ -1062,6 +1604,7 @@ class SeriesSimulation(MarketSimulation):
 
         self.history["run_times"] = []
 
+    @counts_events
     def simulate(self, start=True, series=[(0, 0)], burn_in=0):
         """
         Workhorse method that runs the simulation.
@@ -1075,21 +1618,36 @@ class SeriesSimulation(MarketSimulation):
 
         day = burn_in if burn_in is not None else 0
 
-        for order in series:
-            day_start_time = datetime.now()
+        if self.market.batched:
+            # the whole series is run in one batch,
+            # and each day is tracked with an equal share of its time
+            start_time = datetime.now()
 
-            buy = order[0]
-            sell = -order[1]
+            self.broker.trade_batch(series)
 
-            self.broker.transact(np.array((buy, sell)))
-            buy_sell, ror, price, dividend = self.broker.trade()
+            time_delta = (datetime.now() - start_time) / max(len(series), 1)
 
-            day_end_time = datetime.now()
-            time_delta = day_end_time - day_start_time
+            for order in series:
+                self.track(day + 1, time_delta=time_delta)
 
-            self.track(day + 1, time_delta=time_delta)
+                day = day + 1
+
+        else:
+            for order in series:
+                day_start_time = datetime.now()
+
+                buy = order[0]
+                sell = -order[1]
+
+                self.broker.transact(np.array((buy, sell)))
+                buy_sell, ror, price, dividend = self.broker.trade()
+
+                day_end_time = datetime.now()
+                time_delta = day_end_time - day_start_time
+
+                self.track(day + 1, time_delta=time_delta)
 
-            day = day + 1
+                day = day + 1
 
         self.broker.close()
 
@@ -1119,7 +1677,7 @@ class SeriesSimulation(MarketSimulation):
             + [bs[0] for bs in self.broker.buy_sell_history][self.burn_in_val :],
             "sell": [None]
             + [bs[1] for bs in self.broker.buy_sell_history][self.burn_in_val :],
-            "ror": [None] + self.market.ror_list()[self.burn_in_val :],
+            "ror": np.concatenate(([np.nan], self.market.ror_list()[self.burn_in_val :])),
             "market_times": self.history["run_times"],
         }
 
@@ -0,0 +1,218 @@
+"""
+A persistent, on-disk cache of the solutions of agent types.
+
+Solving a SequentialPortfolioConsumerType is the most expensive part of
+building a population. A sweep of simulations often builds many
+populations sharing the same agent types, so their solutions are worth
+keeping between runs.
+
+Solutions are stored in a directory, one compressed .npz file per agent
+type, named by a hash of the parameters that the solution depends on.
+Only the policy functions the simulations use are stored:
+cFuncAdj, ShareFuncAdj and SequentialShareFuncAdj.
+
+Solutions that cannot be cached, because their policy functions are not
+LinearInterps or their parameters cannot be hashed, are left out with a
+'solution_not_cached' warning event.
+"""
+
+import hashlib
+import json
+import os
+
+import HARK
+import numpy as np
+from HARK.ConsumptionSaving.ConsPortfolioModel import PortfolioSolution
+from HARK.interpolation import LinearInterp
+
+from sharkfin.events import events
+
+# The policy functions that are stored.
+CACHED_FUNCTIONS = ["cFuncAdj", "ShareFuncAdj", "SequentialShareFuncAdj"]
+
+# Parameters that only affect the simulation of an agent, not its solution.
+SIMULATION_PARAMETERS = [
+    "AgentCount",
+    "aNrmInitMean",
+    "aNrmInitStd",
+    "pLvlInitMean",
+    "pLvlInitStd",
+    "PermGroFacAgg",
+    "NewbornTransShk",
+    "sim_common_Rrisky",
+    "T_age",
+    "T_sim",
+    "ex_post",
+    "seed",
+]
+
+
+def _limit(array):
+    """
+    Reads back an extrapolation limit, with the shape it was stored with.
+    """
+    return array.item() if array.ndim == 0 else array
+
+
+def _canonical(value):
+    """
+    Converts the numpy values among an agent's parameters
+    to the python values they are equal to, for json.
+    """
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    elif isinstance(value, np.generic):
+        return value.item()
+
+    raise TypeError(f"Cannot hash parameter value {value!r}")
+
+
+def solution_key(agent_type, parameters):
+    """
+    A hash of the parameters that the solution of an agent depends on.
+
+    Parameters
+    ----------
+
+    agent_type: class - the AgentType subclass
+
+    parameters: dict - the parameters of the agent
+
+    Returns
+    -------
+
+    A hexadecimal string.
+    """
+    relevant = {
+        k: v for k, v in parameters.items() if k not in SIMULATION_PARAMETERS
+    }
+
+    description = json.dumps(
+        {
+            "agent_type": agent_type.__module__ + "." + agent_type.__name__,
+            "HARK": HARK.__version__,
+            "parameters": relevant,
+        },
+        sort_keys=True,
+        default=_canonical,
+    )
+
+    return hashlib.sha256(description.encode("utf-8")).hexdigest()
+
+
+class SolutionCache:
+    """
+    A directory of cached agent type solutions.
+
+    Parameters
+    ----------
+
+    directory: str - where the solutions are stored. Created if needed.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def load(self, agent):
+        """
+        Gives an agent its cached solution, if there is one.
+
+        The agent's solution will have only the CACHED_FUNCTIONS.
+
+        Returns
+        -------
+
+        True if the agent's solution was found in the cache.
+        """
+        try:
+            path = self.path(solution_key(type(agent), agent.parameters))
+        except TypeError:
+            # not cached, which store() reports
+            self.misses += 1
+            return False
+
+        if not os.path.exists(path):
+            self.misses += 1
+            return False
+
+        with np.load(path) as arrays:
+            functions = {}
+
+            for name in CACHED_FUNCTIONS:
+                limits = {}
+
+                if name + "_intercept_limit" in arrays:
+                    limits["intercept_limit"] = _limit(arrays[name + "_intercept_limit"])
+                    limits["slope_limit"] = _limit(arrays[name + "_slope_limit"])
+
+                functions[name] = LinearInterp(
+                    arrays[name + "_x"],
+                    arrays[name + "_y"],
+                    lower_extrap=bool(arrays[name + "_lower_extrap"]),
+                    **limits,
+                )
+
+        solution = PortfolioSolution(
+            cFuncAdj=functions["cFuncAdj"], ShareFuncAdj=functions["ShareFuncAdj"]
+        )
+        solution.SequentialShareFuncAdj = functions["SequentialShareFuncAdj"]
+
+        agent.solution = [solution]
+
+        self.hits += 1
+        return True
+
+    def store(self, agent):
+        """
+        Stores the solution of a solved agent, if it can be cached.
+
+        Returns
+        -------
+
+        True if the solution was stored.
+        """
+        try:
+            path = self.path(solution_key(type(agent), agent.parameters))
+        except TypeError as e:
+            events.emit("solution_not_cached", "warning", reason=str(e))
+            return False
+
+        solution = agent.solution[0]
+        arrays = {}
+
+        for name in CACHED_FUNCTIONS:
+            function = getattr(solution, name)
+
+            if not isinstance(function, LinearInterp):
+                events.emit(
+                    "solution_not_cached",
+                    "warning",
+                    reason=f"Only LinearInterp solutions can be cached. {name} is a {type(function)}",
+                )
+                return False
+
+            arrays[name + "_x"] = function.x_list
+            arrays[name + "_y"] = function.y_list
+            arrays[name + "_lower_extrap"] = function.lower_extrap
+
+            # the limits of extrapolation are only set if they were given
+            if hasattr(function, "intercept_limit"):
+                arrays[name + "_intercept_limit"] = function.intercept_limit
+                arrays[name + "_slope_limit"] = function.slope_limit
+
+        # written to a temporary file first, so a cached solution is never partial
+        temp_path = f"{path}.{os.getpid()}.tmp"
+
+        with open(temp_path, "wb") as f:
+            np.savez_compressed(f, **arrays)
+
+        os.replace(temp_path, path)
+
+        return True
@@ -0,0 +1,208 @@
+"""
+Writing the output of a simulation to disk while it runs.
+
+A StreamWriter takes chunks of tables, as DataFrames, and writes them
+from a background thread, so the simulation does not wait on the disk.
+Each table is written as it grows, in a form that can be appended to:
+
+- parquet: a directory, {path}_{table}.parquet, with one file per chunk.
+  Each file is complete once written, so the chunks written before a
+  failure can still be read. Requires pyarrow.
+
+- csv: a file, {path}_{table}.csv, appended to with each chunk.
+
+read_stream() reads a table back as one DataFrame, in either form.
+"""
+
+import glob
+import os
+import queue
+import threading
+
+import pandas as pd
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+STREAM_FORMATS = ["parquet", "csv"]
+
+
+def default_stream_format():
+    """
+    Parquet if pyarrow is installed, otherwise CSV.
+    """
+    return "csv" if pyarrow is None else "parquet"
+
+
+def stream_path(path, table, format):
+    """
+    The file, or directory, a table is written to.
+    """
+    return f"{path}_{table}.{format}"
+
+
+class StreamWriter:
+    """
+    Writes chunks of tables to disk from a background thread.
+    See the module documentation.
+
+    Chunks are written in the order they are given. An error in the
+    background thread is raised on the next call to write, flush or close.
+
+    Parameters
+    ----------
+
+    path: str - the prefix of the files written
+
+    format: str - one of STREAM_FORMATS. Defaults to default_stream_format().
+
+    max_chunks: int - the number of chunks waiting to be written, at most.
+        Once it is reached, write waits for the disk, so the memory
+        taken by chunks not yet written is bounded.
+    """
+
+    def __init__(self, path, format=None, max_chunks=4):
+        if format is None:
+            format = default_stream_format()
+
+        if format not in STREAM_FORMATS:
+            raise ValueError(f"Unknown stream format {format}. Options: {STREAM_FORMATS}")
+
+        if format == "parquet" and pyarrow is None:
+            raise ImportError("Writing parquet streams requires pyarrow.")
+
+        self.path = path
+        self.format = format
+
+        # the number of chunks written so far, for each table
+        self.chunks = {}
+
+        self.error = None
+        self.closed = False
+
+        self.queue = queue.Queue(maxsize=max_chunks)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def tables(self):
+        """
+        The names of the tables written so far.
+        """
+        return list(self.chunks)
+
+    def write(self, table, frame):
+        """
+        Queues a chunk of a table to be written.
+
+        Parameters
+        ----------
+
+        table: str - the name of the table
+
+        frame: pandas.DataFrame - the chunk. It should not be changed afterwards.
+        """
+        if self.closed:
+            raise ValueError("Cannot write to a closed StreamWriter.")
+
+        self._raise_error()
+
+        self.queue.put((table, frame))
+
+    def flush(self):
+        """
+        Waits until every chunk queued so far has been written.
+        """
+        self.queue.join()
+        self._raise_error()
+
+    def close(self):
+        """
+        Writes the chunks still queued, and stops the background thread.
+        """
+        if not self.closed:
+            self.closed = True
+            self.queue.put(None)
+            self.thread.join()
+
+        self._raise_error()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+
+            try:
+                if item is None:
+                    return
+
+                # after an error, the following chunks are dropped
+                if self.error is None:
+                    self._write_chunk(*item)
+
+            except Exception as e:
+                self.error = e
+
+            finally:
+                self.queue.task_done()
+
+    def _write_chunk(self, table, frame):
+        chunk = self.chunks.get(table, 0)
+        target = stream_path(self.path, table, self.format)
+
+        if self.format == "parquet":
+            if chunk == 0:
+                os.makedirs(target, exist_ok=True)
+
+                # chunks left by an earlier run to the same path
+                for old in glob.glob(os.path.join(target, "part-*.parquet")):
+                    os.remove(old)
+
+            part = os.path.join(target, f"part-{chunk:05d}.parquet")
+
+            # renamed once complete, so a failure leaves no partial file
+            frame.to_parquet(part + ".tmp", index=False)
+            os.replace(part + ".tmp", part)
+
+        else:
+            with open(target, "w" if chunk == 0 else "a", newline="") as f:
+                frame.to_csv(f, header=chunk == 0, index=False)
+                f.flush()
+                os.fsync(f.fileno())
+
+        self.chunks[table] = chunk + 1
+
+
+def read_stream(path, table, format=None):
+    """
+    Reads a table written by a StreamWriter, as one DataFrame.
+
+    If format is None, it is found from the files on disk.
+    """
+    if format is None:
+        for f in STREAM_FORMATS:
+            if os.path.exists(stream_path(path, table, f)):
+                format = f
+                break
+        else:
+            raise FileNotFoundError(f"No stream of {table} at {path}.")
+
+    target = stream_path(path, table, format)
+
+    if format == "csv":
+        return pd.read_csv(target)
+
+    parts = sorted(glob.glob(os.path.join(target, "part-*.parquet")))
+
+    return pd.concat([pd.read_parquet(part) for part in parts], ignore_index=True)
@@ -0,0 +1,138 @@
+import asyncio
+import json
+import unittest
+
+import numpy as np
+
+from sharkfin.events import events
+from sharkfin.markets.ammps_async import (
+    AsyncClientRPCMarket,
+    AsyncRPCClient,
+    simulate_concurrently,
+)
+from sharkfin.simulation import MarketSimulation
+
+
+class FakeRPCClient(AsyncRPCClient):
+    """
+    An AsyncRPCClient without a broker: each request is answered
+    by a market whose price goes up by one each day.
+    """
+
+    def __init__(self):
+        self.host = "localhost"
+        self.futures = {}
+        self.requests = []
+        self.prices = {}
+
+    async def connect(self):
+        self.loop = asyncio.get_running_loop()
+
+        return self
+
+    async def close(self):
+        pass
+
+    async def publish(self, queue_name, body, content_type=None, correlation_id=None):
+        self.requests.append((queue_name, json.loads(body)))
+
+        if correlation_id is None:
+            return
+
+        price = self.prices.get(queue_name, 100) + 1
+        self.prices[queue_name] = price
+
+        self.loop.call_soon(
+            self.futures[correlation_id].set_result,
+            (json.dumps({"ClosingPrice": price, "DailyRange": 1.0}), "application/json"),
+        )
+
+
+class WarningMarket(AsyncClientRPCMarket):
+    """
+    A market that warns a given number of times each day.
+    """
+
+    def __init__(self, client, warnings=0, **kwargs):
+        self.warnings = warnings
+
+        super().__init__(client, **kwargs)
+
+    def run_market(self, *args, **kwargs):
+        for warning in range(self.warnings):
+            events.emit("test_market_warning", "warning")
+
+        return super().run_market(*args, **kwargs)
+
+
+class TestAsyncRPCMarket(unittest.TestCase):
+    def test_simulate_concurrently(self):
+        async def main():
+            async with FakeRPCClient() as client:
+                simulations = [
+                    MarketSimulation(
+                        q=1,
+                        r=5,
+                        days_per_quarter=5,
+                        market=AsyncClientRPCMarket(
+                            client,
+                            queue_name=f"rpc_queue_{i}",
+                            rng=np.random.default_rng(i),
+                        ),
+                    )
+                    for i in range(3)
+                ]
+
+                await simulate_concurrently(simulations)
+
+                return client, simulations
+
+        client, simulations = asyncio.run(main())
+
+        for i, sim in enumerate(simulations):
+            # each market has its own queue and prices
+            np.testing.assert_array_equal(sim.market.prices[1:], 101 + np.arange(5))
+
+            requests = [data for queue, data in client.requests if queue == f"rpc_queue_{i}"]
+
+            assert len(requests) == 6
+            assert requests[-1]["end_simulation"]
+
+    def test_event_counts(self):
+        async def main():
+            async with FakeRPCClient() as client:
+                simulations = [
+                    MarketSimulation(
+                        q=1,
+                        r=5,
+                        days_per_quarter=5,
+                        market=WarningMarket(
+                            client,
+                            warnings=i,
+                            queue_name=f"rpc_queue_{i}",
+                            rng=np.random.default_rng(i),
+                        ),
+                    )
+                    for i in range(3)
+                ]
+
+                await simulate_concurrently(simulations)
+
+                return simulations
+
+        simulations = asyncio.run(main())
+
+        # each simulation counts only the warnings of its own market
+        for i, sim in enumerate(simulations):
+            assert sim.event_counts["test_market_warning"] == 5 * i
+            assert sim.sim_stats().get("test_market_warning_count", 0) == 5 * i
+
+    def test_run_on_event_loop(self):
+        async def main():
+            async with FakeRPCClient() as client:
+                market = AsyncClientRPCMarket(client, queue_name="rpc_queue")
+
+                market.run_market()
+
+        with self.assertRaises(RuntimeError):
+            asyncio.run(main())
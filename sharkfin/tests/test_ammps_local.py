@@ -0,0 +1,120 @@
+import unittest
+
+import numpy as np
+
+from sharkfin.markets.ammps import ClientRPCMarket, MarketFailureError, MarketTimeoutError
+from sharkfin.markets.ammps_local import (
+    LocalAMMPS,
+    LocalAMMPSServer,
+    QueueTransport,
+    SocketTransport,
+    msgpack,
+)
+from sharkfin.simulation import CalibrationSimulation, SeriesSimulation
+
+
+def local_market(**kwargs):
+    market_args = {
+        key: kwargs.pop(key)
+        for key in ["batched", "encoding", "timeout", "poll_interval"]
+        if key in kwargs
+    }
+
+    return ClientRPCMarket(
+        rng=np.random.default_rng(0),
+        transport=QueueTransport(LocalAMMPS(**kwargs)),
+        **market_args,
+    )
+
+
+class TestLocalAMMPS(unittest.TestCase):
+    def test_price_impact(self):
+        market = local_market(price_to_dividend_ratio=60 / 0.05, impact_decay=0)
+
+        price, dividend = market.run_market(buy_sell=(0, 0))
+
+        self.assertAlmostEqual(price, dividend * 60 / 0.05)
+
+        price, dividend = market.run_market(buy_sell=(10000, 0))
+
+        assert price > dividend * 60 / 0.05
+        assert len(market.prices) == len(market.dividends) == len(market.ranges) + 1 == 3
+
+        market.close_market()
+
+    def test_series(self):
+        market = local_market(batched=True)
+
+        sim = SeriesSimulation(market=market)
+        sim.simulate(series=[(10, 0)] * 20 + [(0, 10)] * 20, burn_in=30)
+
+        # one round trip for the burn-in, one for the series, and one to end
+        assert market.transport.market.requests == 3
+        assert market.transport.market.ended
+
+        assert len(market.prices) == 71
+        assert not np.isnan(market.prices).any()
+
+        data = sim.daily_data()
+
+        assert len(data) == 41
+
+    @unittest.skipIf(msgpack is None, "requires msgpack")
+    def test_msgpack(self):
+        market = local_market(batched=True, encoding="msgpack")
+
+        prices, dividends = market.run_market_batch([(0, 0)] * 10)
+
+        np.testing.assert_allclose(prices, dividends * 60 / 0.05)
+
+    def test_market_failure(self):
+        market = local_market(price_range=(1.0, 200.0), impact_decay=0)
+
+        sim = CalibrationSimulation(market=market)
+        sim.simulate(buy_sell_shock=(10**6, 0), burn_in=5)
+
+        assert sim.error_message.startswith("AMMPS Market Failure: Stopped")
+        assert sim.sim_stats()["status_code"] == "1"
+        assert np.isnan(market.prices[-1])
+
+    def test_final_day(self):
+        market = local_market(batched=True, max_days=10)
+
+        with self.assertRaises(MarketFailureError):
+            market.run_market_batch([(0, 0)] * 20)
+
+        # the ten days run are kept
+        assert len(market.prices) == len(market.dividends) == 12
+        assert not np.isnan(market.prices[:11]).any()
+
+    def test_timeout(self):
+        market = local_market(respond_days=3, timeout=0.1, poll_interval=0.02)
+
+        for day in range(3):
+            market.run_market()
+
+        with self.assertRaises(MarketTimeoutError):
+            market.run_market()
+
+        assert np.isnan(market.prices[-1])
+
+    def test_socket(self):
+        with LocalAMMPSServer(price_to_dividend_ratio=60 / 0.05) as server:
+            server.serve_in_thread()
+
+            try:
+                market = ClientRPCMarket(
+                    rng=np.random.default_rng(0),
+                    transport=SocketTransport(*server.server_address),
+                    batched=True,
+                )
+
+                market.run_market()
+                prices, dividends = market.run_market_batch([(0, 0)] * 10)
+
+                np.testing.assert_allclose(prices, dividends * 60 / 0.05)
+                assert len(market.prices) == 12
+
+                market.close_market()
+            finally:
+                server.shutdown()
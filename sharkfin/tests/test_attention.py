@@ -0,0 +1,44 @@
+import numpy as np
+
+from sharkfin.attention import AttentionLog
+
+
+def test_attention_log():
+    """
+    The log gives each agent its days in the order they were recorded,
+    including repeated days, across reads and checkpoints.
+    """
+    rng = np.random.default_rng(0)
+
+    n_agents = 50
+    log = AttentionLog(n_agents, capacity=4)
+    expected = [[] for _ in range(n_agents)]
+
+    for day in range(100):
+        # agents may attend more than once on a day
+        attending = rng.choice(n_agents, rng.integers(0, 10))
+
+        log.record(attending, day)
+
+        for i in attending:
+            expected[i].append(day)
+
+        if day % 7 == 0:
+            assert [list(d) for d in log.agent_days(range(n_agents))] == expected
+
+    assert len(log) == sum(len(d) for d in expected)
+    assert list(log.days(3)) == expected[3]
+    assert log.nbytes > 0
+
+    checkpoint = log.checkpoint()
+
+    log.record([0, 1], 100)
+
+    restored = AttentionLog(n_agents)
+    restored.restore(checkpoint)
+
+    assert [list(d) for d in restored.agent_days(range(n_agents))] == expected
+
+    log.restore(checkpoint)
+
+    assert list(log.days(0)) == expected[0]
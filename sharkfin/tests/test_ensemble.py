@@ -0,0 +1,150 @@
+from dataclasses import fields
+
+import numpy as np
+from HARK.ConsumptionSaving.ConsPortfolioModel import SequentialPortfolioConsumerType
+
+from sharkfin.ensemble import fork_map, fork_simulations
+from sharkfin.expectations import FinanceModel
+from sharkfin.markets import MockMarket
+from sharkfin.population import PopulationState
+from sharkfin.simulation import AttentionSimulation, MarketSimulation
+from simulate.parameters import (
+    LUCAS0,
+    build_population,
+    instantiate_population,
+    solve_population,
+)
+from simulate.run_any_simulation import run_attention_simulation
+
+
+def test_fork_simulations():
+    """
+    Forks an ensemble of market simulations from one burn-in.
+    """
+    sim = MarketSimulation(
+        q=1, r=10, market=MockMarket(rng=np.random.default_rng(2)), days_per_quarter=10
+    )
+
+    results = fork_simulations(
+        sim, [{"seed": 1}, {"seed": 2}, {"seed": 1}], burn_in=5, processes=2
+    )
+
+    prices = [result["daily_data"]["prices"] for result in results]
+
+    assert len(results) == 3
+    assert all(len(p) == 10 for p in prices)
+
+    assert prices[0].equals(prices[2])
+    assert not prices[0].equals(prices[1])
+
+    # the parent is left at the end of its burn-in
+    assert len(sim.market.prices) == 6
+
+
+def simulate_prices(sim):
+    sim.simulate(start=False)
+
+    return {
+        "prices": np.array(sim.market.prices[:]),
+        "expected_ror": list(sim.fm.expected_ror_list),
+        "fm_timed": sim.fm.timer is sim.timer,
+    }
+
+
+def test_fork_attention_simulations():
+    """
+    Forks an ensemble of attention simulations, with different seeds and
+    expectations, from one burn-in. They share the history before the fork.
+    """
+    pop = build_population(SequentialPortfolioConsumerType, LUCAS0, seed=1)
+
+    sim = AttentionSimulation(
+        pop,
+        FinanceModel,
+        a=0.2,
+        q=1,
+        r=10,
+        market=MockMarket(rng=np.random.default_rng(2)),
+        days_per_quarter=10,
+        fm_args={},
+    )
+
+    results = fork_simulations(
+        sim,
+        [
+            {"seed": 1, "fm_args": {"p1": 0.1, "p2": 0.1}},
+            {"seed": 2, "fm_args": {"p1": 0.5, "p2": 0.5}},
+        ],
+        run=simulate_prices,
+        burn_in=5,
+        processes=2,
+    )
+
+    first, second = [result["prices"] for result in results]
+
+    assert len(first) == len(second) == 16
+
+    # the burn-in, before the fork, is shared
+    np.testing.assert_array_equal(first[:6], second[:6])
+    assert not np.array_equal(first[6:], second[6:])
+
+    # the expectations models replaced by the scenarios are still timed
+    assert all(result["fm_timed"] for result in results)
+
+
+def run_lucas0(seed, solved_pop=None):
+    rng = np.random.default_rng(seed)
+
+    data, sim_stats, history, class_stats = run_attention_simulation(
+        LUCAS0,
+        a=0.2,
+        q=1,
+        r=60,
+        market=MockMarket(rng=rng),
+        fm=FinanceModel,
+        rng=rng,
+        pad=5,
+        seed=seed,
+        solved_pop=solved_pop,
+    )
+
+    return data
+
+
+def test_solve_seed():
+    """
+    The seed a population is solved with does not change the population
+    instantiated from it: that depends only on the seed it is
+    instantiated with, as build_population gives it.
+    """
+    parameter_dict = LUCAS0.copy()
+    parameter_dict["num_per_type"] = 5
+
+    built = build_population(SequentialPortfolioConsumerType, parameter_dict, seed=3)
+
+    for solve_seed in [None, 0, 3]:
+        pop = instantiate_population(
+            solve_population(SequentialPortfolioConsumerType, parameter_dict, seed=solve_seed),
+            seed=3,
+        )
+
+        for field in fields(PopulationState):
+            np.testing.assert_array_equal(
+                getattr(pop.state, field.name), getattr(built.state, field.name)
+            )
+
+
+def test_ensemble_member_matches_single_run():
+    """
+    A member of an ensemble of seeds, run from a population solved once,
+    matches a simulation run alone with its seed, which builds its
+    population with build_population.
+    """
+    solved_pop = solve_population(SequentialPortfolioConsumerType, LUCAS0)
+
+    members = fork_map(
+        lambda seed: run_lucas0(seed, solved_pop=solved_pop), [3, 4], processes=2
+    )
+
+    assert members[0].equals(run_lucas0(3))
+    assert not members[0].equals(members[1])
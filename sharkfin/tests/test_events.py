@@ -0,0 +1,87 @@
+import io
+import json
+import threading
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from sharkfin.events import EventLog, JSONLinesSink, events
+from sharkfin.markets import MockMarket
+
+
+def test_event_log():
+    """
+    Every event is counted, and those at or above the level
+    are written to the sinks.
+    """
+    log = EventLog(level="warning")
+
+    # with no sinks, events are only counted
+    log.emit("market_run", "debug", price=100.0)
+    assert not log.enabled("error")
+
+    out = io.StringIO()
+    sink = JSONLinesSink(out)
+    log.add_sink(sink)
+
+    snapshot = log.snapshot()
+
+    log.emit("market_run", "debug", price=101.0)
+    log.emit("risky_share_clipped_to_1", "warning", RiskyAvg=np.array([1.1, 1.2]))
+    log.emit("risky_share_clipped_to_1", "warning", RiskyAvg=np.array([1.3]))
+
+    assert log.counts["market_run"] == 2
+    assert log.counts_since(snapshot) == {"market_run": 1, "risky_share_clipped_to_1": 2}
+    assert log.counts_since(snapshot, "warning") == {"risky_share_clipped_to_1": 2}
+
+    log.remove_sink(sink)
+
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+
+    assert [line["event"] for line in lines] == ["risky_share_clipped_to_1"] * 2
+    assert lines[0]["level"] == "warning"
+    assert lines[0]["RiskyAvg"] == [1.1, 1.2]
+
+    with pytest.raises(ValueError):
+        log.set_level("verbose")
+
+
+def test_market_events():
+    """
+    The mock market reports each day as an event, not on stdout.
+    """
+    market = MockMarket()
+    snapshot = events.snapshot()
+
+    market.run_market()
+    market.run_market()
+
+    assert events.counts_since(snapshot)["market_run"] == 2
+
+
+def test_event_counts_across_threads():
+    """
+    Events emitted from several threads are all counted, and each
+    thread's counting() block counts only that thread's events.
+    """
+    log = EventLog()
+    thread_counts = [Counter() for thread in range(4)]
+
+    def emit_events(counts):
+        with log.counting(counts):
+            for i in range(1000):
+                log.emit("agent_update", "debug")
+
+    threads = [threading.Thread(target=emit_events, args=(c,)) for c in thread_counts]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    log.emit("agent_update", "debug")
+
+    assert log.counts["agent_update"] == 4001
+    assert all(counts["agent_update"] == 1000 for counts in thread_counts)
@@ -1,9 +1,15 @@
 import HARK.ConsumptionSaving.ConsIndShockModel as cism
-from sharkfin.expectations import FinanceModel, InferentialExpectations, UsualExpectations
+from sharkfin.expectations import (
+    FinanceModel,
+    InferentialExpectations,
+    UsualExpectations,
+    scipy_stats_lognorm_from_mean_std,
+)
 from sharkfin.markets import MockMarket
 
 import numpy as np
 import unittest
+from scipy.stats import ks_1samp
 
 class TestFinanceModel(unittest.TestCase):
 
@@ -42,6 +48,34 @@ class TestFinanceModel(unittest.TestCase):
         assert len(estd1) != len(estd2)
         assert a != b
 
+    def test_FinanceModel_memory(self):
+        """
+        The running statistics give the same expectations
+        as weighting the whole history of returns.
+        """
+        fm = FinanceModel(MockMarket(rng = np.random.default_rng(5)), days_per_quarter = 30)
+
+        for day in range(100):
+            fm.market.run_market()
+            fm.calculate_risky_expectations()
+
+        ror = np.array(fm.market.ror_list())
+        s = np.exp(fm.b * len(ror))
+        w = (1 - s) * np.exp(fm.a * np.arange(1, len(ror) + 1))
+        w = w / w.sum() * (1 - s)
+
+        expected_ror = s * fm.sp500_ror + np.sum(w * ror)
+        expected_std = np.sqrt(s * fm.sp500_std ** 2 + np.sum(w * (ror - expected_ror) ** 2))
+
+        self.assertAlmostEqual(fm.expected_ror_list[-1], expected_ror, places = 12)
+        self.assertAlmostEqual(fm.expected_std_list[-1], expected_std, places = 12)
+
+        # restored expectations recompute their statistics from the market
+        fm.restore(fm.checkpoint())
+        fm.calculate_risky_expectations()
+
+        self.assertAlmostEqual(fm.expected_ror_list[-1], expected_ror, places = 12)
+
 class TestUsualExpectations(unittest.TestCase):
     def test_UsualExpectations(self):
         fm = UsualExpectations(MockMarket(), days_per_quarter = 30)
@@ -127,4 +161,42 @@ class TestInferentialExpectations(unittest.TestCase):
         u_3 = usual_fm.risky_expectations()
 
         assert usual['RiskyAvg'] == u_3['RiskyAvg']
-        assert usual['RiskyStd'] == u_3['RiskyStd']
\ No newline at end of file
+        assert usual['RiskyStd'] == u_3['RiskyStd']
+
+    def test_attention_risky_expectations(self):
+        """
+        The batched Kolmogorov-Smirnov decisions match scipy's ks_1samp,
+        agent by agent.
+        """
+        rng = np.random.default_rng(seed = 20230424)
+        fm = InferentialExpectations(MockMarket(rng = rng), days_per_quarter = 30)
+        fm.zeta = 0.35
+
+        for _ in range(40):
+            fm.market.run_market()
+            fm.calculate_risky_expectations()
+
+        assert len(fm.usual_cdf) == len(fm.market.ror_list())
+
+        # including an agent with no observations, and repeated days
+        attention_days = [[], [0, 0, 1]] + [
+            list(rng.choice(40, rng.integers(1, 20))) for _ in range(20)
+        ]
+
+        observed = np.asarray(fm.market.ror_list()) + 1
+        usual_dist = scipy_stats_lognorm_from_mean_std(1 + fm.daily_ror, fm.daily_std)
+
+        expected = [False] + [
+            ks_1samp(observed[days], usual_dist.cdf).pvalue < fm.zeta
+            for days in attention_days[1:]
+        ]
+
+        assert np.array_equal(fm.strange_attention(attention_days), expected)
+
+        expectations = fm.attention_risky_expectations(attention_days)
+
+        for days, avg in zip(attention_days, expectations['RiskyAvg']):
+            agent = cism.IndShockConsumerType()
+            agent.assign_parameters(**{'attention_days' : days})
+
+            assert fm.risky_expectations(agent)['RiskyAvg'] == avg
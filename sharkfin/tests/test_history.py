@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from sharkfin.history import HistoryRecorder, TrackingPolicy
+
+
+def test_history_recorder():
+    """
+    The recorder reads like a dict of daily lists, grows past the days
+    it was allocated for, builds frames only when read, and restores
+    from a checkpoint.
+    """
+    built = []
+
+    def build(means, stds):
+        built.append(means)
+        return pd.DataFrame({"mean": means, "std": stds})
+
+    history = HistoryRecorder(["total_assets", "unused"], days=2)
+    history.add_frame("class_stats", build)
+    history.add_metrics(["RiskyAvg_mean"])
+
+    for day in range(5):
+        history.record(total_assets=day * 10.0, RiskyAvg_mean=1.0 + day)
+        history.record_frame("class_stats", np.arange(3.0) + day, np.ones(3))
+
+    assert list(history) == ["total_assets", "unused", "class_stats", "RiskyAvg_mean"]
+    assert np.array_equal(history["total_assets"], [0, 10, 20, 30, 40])
+    assert len(history["unused"]) == 0
+    assert len(history["class_stats"]) == 5
+    assert built == []
+
+    assert history["class_stats"][-1]["mean"].tolist() == [4, 5, 6]
+    assert len(built) == 1
+
+    checkpoint = history.checkpoint()
+    history.record(total_assets=50.0)
+
+    restored = HistoryRecorder(["total_assets", "unused"], days=2)
+    restored.add_frame("class_stats", build)
+    restored.add_metrics(["RiskyAvg_mean"])
+    restored.restore(checkpoint)
+
+    assert np.array_equal(restored["total_assets"], [0, 10, 20, 30, 40])
+    assert np.array_equal(restored["RiskyAvg_mean"], history["RiskyAvg_mean"])
+    assert restored["class_stats"][2].equals(history["class_stats"][2])
+
+    history_df = pd.DataFrame({k: pd.Series(v) for k, v in restored.items()})
+    assert len(history_df) == 5
+
+
+def test_tracking_policy():
+    """
+    A policy tracks the state before the first day, every k days
+    and the ends of quarters, and counts at most the days it tracks.
+    """
+    policy = TrackingPolicy("class", every=4)
+
+    tracked = [day for day in range(-1, 20) if policy.tracks(day, 10)]
+
+    assert tracked == [-1, 0, 4, 8, 9, 12, 16, 19]
+    assert policy.tracked_days(20, 10) >= len(tracked)
+
+    assert policy.includes("aggregate")
+    assert policy.includes("class")
+    assert not policy.includes("agent")
+
+    assert not TrackingPolicy("none").tracks(-1, 10)
+    assert not TrackingPolicy("aggregate", every=4, quarter_end=False).tracks(9, 10)
+
+    with pytest.raises(ValueError):
+        TrackingPolicy("daily")
+
+    with pytest.raises(ValueError):
+        TrackingPolicy(every=0)
@@ -1,6 +1,14 @@
 from sharkfin.markets import MockMarket
-from sharkfin.markets.ammps import ClientRPCMarket
+from sharkfin.markets.ammps import (
+    ClientRPCMarket,
+    MarketFailureError,
+    MarketTimeoutError,
+    Message,
+)
+from sharkfin.simulation import MarketSimulation
 from sharkfin.utilities import price_dividend_ratio_random_walk
+import json
+import time
 import unittest
 
 
@@ -8,6 +16,39 @@ import numpy as np
 
 class TestMockMarket(unittest.TestCase):
 
+    def test_series(self):
+
+        market = MockMarket(rng = np.random.default_rng(3))
+
+        for day in range(100):
+            market.run_market()
+
+        prices = list(market.prices)
+        dividends = list(market.dividends)
+
+        ror_list = market.ror_list()
+
+        assert len(market.prices) == 101
+        assert not ror_list.flags.writeable
+        np.testing.assert_allclose(
+            ror_list,
+            [(prices[i + 1] + dividends[i + 1]) / prices[i] - 1 for i in range(100)]
+        )
+        np.testing.assert_allclose(market.log_return_list(), np.log(ror_list + 1))
+        np.testing.assert_allclose(market.ror_list(98), ror_list[98:])
+
+        # changing a price changes the returns around it
+        market.prices[50] = np.nan
+
+        assert np.isnan(market.ror_list()[49])
+        assert np.isnan(market.ror_list()[50])
+        assert not np.isnan(market.ror_list()[51])
+
+        # restoring the market restores its returns
+        market.restore(market.checkpoint())
+
+        assert len(market.ror_list()) == 100
+
     def test_mock(self):
 
         market = MockMarket(dividend_growth_rate = 0.000628, dividend_std = 0.011988)
@@ -31,6 +72,23 @@ class TestMockMarket(unittest.TestCase):
 
         assert market.ror_list()[2] == (market.prices[3] + market.dividends[3]) / market.prices[2] - 1
 
+    def test_mock_path(self):
+
+        market = MockMarket(rng = np.random.default_rng(5))
+        path_market = MockMarket(rng = np.random.default_rng(5))
+
+        for day in range(20):
+            market.run_market()
+
+        prices, dividends = path_market.run_market_path(20)
+
+        assert len(path_market.prices) == len(market.prices) == 21
+        assert len(path_market.ranges) == 20
+
+        np.testing.assert_allclose(prices, market.prices[1:])
+        np.testing.assert_allclose(dividends, market.dividends[1:])
+        np.testing.assert_allclose(path_market.ror_list(), market.ror_list())
+
 class TestRPCMarket(unittest.TestCase):
 
     def test_rpc_market(self):
@@ -42,6 +100,136 @@ class TestRPCMarket(unittest.TestCase):
             print(e)
 
 
+class FakeTransport:
+    """
+    Stands in for the transport of a ClientRPCMarket.
+    Responds to each request after `delay` calls to receive,
+    or never if delay is None. A batched request is answered with a price
+    for each day, up to `stop_after` days, when the market stops,
+    even if it ran every day of the request.
+    """
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.stop_after = None
+        self.time_limits = []
+        self.requests = []
+
+    def receive(self, time_limit=None):
+        self.time_limits.append(time_limit)
+
+        if self.delay is None or len(self.time_limits) <= self.delay:
+            return None
+
+        correlation_id, request = self.requests[-1]
+
+        if "days" in request:
+            n_days = len(request["days"])
+
+            if self.stop_after is not None:
+                n_days = min(n_days, self.stop_after)
+
+            response = {
+                "ClosingPrice": list(101.0 + np.arange(n_days)),
+                "DailyRange": [1.0] * n_days,
+            }
+
+            if self.stop_after is not None and len(request["days"]) >= self.stop_after:
+                response["MarketState"] = "Stopped: Hit market maker price range"
+        else:
+            response = {"ClosingPrice": 101.0, "DailyRange": 1.0}
+
+        return Message(correlation_id, json.dumps(response), "application/json")
+
+    def send(self, queue_name, body, content_type=None, correlation_id=None):
+        self.requests.append((correlation_id, json.loads(body)))
+
+    def close(self):
+        pass
+
+
+def fake_rpc_market(**kwargs):
+    return ClientRPCMarket(
+        rng=np.random.default_rng(0), transport=FakeTransport(), **kwargs
+    )
+
+
+class TestRPCResponses(unittest.TestCase):
+
+    def test_response_without_sleeping(self):
+        market = fake_rpc_market(timeout=5, poll_interval=2)
+
+        start = time.monotonic()
+        price, dividend = market.run_market()
+
+        assert time.monotonic() - start < 1
+        assert price == 101.0
+        assert market.transport.time_limits[0] <= 2
+
+    def test_timeout(self):
+        market = fake_rpc_market(timeout=0.05, poll_interval=0.01)
+        # the market never responds
+        market.transport.delay = None
+
+        with self.assertRaises(MarketTimeoutError):
+            market.run_market()
+
+        assert np.isnan(market.prices[-1])
+        assert all(limit <= 0.01 for limit in market.transport.time_limits)
+
+    def test_batched_burn_in(self):
+        market = fake_rpc_market(batched=True)
+
+        sim = MarketSimulation(q=1, r=1, days_per_quarter=1, market=market)
+        sim.start_simulation(burn_in=30)
+
+        # the burn-in is one round trip
+        assert len(market.transport.requests) == 1
+        assert len(market.transport.requests[0][1]["days"]) == 30
+
+        assert len(market.prices) == len(market.dividends) == 31
+        assert len(sim.broker.buy_sell_history) == 30
+        np.testing.assert_array_equal(market.prices[1:], 101.0 + np.arange(30))
+        np.testing.assert_array_equal(
+            [day["dividend"] for day in market.transport.requests[0][1]["days"]],
+            market.dividends[1:],
+        )
+
+    def test_batch_failure(self):
+        market = fake_rpc_market(batched=True)
+        market.transport.stop_after = 10
+
+        with self.assertRaises(MarketFailureError):
+            market.run_market_batch([(0, 0)] * 30)
+
+        # the days run before the market stopped are kept
+        assert len(market.prices) == len(market.dividends) == 12
+        assert np.isnan(market.prices[-1])
+        assert market.prices[10] == 110.0
+
+    def test_batch_failure_after_every_day(self):
+        market = fake_rpc_market(batched=True)
+        market.transport.stop_after = 10
+
+        with self.assertRaises(MarketFailureError):
+            market.run_market_batch([(0, 0)] * 10)
+
+        # every day of the batch ran, so no day is missing
+        assert len(market.prices) == len(market.dividends) == len(market.ranges) + 1 == 11
+        assert not np.isnan(market.prices).any()
+        assert len(market.ror_list()) == 10
+
+    def test_batch_timeout(self):
+        market = fake_rpc_market(batched=True, timeout=0.05, poll_interval=0.01)
+        market.transport.delay = None
+
+        with self.assertRaises(MarketTimeoutError):
+            market.run_market_batch([(0, 0)] * 10)
+
+        assert len(market.prices) == len(market.dividends) == 2
+        assert np.isnan(market.prices[-1])
+
+
 class TestMarketErrors(unittest.TestCase):
 
     def test_stopped_market(self):
@@ -0,0 +1,152 @@
+import numpy as np
+from HARK.interpolation import BilinearInterpOnInterp1D, LinearInterp
+
+from sharkfin.policy import PolicySlices, TabulatedPolicy
+
+
+def merged_functions(y_grid, z_grid, scale):
+    return [
+        [
+            LinearInterp(
+                np.linspace(0, 10, 5 + i + j),
+                scale * (y + z) * np.sqrt(np.linspace(0, 10, 5 + i + j)),
+            )
+            for j, z in enumerate(z_grid)
+        ]
+        for i, y in enumerate(y_grid)
+    ]
+
+
+def test_tabulated_policy():
+    """
+    A tabulated policy matches the merged HARK interpolator it replaces,
+    for several classes at once.
+    """
+    rng = np.random.default_rng(0)
+
+    y_grid = np.array([0.9, 1.0, 1.2])
+    z_grid = np.array([0.05, 0.1, 0.2, 0.3])
+
+    functions = [
+        merged_functions(y_grid, z_grid, 1),
+        merged_functions(y_grid, z_grid, 2),
+    ]
+    merged = [BilinearInterpOnInterp1D(f, y_grid, z_grid) for f in functions]
+
+    policy = TabulatedPolicy(functions, [y_grid, z_grid])
+
+    n = 100
+    class_id = rng.integers(0, 2, n)
+    x = rng.uniform(0, 10, n)
+    # including expectations outside of the grid, which are extrapolated
+    y = rng.uniform(0.8, 1.3, n)
+    z = rng.uniform(0, 0.4, n)
+
+    expected = np.array([merged[c](x[i], y[i], z[i]) for i, c in enumerate(class_id)])
+
+    assert np.all(policy.in_range(class_id, x))
+    assert np.allclose(policy(class_id, x, y, z), expected)
+    assert not policy.in_range([0], np.array([11.0]))[0]
+
+
+def test_policy_slices():
+    """
+    Agents sharing their class and expectations are evaluated from one
+    cached slice of the policy.
+    """
+    y_grid = np.array([0.9, 1.0, 1.2])
+    z_grid = np.array([0.05, 0.1, 0.2, 0.3])
+
+    policy = TabulatedPolicy(
+        [merged_functions(y_grid, z_grid, 1), merged_functions(y_grid, z_grid, 2)],
+        [y_grid, z_grid],
+    )
+    slices = PolicySlices(policy, maxsize=2)
+
+    x = np.linspace(0, 10, 20)
+    class_id = np.arange(20) % 2
+    y = np.full(20, 1.05)
+    z = np.full(20, 0.15)
+
+    assert np.allclose(slices(class_id, x, y, z), policy(class_id, x, y, z))
+    assert slices.misses == 2 and slices.hits == 0
+
+    assert np.allclose(slices(class_id, x, y, z), policy(class_id, x, y, z))
+    assert slices.misses == 2 and slices.hits == 2
+
+    # the least recently used slices are dropped
+    slices(class_id, x, y + 0.1, z)
+    assert len(slices.slices) == 2
+    assert slices.misses == 4
+
+
+def test_tabulated_policy_keeps_knots():
+    """
+    A tabulated policy keeps every knot of its functions, so it matches
+    them between their knots, however many there are. A smaller asset
+    grid must be asked for, and its error is reported.
+    """
+    y_grid = np.array([0.9, 1.0])
+    z_grid = np.array([0.1])
+
+    knots = np.linspace(0, 10, 2000) ** 2 / 10
+    functions = [[[LinearInterp(knots, y * np.sqrt(knots))] for y in y_grid]]
+
+    policy = TabulatedPolicy(functions, [y_grid, z_grid])
+
+    assert len(policy.x_grid) == len(knots)
+    assert policy.max_error == 0.0
+
+    # a grid finer than the knots
+    x = np.linspace(0, 10, 10001)
+    class_id = np.zeros(len(x), dtype=int)
+
+    for i, y in enumerate(y_grid):
+        np.testing.assert_allclose(
+            policy(class_id, x, np.full(len(x), y), np.full(len(x), 0.1)),
+            functions[0][i][0](x),
+        )
+
+    thinned = TabulatedPolicy(functions, [y_grid, z_grid], max_points=100)
+
+    assert len(thinned.x_grid) == 100
+    assert thinned.max_error > 0
+
+
+def test_tabulated_policy_class_ranges():
+    """
+    Each class is tabulated only within the knots of its own functions.
+    Outside them, where the table holds the class's extrapolation,
+    its assets are out of range.
+    """
+    y_grid = np.array([1.0])
+    z_grid = np.array([0.1])
+
+    wide = LinearInterp(np.linspace(0, 10, 11), np.sqrt(np.linspace(0, 10, 11)))
+    # not extrapolated below its knots, and extrapolated non-linearly above them
+    narrow = LinearInterp(
+        np.linspace(1, 5, 9),
+        0.5 * np.linspace(1, 5, 9),
+        lower_extrap=False,
+        intercept_limit=3.0,
+        slope_limit=0.0,
+    )
+
+    policy = TabulatedPolicy([[[wide]], [[narrow]]], [y_grid, z_grid])
+
+    x = np.linspace(0, 10, 1001)
+    y = np.full(len(x), 1.0)
+    z = np.full(len(x), 0.1)
+
+    for class_id, function in enumerate([wide, narrow]):
+        classes = np.full(len(x), class_id)
+        inside = policy.in_range(classes, x)
+
+        np.testing.assert_allclose(policy(classes, x, y, z)[inside], function(x[inside]))
+
+        # with the class's own function outside of its range, as the population does
+        values = np.where(inside, policy(classes, x, y, z), function(x))
+        np.testing.assert_allclose(values, function(x))
+
+    assert np.all(policy.in_range(np.zeros(len(x), dtype=int), x))
+    assert policy.in_range(np.ones(len(x), dtype=int), x).tolist() == list((1 <= x) & (x <= 5))
@@ -1,8 +1,11 @@
 import numpy as np
+import pytest
 from HARK.ConsumptionSaving.ConsPortfolioModel import SequentialPortfolioConsumerType
+from HARK.distribution import DiscreteDistribution, Uniform
 
+from sharkfin.events import events
 from sharkfin.population import SharkPopulation, SharkPopulationSolution
-from simulate.parameters import LUCAS0, WHITESHARK
+from simulate.parameters import LUCAS0, WHITESHARK, build_population
 
 
 def test_lucas_agent_population():
@@ -36,6 +39,32 @@ def test_lucas_agent_population():
     # initialize population model
     pop.init_simulation()
 
+    # the population state holds one row per simulated agent
+    assert len(pop.state) == sum(agent.AgentCount for agent in pop.agents)
+
+    delta = pop.attend(
+        np.arange(len(pop.agents)), 100, {"RiskyAvg": 1.01, "RiskyStd": 0.1}, day=0
+    )
+
+    assert np.allclose(pop.state.shares, delta)
+    assert np.all(pop.state.RiskyAvg == 1.01)
+
+    # agents are bucketed by macro day and updated together
+    pop.assign_macro_days(np.zeros(len(pop.agents), dtype=int))
+
+    macro_agents = pop.macro_day_agents(0)
+    rows = pop.agent_rows(macro_agents)
+
+    assert len(macro_agents) == len(pop.agents)
+    assert len(pop.macro_day_agents(1)) == 0
+
+    delta = pop.macro_update(macro_agents, 100)
+
+    assert len(delta) == len(rows)
+    assert np.all(delta <= 0)
+    assert np.all(pop.state.t_age[rows] == 1)
+    assert np.allclose(pop.state.aLvl[rows], pop.state.aNrm[rows] * pop.state.pLvl[rows])
+
     return pop
 
 '''
@@ -154,3 +183,151 @@ def test_random_seeds():
         pop.agent_database["agents"].map(lambda a: a.history["pLvl"][100][0]).std()
         > 0.00000001
     )
+
+
+def test_parallel_solve():
+    parameter_dict = LUCAS0.copy()
+    parameter_dict["CRRA"] = Uniform(bot=4, top=6)
+    parameter_dict["approx_params"] = {"CRRA": 2}
+    # a coarse grid, for speed
+    parameter_dict["aXtraCount"] = 20
+
+    def solved_population(processes):
+        pop = SharkPopulation(
+            SequentialPortfolioConsumerType,
+            parameter_dict,
+            dollars_per_hark_money_unit=1500,
+        )
+
+        pop.approx_distributions(parameter_dict["approx_params"])
+        pop.create_distributed_agents()
+        pop.create_database()
+        pop.solve(merge_by=parameter_dict["ex_post"], processes=processes)
+
+        return pop
+
+    serial = solved_population(None)
+    parallel = solved_population(2)
+
+    mNrm = np.linspace(0.1, 100, 50)
+
+    for agent, parallel_agent in zip(serial.agents, parallel.agents):
+        assert np.array_equal(
+            agent.solution[0].cFuncAdj(mNrm), parallel_agent.solution[0].cFuncAdj(mNrm)
+        )
+        assert np.array_equal(
+            agent.solution[0].ShareFuncAdj(mNrm),
+            parallel_agent.solution[0].ShareFuncAdj(mNrm),
+        )
+
+
+def test_macro_update_warnings():
+    """
+    A macro update leaving agents with negative assets, or a risky share
+    above 1, is counted as an event rather than stopping the simulation.
+    """
+    parameter_dict = LUCAS0.copy()
+    parameter_dict["num_per_type"] = 5
+
+    pop = build_population(SequentialPortfolioConsumerType, parameter_dict, seed=0)
+
+    evaluate_policy = pop.evaluate_policy
+
+    def bad_policy(name, x, rows):
+        if name == "cFuncAdj":
+            # consuming more than the market resources
+            return x + 1.0
+
+        return evaluate_policy(name, x, rows) + 2.0
+
+    pop.evaluate_policy = bad_policy
+
+    snapshot = events.snapshot()
+
+    pop.macro_update(np.arange(len(pop.agents)), 100.0)
+
+    counts = events.counts_since(snapshot, "error")
+
+    assert counts["negative_assets_after_macro_update"] == 1
+    assert counts["share_above_1_after_macro_update"] == 1
+
+
+def test_tabulated_policies():
+    """
+    The tabulated policies match the consumption and risky share
+    functions of each solution class between their knots.
+    """
+    parameter_dict = LUCAS0.copy()
+    parameter_dict["num_per_type"] = 5
+
+    pop = build_population(SequentialPortfolioConsumerType, parameter_dict, seed=0)
+
+    for name in ["cFuncAdj", "ShareFuncAdj"]:
+        table = pop.policy_tables[name]
+
+        # every agent, on a grid finer than the knots, within the table
+        x = np.linspace(table.x_grid[0], table.x_grid[-1], 4 * len(table.x_grid))
+        rows = np.repeat(np.arange(len(pop.state)), len(x))
+        mNrm = np.tile(x, len(pop.state))
+
+        np.testing.assert_allclose(
+            pop.evaluate_policy(name, mNrm, rows),
+            pop._evaluate_class_policies(
+                name,
+                mNrm,
+                pop.state.class_id[rows],
+                pop.state.RiskyAvg[rows],
+                pop.state.RiskyStd[rows],
+            ),
+            rtol=1e-10,
+            atol=1e-12,
+        )
+
+
+def test_macro_period_matches_hark():
+    """
+    The batched macro period moves each agent as HARK's own simulation
+    of one period does, given the same shocks.
+    """
+    parameter_dict = LUCAS0.copy()
+    parameter_dict["num_per_type"] = 3
+
+    pop = build_population(SequentialPortfolioConsumerType, parameter_dict, seed=0)
+
+    for agent in pop.agents:
+        # no deaths, and one known income shock, so both draw the same
+        agent.LivPrb = [1.0]
+        agent.IncShkDstn = [
+            DiscreteDistribution(np.array([1.0]), np.array([[0.97], [1.1]]))
+        ]
+        # with no risky share, the risky return drawn by HARK does not matter
+        agent.controls["Share"][:] = 0.0
+
+    pop.state.Share[:] = 0.0
+
+    pop.simulate_macro_period(np.arange(len(pop.state)))
+
+    for i, agent in enumerate(pop.agents):
+        agent.simulate(sim_periods=1)
+
+        rows = pop.agent_rows([i])
+
+        np.testing.assert_allclose(pop.state.pLvl[rows], agent.state_now["pLvl"])
+        np.testing.assert_allclose(pop.state.mNrm[rows], agent.state_now["mNrm"])
+        np.testing.assert_allclose(pop.state.cNrm[rows], agent.controls["cNrm"])
+        np.testing.assert_allclose(pop.state.Share[rows], agent.controls["Share"])
+        np.testing.assert_allclose(pop.state.aNrm[rows], agent.state_now["aNrm"])
+
+
+def test_macro_period_single_cycle():
+    """
+    Agents whose parameters vary over their cycle are not supported.
+    """
+    parameter_dict = LUCAS0.copy()
+    parameter_dict["num_per_type"] = 1
+
+    pop = build_population(SequentialPortfolioConsumerType, parameter_dict, seed=0)
+    pop.agents[0].T_cycle = 2
+
+    with pytest.raises(ValueError):
+        pop.pack_state()
@@ -6,6 +6,7 @@ from sharkfin.broker import *
 from sharkfin.expectations import *
 from sharkfin.population import *
 from sharkfin.simulation import *
+from sharkfin.streaming import StreamWriter, read_stream
 from simulate.parameters import LUCAS0, WHITESHARK, build_population
 
 ## MARKET SIMULATIONS
@@ -30,6 +31,34 @@ def test_market_simulation():
     assert len(data["prices"]) == 60
 
 
+def test_market_simulation_checkpoint(tmp_path):
+    """
+    Resumes a MarketSimulation from a checkpoint
+    and checks that it continues identically.
+    """
+    path = tmp_path / "checkpoint.pkl"
+
+    sim = MarketSimulation(
+        q=2, r=10, market=MockMarket(rng=np.random.default_rng(3)), days_per_quarter=10
+    )
+    sim.checkpoint_path = path
+    sim.checkpoint_every = 15
+    sim.simulate(burn_in=2)
+
+    resumed = MarketSimulation(
+        q=2, r=10, market=MockMarket(rng=np.random.default_rng(4)), days_per_quarter=10
+    )
+    resumed.load_checkpoint(path)
+
+    assert resumed.clock["quarter"] == 1
+    assert resumed.clock["run"] == 5
+
+    resumed.simulate()
+
+    assert sim.daily_data().equals(resumed.daily_data())
+    assert resumed.end_day == sim.end_day
+
+
 def test_calibration_simulation():
     """
     Sets up and runs an agent population simulation
@@ -196,6 +225,30 @@ def test_attention_simulation():
     assert ror_mean_1 == approx(ror_mean_2)
 '''
 
+def test_attention_calendar():
+    """
+    Samples attention calendars and checks their rate and reproducibility.
+    """
+    days = 60
+
+    calendar = AttentionCalendar(np.random.default_rng(1), 1000, 0.05, days)
+    same_calendar = AttentionCalendar(np.random.default_rng(1), 1000, 0.05, days)
+
+    attending = [calendar.attending(day) for day in range(days)]
+
+    for day in range(days):
+        assert np.array_equal(attending[day], same_calendar.attending(day))
+        assert len(np.unique(attending[day])) == len(attending[day])
+
+    assert sum(len(a) for a in attending) / (1000 * days) == approx(0.05, rel=0.1)
+
+    none = AttentionCalendar(np.random.default_rng(1), 10, 0, days)
+    every = AttentionCalendar(np.random.default_rng(1), 10, 1, days)
+
+    assert len(none.attending(0)) == 0
+    assert np.array_equal(every.attending(days - 1), np.arange(10))
+
+
 def test_lucas0_simulation():
     """
     Sets up and runs an simulation with an agent population.
@@ -242,3 +295,130 @@ def test_lucas0_simulation():
     data = attsim.daily_data()
 
     assert len(data["prices"]) == 30
+
+
+def test_tracking_simulation():
+    """
+    Runs a simulation that tracks only aggregate metrics, every few days.
+    """
+    pop = build_population(
+        SequentialPortfolioConsumerType,
+        LUCAS0,
+        seed=1,
+    )
+
+    days_per_quarter = 12
+
+    sim = AttentionSimulation(
+        pop,
+        FinanceModel,
+        a=0.2,
+        q=1,
+        r=1,
+        market=None,
+        days_per_quarter=days_per_quarter,
+        fm_args={},
+        tracking=TrackingPolicy("aggregate", every=5),
+    )
+    sim.simulate(burn_in=2)
+
+    assert "class_stats" not in sim.history
+    assert "total_pop_stats" not in sim.history
+
+    # before the first day, days 0, 5 and 10, and the end of the quarter
+    assert list(sim.history["t"]) == [-1, 0, 5, 10, 11]
+
+    data = sim.daily_data()
+
+    assert len(data["prices"]) == days_per_quarter
+    assert data["total_assets"].notna().tolist() == [
+        day in (0, 5, 10, 11) for day in range(days_per_quarter)
+    ]
+
+    assert sim.tracking.level == "aggregate"
+
+    # the time of each phase of the simulation
+    assert sim.timer.calls["trade"] == 1
+    assert sim.timer.calls["track"] == days_per_quarter
+    assert sim.timer.counts["policy_evaluations"] > 0
+    assert "mNrm_ratio_StE_mean" in sim.pop.class_stats()
+
+
+def test_tracked_days():
+    """
+    With several days in each run, every day is tracked once,
+    by its day in the simulation.
+    """
+    for simulation_class in [MacroSimulation, AttentionSimulation]:
+        pop = build_population(
+            SequentialPortfolioConsumerType,
+            LUCAS0,
+            seed=1,
+        )
+
+        kwargs = {"a": 0.2} if simulation_class is AttentionSimulation else {}
+
+        sim = simulation_class(
+            pop,
+            FinanceModel,
+            q=2,
+            r=5,
+            market=None,
+            days_per_quarter=10,
+            fm_args={},
+            tracking="aggregate",
+            **kwargs,
+        )
+        sim.simulate(burn_in=2)
+
+        assert sim.days_per_run == 2
+
+        t = np.array(sim.history["t"])
+
+        assert len(np.unique(t)) == len(t)
+        assert t.tolist() == list(range(-1, 20))
+
+
+def test_streaming_simulation(tmp_path):
+    """
+    Runs a simulation that writes its history to disk every few days.
+    """
+    pop = build_population(
+        SequentialPortfolioConsumerType,
+        LUCAS0,
+        seed=1,
+    )
+
+    days_per_quarter = 12
+
+    sim = AttentionSimulation(
+        pop,
+        FinanceModel,
+        a=0.2,
+        q=1,
+        r=1,
+        market=None,
+        days_per_quarter=days_per_quarter,
+        fm_args={},
+        tracking="class",
+    )
+
+    path = str(tmp_path / "run")
+
+    with StreamWriter(path, format="csv") as stream:
+        sim.stream_to(stream, every=5)
+        sim.simulate(burn_in=2)
+
+    # what is left of the history is the days not yet written: none
+    assert len(sim.history["t"]) == 0
+
+    data = read_stream(path, "data")
+    history = read_stream(path, "history")
+    class_stats = read_stream(path, "history_class_stats")
+
+    assert data["t"].tolist() == list(range(days_per_quarter))
+    assert history["t"].tolist() == list(range(-1, days_per_quarter))
+    assert data["total_assets"].tolist() == approx(history["total_assets"][1:].tolist())
+
+    assert sorted(class_stats["t"].unique()) == list(range(-1, days_per_quarter))
+    assert "aLvl_mean" in class_stats
@@ -0,0 +1,92 @@
+from types import SimpleNamespace
+
+import numpy as np
+from HARK.ConsumptionSaving.ConsPortfolioModel import SequentialPortfolioConsumerType
+from HARK.distribution import Uniform
+from HARK.interpolation import ConstantFunction, LinearInterp
+
+from sharkfin.events import events
+from sharkfin.solution_cache import SolutionCache, solution_key
+from simulate.parameters import LUCAS0, solve_population
+
+
+def test_solution_cache(tmp_path):
+    parameter_dict = LUCAS0.copy()
+    parameter_dict["CRRA"] = Uniform(bot=4, top=6)
+    parameter_dict["approx_params"] = {"CRRA": 2}
+    # a coarse grid, for speed
+    parameter_dict["aXtraCount"] = 20
+
+    cache = SolutionCache(tmp_path)
+
+    solved = solve_population(SequentialPortfolioConsumerType, parameter_dict, cache=cache)
+
+    assert cache.misses == 2
+    assert len(list(tmp_path.glob("*.npz"))) == 2
+
+    cached = solve_population(SequentialPortfolioConsumerType, parameter_dict, cache=cache)
+
+    assert cache.hits == 2
+
+    mNrm = np.linspace(0.1, 100, 50)
+
+    for agent, cached_agent in zip(solved.agents, cached.agents):
+        for name in ["cFuncAdj", "ShareFuncAdj", "SequentialShareFuncAdj"]:
+            assert np.array_equal(
+                getattr(agent.solution[0], name)(mNrm),
+                getattr(cached_agent.solution[0], name)(mNrm),
+            )
+
+    # the key ignores parameters that only affect the simulation
+    parameters = solved.agents[0].parameters
+
+    assert solution_key(SequentialPortfolioConsumerType, parameters) == solution_key(
+        SequentialPortfolioConsumerType, dict(parameters, aNrmInitMean=0, AgentCount=7)
+    )
+    assert solution_key(SequentialPortfolioConsumerType, parameters) != solution_key(
+        SequentialPortfolioConsumerType, dict(parameters, CRRA=parameters["CRRA"] + 1)
+    )
+
+
+class FakeAgent:
+    def __init__(self, parameters, solution):
+        self.parameters = parameters
+        self.solution = [solution]
+
+
+def test_uncacheable_solutions(tmp_path):
+    """
+    Solutions that cannot be cached are left out with a warning,
+    rather than stopping the solve.
+    """
+    cache = SolutionCache(tmp_path)
+
+    function = LinearInterp(np.array([0.0, 1.0]), np.array([0.0, 1.0]))
+    solution = SimpleNamespace(
+        cFuncAdj=function, ShareFuncAdj=function, SequentialShareFuncAdj=function
+    )
+
+    snapshot = events.snapshot()
+
+    # a policy function that is not a LinearInterp
+    agent = FakeAgent(
+        {"CRRA": 5.0},
+        SimpleNamespace(**dict(vars(solution), ShareFuncAdj=ConstantFunction(0.5))),
+    )
+
+    assert not cache.store(agent)
+    assert not cache.load(agent)
+
+    # a parameter that cannot be hashed
+    agent = FakeAgent({"CRRA": 5.0, "IncShkDstn": object()}, solution)
+
+    assert not cache.store(agent)
+    assert not cache.load(agent)
+
+    assert events.counts_since(snapshot, "warning")["solution_not_cached"] == 2
+    assert list(tmp_path.iterdir()) == []
+
+    agent = FakeAgent({"CRRA": 5.0}, solution)
+
+    assert cache.store(agent)
+    assert cache.load(agent)
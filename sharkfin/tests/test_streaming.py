@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from sharkfin.streaming import StreamWriter, read_stream
+
+
+def test_stream_writer(tmp_path):
+    """
+    Chunks written from the background thread read back as one table,
+    and an error in the thread is raised in the caller.
+    """
+    path = str(tmp_path / "run")
+
+    with StreamWriter(path, format="csv", max_chunks=1) as stream:
+        for chunk in range(5):
+            t = np.arange(3) + 3 * chunk
+            stream.write("history", pd.DataFrame({"t": t, "total_assets": 10.0 * t}))
+
+        stream.flush()
+
+        # written before the writer is closed
+        assert len(read_stream(path, "history")) == 15
+
+    assert stream.tables() == ["history"]
+
+    history = read_stream(path, "history")
+
+    assert history["t"].tolist() == list(range(15))
+    assert history["total_assets"].tolist() == [10.0 * t for t in range(15)]
+
+    stream = StreamWriter(path, format="csv")
+    stream.write("history", None)
+
+    with pytest.raises(AttributeError):
+        stream.close()
+
+    with pytest.raises(ValueError):
+        stream.write("history", history)
+
+    with pytest.raises(ValueError):
+        StreamWriter(path, format="xlsx")
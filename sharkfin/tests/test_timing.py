@@ -0,0 +1,42 @@
+import json
+import time
+
+from sharkfin.timing import PhaseTimer
+
+
+def test_phase_timer(tmp_path):
+    """
+    Phases add up their time and calls, and are written as a Chrome trace.
+    """
+    timer = PhaseTimer()
+
+    with timer.phase("trade"):
+        time.sleep(0.01)
+
+    timer.start_trace()
+
+    for _ in range(3):
+        with timer.phase("track"):
+            pass
+
+    timer.count("ks_tests", 5)
+    timer.count("ks_tests")
+
+    stats = timer.stats()
+
+    assert stats["phase_trade_seconds"] >= 0.01
+    assert stats["phase_trade_calls"] == 1
+    assert stats["phase_track_calls"] == 3
+    assert "phase_track_cpu_seconds" in stats
+    assert stats["count_ks_tests"] == 6
+
+    path = tmp_path / "trace.json"
+    timer.write_chrome_trace(path)
+
+    with open(path) as f:
+        trace = json.load(f)
+
+    # only the phases timed since the trace started
+    assert [e["name"] for e in trace["traceEvents"]] == ["track"] * 3
+    assert all(e["ph"] == "X" and e["dur"] >= 0 for e in trace["traceEvents"])
+    assert trace["otherData"]["ks_tests"] == 6
@@ -0,0 +1,148 @@
+"""
+Timing the phases of a simulation, such as trading or updating
+expectations, and counting calls to costly operations within them,
+such as solution lookups and Kolmogorov-Smirnov tests.
+
+A PhaseTimer adds up the wall-clock and CPU time of each phase.
+It can also record every timed phase as a Chrome trace, which can be
+viewed with chrome://tracing or https://ui.perfetto.dev.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+
+
+class _Phase:
+    """
+    The context manager timing one phase.
+    """
+
+    __slots__ = ("timer", "name", "wall", "cpu")
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timer.add(
+            self.name,
+            self.wall,
+            time.perf_counter() - self.wall,
+            time.process_time() - self.cpu,
+        )
+
+
+class PhaseTimer:
+    """
+    The time spent in each phase of a simulation, and counts of calls.
+
+    Usage:
+
+        with timer.phase("trade"):
+            ...
+
+        timer.count("ks_tests", n)
+
+    Parameters
+    ----------
+
+    trace: bool - whether to record each timed phase for a Chrome trace
+    """
+
+    def __init__(self, trace=False):
+        self.wall = defaultdict(float)
+        self.cpu = defaultdict(float)
+        self.calls = Counter()
+
+        self.counts = Counter()
+
+        # the Chrome trace events, if tracing
+        self.trace_events = None
+
+        # the start of the trace, in perf_counter seconds
+        self.origin = time.perf_counter()
+
+        if trace:
+            self.start_trace()
+
+    def phase(self, name):
+        """
+        A context manager timing a phase.
+        """
+        return _Phase(self, name)
+
+    def add(self, name, start, wall, cpu):
+        """
+        Adds a timed phase, which started at start, in perf_counter seconds.
+        """
+        self.wall[name] += wall
+        self.cpu[name] += cpu
+        self.calls[name] += 1
+
+        if self.trace_events is not None:
+            self.trace_events.append(
+                {
+                    "name": name,
+                    "cat": "phase",
+                    "ph": "X",
+                    "ts": (start - self.origin) * 1e6,
+                    "dur": wall * 1e6,
+                    "pid": os.getpid(),
+                    "tid": threading.get_ident(),
+                    "args": {"cpu_ms": cpu * 1e3},
+                }
+            )
+
+    def count(self, name, n=1):
+        """
+        Counts n calls of an operation.
+        """
+        self.counts[name] += n
+
+    def start_trace(self):
+        """
+        Starts recording each timed phase for a Chrome trace.
+        """
+        if self.trace_events is None:
+            self.trace_events = []
+
+    def stats(self):
+        """
+        The time spent in each phase, the number of times it was timed,
+        and the counts of calls, as a flat dict for sim_stats.
+        """
+        stats = {}
+
+        for name in self.wall:
+            stats[f"phase_{name}_seconds"] = self.wall[name]
+            stats[f"phase_{name}_cpu_seconds"] = self.cpu[name]
+            stats[f"phase_{name}_calls"] = self.calls[name]
+
+        for name, n in self.counts.items():
+            stats[f"count_{name}"] = n
+
+        return stats
+
+    def write_chrome_trace(self, path):
+        """
+        Writes the recorded phases as a Chrome trace JSON file,
+        with the counts of calls as its metadata.
+        """
+        with open(path, "w") as f:
+            json.dump(
+                {
+                    "traceEvents": self.trace_events or [],
+                    "displayTimeUnit": "ms",
+                    "otherData": dict(self.counts),
+                },
+                f,
+            )
@@ -1,3 +1,5 @@
+from copy import deepcopy
+
 from HARK.Calibration.Income.IncomeTools import sabelhaus_song_var_profile
 from HARK.ConsumptionSaving.ConsPortfolioModel import init_portfolio
 
@@ -8,9 +10,19 @@ from xarray import DataArray
 from sharkfin.population import SharkPopulation
 
 
-def build_population(agent_type, parameters, seed=None, dphm=1500):
-    num_per_type = parameters.get("num_per_type", 1)
+def solve_population(
+    agent_type, parameters, seed=None, dphm=1500, processes=None, cache=None
+):
+    """
+    Creates and solves a population.
+
+    This is the part of building a population that does not depend on
+    the seed, so one solved population can serve simulations with
+    many seeds. See instantiate_population.
 
+    If processes is greater than 1, the agent types are solved in parallel.
+    If a SolutionCache is given, agent types found in it are not solved again.
+    """
     pop = SharkPopulation(
         agent_type, parameters, seed=seed, dollars_per_hark_money_unit=dphm
     )
@@ -19,9 +31,28 @@ def build_population(agent_type, parameters, seed=None, dphm=1500):
 
     pop.create_distributed_agents()
     pop.create_database()
-    pop.solve_distributed_agents()
 
-    pop.solve(merge_by=parameters["ex_post"])
+    pop.solve(merge_by=parameters["ex_post"], processes=processes, cache=cache)
+
+    return pop
+
+
+def instantiate_population(pop, seed=None, copy=True, num_per_type=None):
+    """
+    Makes a solved population ready for simulation with the given seed:
+    num_per_type agents are made from each agent type and initialized.
+    num_per_type defaults to the parameter of the population.
+
+    If copy is True, the solved population is left unchanged,
+    and a copy of it is instantiated.
+    """
+    if copy:
+        pop = deepcopy(pop)
+
+    pop.seed = seed
+
+    if num_per_type is None:
+        num_per_type = pop.parameters.get("num_per_type", 1)
 
     pop.explode_agents(num_per_type)
 
@@ -31,6 +62,16 @@ def build_population(agent_type, parameters, seed=None, dphm=1500):
     return pop
 
 
+def build_population(
+    agent_type, parameters, seed=None, dphm=1500, processes=None, cache=None
+):
+    pop = solve_population(
+        agent_type, parameters, seed=seed, dphm=dphm, processes=processes, cache=cache
+    )
+
+    return instantiate_population(pop, seed=seed, copy=False)
+
+
 #############################
 # WHITESHARK POPULATION
 #############################
@@ -9,7 +9,13 @@ from HARK.Calibration.Income.IncomeTools import (
 )
 from HARK.ConsumptionSaving.ConsPortfolioModel import SequentialPortfolioConsumerType
 
-from simulate.parameters import build_population, LUCAS0, WHITESHARK
+from simulate.parameters import (
+    build_population,
+    instantiate_population,
+    solve_population,
+    LUCAS0,
+    WHITESHARK,
+)
 
 import json
 from math import exp
@@ -17,6 +23,11 @@ import numpy as np
 import os
 import pandas as pd
 
+from sharkfin.ensemble import fork_map
+from sharkfin.events import EVENT_LEVELS, JSONLinesSink, PrintSink, events
+from sharkfin.history import TRACKING_LEVELS, TrackingPolicy
+from sharkfin.solution_cache import SolutionCache
+from sharkfin.streaming import STREAM_FORMATS, StreamWriter
 from sharkfin.expectations import (
     InferentialExpectations,
     FinanceModel,
@@ -24,6 +35,7 @@ from sharkfin.expectations import (
 )
 from sharkfin.markets import MockMarket
 from sharkfin.markets.ammps import ClientRPCMarket
+from sharkfin.markets.ammps_local import LocalAMMPS, QueueTransport
 from sharkfin.population import SharkPopulation
 from sharkfin.simulation import AttentionSimulation, CalibrationSimulation
 from sharkfin.utilities import (
@@ -59,8 +71,75 @@ parser.add_argument(
 
 # General simulation arguments
 parser.add_argument("-d", "--seed", help="random seed", default=0)
+parser.add_argument(
+    "--seeds",
+    help="Ensemble: range of seeds START:STOP. Runs one simulation per seed, "
+    + "sharing one solved population, and combines their output.",
+    default=None,
+)
+parser.add_argument(
+    "--processes",
+    help="Number of processes used to solve the population. "
+    + "In an ensemble, also the number of simulations to run at once, "
+    + "which defaults to the number of CPUs.",
+    default=None,
+)
+parser.add_argument(
+    "--solution_cache",
+    help="Directory of cached agent type solutions. Agent types found in it are not solved again.",
+    default=None,
+)
 parser.add_argument("--quarters", help="number of quarters", default=2)
 parser.add_argument("--days", help="days per quarter", default=60)
+parser.add_argument(
+    "--tracking",
+    help="How much of the history to record: "
+    + ", ".join(TRACKING_LEVELS)
+    + ". The history is also recorded at the end of each quarter.",
+    choices=TRACKING_LEVELS,
+    default="agent",
+)
+parser.add_argument(
+    "--track_every", help="Record the history every this many days", default=1
+)
+parser.add_argument(
+    "--stream_every",
+    help="Write the history and daily data to disk every this many days while "
+    + "the simulation runs, keeping only the days not yet written in memory. "
+    + "Not supported for ensembles of seeds.",
+    default=None,
+)
+parser.add_argument(
+    "--stream_format",
+    help="Format of the streamed output. Defaults to parquet if pyarrow is installed, else csv.",
+    choices=STREAM_FORMATS,
+    default=None,
+)
+
+# Event log
+parser.add_argument(
+    "--event_log",
+    help="Write the simulation's events, such as warnings about agents' solutions, "
+    + "to this file as JSON lines",
+    default=None,
+)
+parser.add_argument(
+    "--event_level",
+    help="The least severe events written or printed",
+    choices=list(EVENT_LEVELS),
+    default="info",
+)
+parser.add_argument(
+    "--print_events", help="Print the simulation's events", action="store_true"
+)
+parser.add_argument(
+    "--chrome_trace",
+    help="Write the timed phases of the simulation to this file as a Chrome trace "
+    + "(view with chrome://tracing or ui.perfetto.dev). "
+    + "Not written for ensembles of seeds. "
+    + "The total time of each phase is always in the sim_stats.",
+    default=None,
+)
 
 # Population parameters
 parser.add_argument(
@@ -80,7 +159,10 @@ parser.add_argument(
 # General market arguments
 # TODO market_type: MockMarket # this determines which Market class to use.
 parser.add_argument(
-    "--market", help="Market: name of Market class", default="MockMarket"
+    "--market",
+    help="Market: name of Market class. Options: MockMarket, ClientRPCMarket, "
+    "LocalAMMPS (a ClientRPCMarket with a local stand-in for AMMPS)",
+    default="MockMarket",
 )
 
 # Choose which simulation
@@ -130,6 +212,21 @@ parser.add_argument(
 parser.add_argument(
     "-r", "--rhost", help="RabbitMQ: rabbitmq server location", default="localhost"
 )
+parser.add_argument(
+    "--rpc_timeout",
+    help="RabbitMQ: seconds to wait for each market response before failing",
+    default=None,
+)
+parser.add_argument(
+    "--rpc_batch",
+    help="RabbitMQ: send days with orders known in advance, such as the burn-in, in one request",
+    action="store_true",
+)
+parser.add_argument(
+    "--rpc_encoding",
+    help="RabbitMQ: encoding of market requests. Options: json, msgpack",
+    default="json",
+)
 
 parser.add_argument(
     "--mba",
@@ -188,11 +285,26 @@ def run_attention_simulation(
     rng=None,
     pad=None,
     seed=None,
+    solved_pop=None,
+    processes=None,
+    cache=None,
+    tracking=None,
+    stream=None,
+    stream_every=30,
+    chrome_trace=None,
 ):
     # initialize population
-    pop = build_population(
-        SequentialPortfolioConsumerType, agent_parameters, seed=seed, dphm=dphm
-    )
+    if solved_pop is not None:
+        pop = instantiate_population(solved_pop, seed=seed)
+    else:
+        pop = build_population(
+            SequentialPortfolioConsumerType,
+            agent_parameters,
+            seed=seed,
+            dphm=dphm,
+            processes=processes,
+            cache=cache,
+        )
 
     sim = AttentionSimulation(
         pop,
@@ -205,10 +317,20 @@ def run_attention_simulation(
         seed=seed,
         fm_args={"p1": p1, "p2": p2, "delta_t1": d1, "delta_t2": d2, "zeta": zeta},
         broker_args={"market_broker_arg": mba},
+        tracking=tracking,
     )
 
+    if stream is not None:
+        sim.stream_to(stream, every=stream_every)
+
+    if chrome_trace is not None:
+        sim.timer.start_trace()
+
     sim.simulate(burn_in=pad)
 
+    if chrome_trace is not None:
+        sim.timer.write_chrome_trace(chrome_trace)
+
     return sim.daily_data(), sim.sim_stats(), sim.history, sim.pop.class_stats()
 
 
@@ -245,6 +367,43 @@ def run_chum_simulation(
     )  # , sim.pop.class_stats()
 
 
+def parse_seeds(seeds):
+    """
+    Parses a range of seeds, START:STOP, into a list.
+    """
+    start, stop = seeds.split(":")
+
+    return list(range(int(start), int(stop)))
+
+
+def ensemble_result(seed, data, sim_stats, history, class_stats):
+    """
+    Prepares the output of one simulation of an ensemble
+    to be combined with the others, labeled with its seed.
+    The agent objects, which cannot be sent between processes,
+    are left out of the history.
+    """
+    history = dict(history)
+
+    if "total_pop_stats" in history:
+        history["total_pop_stats"] = [
+            stats.drop(columns="agents", errors="ignore")
+            for stats in history["total_pop_stats"]
+        ]
+
+    history_df = pd.DataFrame(dict([(k, pd.Series(v)) for k, v in history.items()]))
+
+    sim_stats = dict(sim_stats)
+    sim_stats["run_seed"] = seed
+
+    return {
+        "data": data.assign(run_seed=seed) if data is not None else None,
+        "sim_stats": sim_stats,
+        "history": history_df.assign(run_seed=seed),
+        "class_stats": class_stats.assign(run_seed=seed),
+    }
+
+
 def env_param(name, default):
     return os.environ[name] if name in os.environ else default
 
@@ -282,11 +441,25 @@ if __name__ == "__main__":
 
     # General simulation arguments
     seed = int(args.seed)
+    processes = int(args.processes) if args.processes is not None else None
+    cache = (
+        SolutionCache(args.solution_cache) if args.solution_cache is not None else None
+    )
     popn = int(args.popn)
     quarters = int(args.quarters)
     days_per_quarter = int(args.days)
     runs = days_per_quarter # variable runs per quarter is an artifact of an earlier version
                             # and should be deprecated
+    tracking = TrackingPolicy(args.tracking, every=int(args.track_every))
+    stream_every = int(args.stream_every) if args.stream_every is not None else None
+
+    events.set_level(args.event_level)
+
+    if args.event_log is not None:
+        events.add_sink(JSONLinesSink(args.event_log))
+
+    if args.print_events:
+        events.add_sink(PrintSink())
 
     # General market arguments
     market_class_name = str(args.market)
@@ -319,6 +492,7 @@ if __name__ == "__main__":
     # Specific to RabbitMQ AMMPS Market
     host = args.rhost
     queue = args.queue
+    rpc_timeout = float(args.rpc_timeout) if args.rpc_timeout is not None else None
 
     # market broker arg
     # also, masters of business administration
@@ -365,35 +539,20 @@ if __name__ == "__main__":
         )
     )
 
-    # random number generator with seed
-    rng = np.random.default_rng(seed)
-
     pdr = price_dividend_ratio_random_walk(
             pop_DiscFac, pop_CRRA, dividend_growth_rate, dividend_std, days_per_quarter
         )
 
-    market_args = {
-        "dividend_growth_rate": dividend_growth_rate,
-        "dividend_std": dividend_std,
-        "rng": rng,
-        "price_to_dividend_ratio": pdr,
-    }
-
     market_class = None
 
     if market_class_name == "MockMarket":
         market_class = MockMarket
-    elif market_class_name == "ClientRPCMarket":
+    elif market_class_name in ["ClientRPCMarket", "LocalAMMPS"]:
         market_class = ClientRPCMarket
-        market_args["queue_name"] = queue
-        market_args["host"] = host
-        market_args["macro_price_field"] = macro_price_field
     else:
         print(f"{market_class_name} is not a known market class. Using MockMarket.")
         market_class = MockMarket
 
-    market = market_class(**market_args)
-
     expectations_class = None
 
     if expectations_class_name == "FinanceModel":
@@ -419,51 +578,157 @@ if __name__ == "__main__":
         parameter_dict["aNrmInitMean"] = pop_aNrmInitMean
     else:
         raise Exception(f"No valid population named! Got {population_name}. Panic!")
-    
-    bigseed = rng.integers(0, 2**31 - 1)
 
-    if args.simulation == "Attention":
-        data, sim_stats, history, class_stats = run_attention_simulation(
+    def run_seed(seed, solved_pop=None, stream=None):
+        """
+        Runs the simulation with one seed.
+        Returns its daily data, sim_stats, history and class stats.
+        """
+        # random number generator with seed
+        rng = np.random.default_rng(seed)
+
+        market_args = {
+            "dividend_growth_rate": dividend_growth_rate,
+            "dividend_std": dividend_std,
+            "rng": rng,
+            "price_to_dividend_ratio": pdr,
+        }
+
+        if market_class is ClientRPCMarket:
+            market_args["queue_name"] = queue
+            market_args["host"] = host
+            market_args["macro_price_field"] = macro_price_field
+            market_args["timeout"] = rpc_timeout
+            market_args["batched"] = args.rpc_batch
+            market_args["encoding"] = args.rpc_encoding
+
+            if market_class_name == "LocalAMMPS":
+                market_args["transport"] = QueueTransport(
+                    LocalAMMPS(price_to_dividend_ratio=pdr)
+                )
+
+        market = market_class(**market_args)
+
+        bigseed = rng.integers(0, 2**31 - 1)
+
+        if args.simulation == "Attention":
+            return run_attention_simulation(
+                parameter_dict,
+                a=attention,
+                q=quarters,
+                # days_per_quarter is current hard-coded at 60.
+                r=runs, #############ALERT###########################
+                market=market,
+                fm=expectations_class,
+                dphm=dphm,
+                p1=p1,
+                p2=p2,
+                d1=d1,
+                d2=d2,
+                zeta=zeta,
+                mba=mba,
+                rng=rng,
+                pad=pad,
+                seed=bigseed,
+                solved_pop=solved_pop,
+                processes=processes,
+                cache=cache,
+                tracking=tracking,
+                stream=stream,
+                stream_every=stream_every,
+                chrome_trace=args.chrome_trace if args.seeds is None else None,
+            )
+        elif args.simulation == "Calibration":
+            return run_chum_simulation(
+                parameter_dict,
+                a=attention,
+                q=quarters,
+                 # days_per_quarter is current hard-coded at 60.
+                r=runs, #############ALERT###########################
+                market=market,
+                dphm=dphm,
+                buy=buysize,
+                sell=sellsize,
+                pad=pad,
+                seed=bigseed,
+            )
+        else:
+            print(
+                f"No known --simulation {args.simulation}. Valid options include: Attention, Calibration"
+            )
+
+    filename = args.save_as + ("-" + args.tag if args.tag != "" else "")
+
+    def complete_sim_stats(sim_stats):
+        sim_stats["filename"] = filename
+        sim_stats["dividend_std"] = dividend_std
+        sim_stats["pop_aNrmInitMean"] = pop_aNrmInitMean
+        sim_stats["price_dividend_ratio"] = pdr
+
+        return sim_stats
+
+    if args.seeds is not None:
+        if args.simulation != "Attention":
+            raise Exception("Ensembles of seeds are only supported for the Attention simulation.")
+
+        if stream_every is not None:
+            raise Exception("Streaming is not supported for ensembles of seeds.")
+
+        seeds = parse_seeds(args.seeds)
+        # the population is solved once, for all seeds
+        solved_pop = solve_population(
+            SequentialPortfolioConsumerType,
             parameter_dict,
-            a=attention,
-            q=quarters,
-            # days_per_quarter is current hard-coded at 60.
-            r=runs, #############ALERT###########################
-            market=market,
-            fm=expectations_class,
             dphm=dphm,
-            p1=p1,
-            p2=p2,
-            d1=d1,
-            d2=d2,
-            zeta=zeta,
-            mba=mba,
-            rng=rng,
-            pad=pad,
-            seed=bigseed,
+            processes=processes,
+            cache=cache,
         )
-    elif args.simulation == "Calibration":
-        data, sim_stats, history, class_stats = run_chum_simulation(
-            parameter_dict,
-            a=attention,
-            q=quarters,
-             # days_per_quarter is current hard-coded at 60.
-            r=runs, #############ALERT###########################
-            market=market,
-            dphm=dphm,
-            buy=buysize,
-            sell=sellsize,
-            pad=pad,
-            seed=bigseed,
+
+        results = fork_map(
+            lambda seed: ensemble_result(seed, *run_seed(seed, solved_pop=solved_pop)),
+            seeds,
+            processes=processes,
         )
-    else:
-        print(
-            f"No known --simulation {args.simulation}. Valid options include: Attention, Calibration"
+
+        pd.concat([r["history"] for r in results]).to_csv(f"{filename}_history.csv")
+        pd.concat([r["class_stats"] for r in results]).to_csv(
+            f"{filename}_class_stats.csv"
         )
+        pd.concat([r["data"] for r in results]).to_csv(f"{filename}_data.csv")
 
-    history_df = pd.DataFrame(dict([(k, pd.Series(v)) for k, v in history.items()]))
+        # one line of sim_stats per seed
+        with open(f"{filename}_sim_stats.txt", "w+") as f:
+            for r in results:
+                f.write(json.dumps(complete_sim_stats(r["sim_stats"]), cls=NpEncoder))
+                f.write("\n")
 
-    filename = args.save_as + ("-" + args.tag if args.tag != "" else "")
+        print("Ending the run_any_simulation.py script")
+        sys.exit()
+
+    if stream_every is not None:
+        if args.simulation != "Attention":
+            raise Exception("Streaming is only supported for the Attention simulation.")
+
+        # the history and daily data are written as the simulation runs.
+        # Whatever was written before a failure is kept.
+        with StreamWriter(filename, format=args.stream_format) as stream:
+            data, sim_stats, history, class_stats = run_seed(seed, stream=stream)
+
+        try:
+            class_stats.to_csv(f"{filename}_class_stats.csv")
+        except:
+            print("No usable class stats")
+
+        with open(f"{filename}_sim_stats.txt", "w+") as f:
+            f.write(json.dumps(complete_sim_stats(sim_stats), cls=NpEncoder))
+
+        print(f"Streamed {', '.join(stream.tables())} to {filename}_*.{stream.format}")
+        print("Ending the run_any_simulation.py script")
+        sys.exit()
+
+    data, sim_stats, history, class_stats = run_seed(seed)
+
+    history_df = pd.DataFrame(dict([(k, pd.Series(v)) for k, v in history.items()]))
 
     try:
         history_df.to_csv(f"{filename}_history.csv")
@@ -476,11 +741,7 @@ if __name__ == "__main__":
         print("No usable class stats")
 
     with open(f"{filename}_sim_stats.txt", "w+") as f:
-        sim_stats["filename"] = filename
-        sim_stats["dividend_std"] = dividend_std
-        sim_stats["pop_aNrmInitMean"] = pop_aNrmInitMean
-        sim_stats["price_dividend_ratio"] = pdr
-        f.write(json.dumps(sim_stats, cls=NpEncoder))
+        f.write(json.dumps(complete_sim_stats(sim_stats), cls=NpEncoder))
 
     try:
         data.to_csv(f"{filename}_data.csv")